@@ -0,0 +1,89 @@
+### Fuzzy name search: trigram index vs comparing the term to every name ###
+#
+#   python benchmarks/bench_fuzzy.py --rows 1000000
+#
+# Builds fuzzy.NameIndex over the trail, park and area names of a synthetic csv, then looks
+# up --queries trail names with one or two typos (a dropped, doubled or swapped letter) and
+# reports the build time, the p50/p95/max lookup time and how often the misspelled trail
+# came back among the results. One of the same lookups is also timed with the edit
+# distance to every name, the approach the index replaces. Exits with status 1 if the p95
+# lookup is over --budget milliseconds.
+
+import argparse
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+import fuzzy
+from synthetic import write_trails_csv
+
+
+def misspell(name, rng, typos):
+    #Drop, double or swap letters at random places
+    for _ in range(typos):
+        i = int(rng.integers(1, max(2, len(name) - 2)))
+        kind = rng.integers(3)
+        if kind == 0:
+            name = name[:i] + name[i+1:]
+        elif kind == 1:
+            name = name[:i] + name[i] + name[i:]
+        else:
+            name = name[:i-1] + name[i] + name[i-1] + name[i+1:]
+    return name
+
+
+def brute_force(index, term):
+    #Edit distance from the term to every name, in chunks so the work arrays stay small
+    key = fuzzy.normalize(term)
+    best = []
+    for start in range(0, len(index.keys), 20000):
+        best.append(fuzzy.edit_distances(key, index.keys[start:start+20000]))
+    return np.argsort(np.concatenate(best), kind='stable')[:20]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the fuzzy name search')
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--budget', type=float, default=10.0, help='p95 lookup budget in milliseconds')
+    args = parser.parse_args(argv)
+
+    csv = write_trails_csv(args.rows, Path(tempfile.gettempdir()) / f'trails-{args.rows}.csv')
+    df = pd.read_csv(csv, usecols=['trail_id', 'name', 'national_park', 'city_name'])
+    trails = pd.DataFrame({'trailID': df['trail_id'], 'trailName': df['name'],
+                           'parkName': df['national_park'], 'area_name': df['city_name']})
+
+    start = time.perf_counter()
+    index = fuzzy.NameIndex(trails)
+    print(f'build: {len(index.keys)} names from {len(trails)} trails in {time.perf_counter()-start:.2f}s')
+
+    rng = np.random.default_rng(0)
+    #Without the synthetic ' #123' suffix, as a user would type the name
+    names = trails['trailName'].sample(args.queries, random_state=0).str.replace(r' #\d+$', '', regex=True).tolist()
+    times, found = [], 0
+    for name in names:
+        term = misspell(name, rng, int(rng.integers(1, 3)))
+        began = time.perf_counter()
+        result = index.search(term)
+        times.append((time.perf_counter() - began) * 1000)
+        found += any(fuzzy.normalize(r).startswith(fuzzy.normalize(name)) for r in result['name'])
+    p95 = statistics.quantiles(times, n=20)[-1]
+    print(f'index: p50 {statistics.median(times):.2f}ms  p95 {p95:.2f}ms  max {max(times):.2f}ms  '
+          f'misspelled trail found {found}/{len(names)}')
+
+    began = time.perf_counter()
+    brute_force(index, misspell(names[0], rng, 1))
+    print(f'every name: {(time.perf_counter() - began) * 1000:.0f}ms per lookup')
+    if p95 > args.budget:
+        print(f'p95 over the {args.budget}ms budget')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
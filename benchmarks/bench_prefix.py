@@ -0,0 +1,66 @@
+### Name completions: prefix index vs filtering every name ###
+#
+#   python benchmarks/bench_prefix.py --rows 1000000
+#
+# Builds prefix.PrefixIndex over the trail and park names of a synthetic csv, then asks for
+# the top --limit completions of --queries prefixes (1 to 8 leading characters of random
+# trail names, as typed one key at a time) and reports the build time and the p50/p95/max
+# completion time. The same completions are also timed by filtering and sorting every name,
+# the approach the index replaces. Exits with status 1 if the p95 completion is over
+# --budget microseconds.
+
+import argparse
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+import prefix
+from synthetic import write_trails_csv
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the name completions')
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--limit', type=int, default=10)
+    parser.add_argument('--budget', type=float, default=200.0, help='p95 completion budget in microseconds')
+    args = parser.parse_args(argv)
+
+    csv = write_trails_csv(args.rows, Path(tempfile.gettempdir()) / f'trails-{args.rows}.csv')
+    df = pd.read_csv(csv, usecols=['trail_id', 'name', 'national_park', 'num_reviews'])
+    trails = pd.DataFrame({'trailID': df['trail_id'], 'trailName': df['name'],
+                           'parkName': df['national_park'], 'reviews': df['num_reviews']})
+
+    start = time.perf_counter()
+    index = prefix.PrefixIndex(trails, trails['parkName'].dropna().unique())
+    print(f'build: {len(index.keys)} names from {len(trails)} trails in {time.perf_counter()-start:.2f}s')
+
+    rng = np.random.default_rng(0)
+    names = trails['trailName'].sample(args.queries, random_state=0).tolist()
+    typed = [name[:int(rng.integers(1, 9))] for name in names]
+    times = []
+    for term in typed:
+        began = time.perf_counter()
+        index.complete(term, args.limit)
+        times.append((time.perf_counter() - began) * 1e6)
+    p95 = statistics.quantiles(times, n=20)[-1]
+    print(f'index: p50 {statistics.median(times):.0f}us  p95 {p95:.0f}us  max {max(times):.0f}us')
+
+    lowered = trails['trailName'].str.lower()
+    began = time.perf_counter()
+    for term in typed[:5]:
+        trails[lowered.str.startswith(term.lower())].nlargest(args.limit, 'reviews')
+    print(f'every name: {(time.perf_counter() - began) / 5 * 1e6:.0f}us per completion')
+    if p95 > args.budget:
+        print(f'p95 over the {args.budget}us budget')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+### Statistics page: rollup tables vs GROUP BY over every trail ###
+#
+#   python benchmarks/bench_rollups.py --rows 1000000
+#
+# Loads a synthetic csv into a scratch database and reads the per-park and per-state
+# statistics two ways: from ParkStats and StateStats (queries.PARK_STATISTICS and
+# STATE_STATISTICS), as the statistics page does, and with the GROUP BY over Trails, Location
+# and NationalParks they replace. Then adds and deletes --writes trails one at a time, as Add
+# Trails and Delete do, with and without the rollup triggers, to time what keeping the
+# rollups up to date adds to a write. Exits with status 1 if the rollups differ from the
+# GROUP BY, before or after the writes.
+
+import argparse
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+import database
+import queries
+from synthetic import write_trails_csv
+
+#The trails of every park / state, with the state of each trail's first Location like TrailCard
+SCOPES = {
+    'park': ('p.parkName', 'Trails t JOIN NationalParks p ON p.parkID=t.parkID', queries.PARK_STATISTICS),
+    'state': ('l.state', 'Trails t JOIN Location l ON l.rowid=(SELECT min(rowid) FROM Location WHERE trailID=t.trailID)',
+              queries.STATE_STATISTICS),
+}
+
+
+def group_by(key, joined):
+    #The same rows as the rollup table, computed from the trails
+    parts = [f"SELECT {key} AS name, 'trails' AS measure, 0 AS bucket, count(*) AS trails, 0.0 AS total \
+        FROM {joined} WHERE {key} IS NOT NULL GROUP BY 1"]
+    for measure, column in database.ROLLUP_VALUES.items():
+        parts.append(f"SELECT {key}, '{measure}', {database.rollup_bucket(measure, 't.' + column)}, count(*), total(t.{column}) \
+            FROM {joined} WHERE {key} IS NOT NULL AND {database.rollup_numeric('t.' + column)} GROUP BY 1, 3")
+    return ' UNION ALL '.join(parts)
+
+
+def timed_read(conn, sql, runs=5):
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        found = pd.read_sql_query(sql, conn)
+        times.append((time.perf_counter() - start) * 1000)
+    return found, statistics.median(times)
+
+
+def same(rollup, computed):
+    columns = ['name', 'measure', 'bucket']
+    rollup = rollup.astype({'bucket': float}).sort_values(columns).reset_index(drop=True)
+    computed = computed.astype({'bucket': float}).sort_values(columns).reset_index(drop=True)
+    return (len(rollup) == len(computed) and (rollup[columns + ['trails']] == computed[columns + ['trails']]).all().all()
+            and ((rollup['total'] - computed['total']).abs() <= 1e-6 * computed['total'].abs().clip(lower=1)).all())
+
+
+def check(conn, label):
+    ok = True
+    for scope, (key, joined, sql) in SCOPES.items():
+        rollup, rollup_ms = timed_read(conn, sql)
+        computed, group_ms = timed_read(conn, group_by(key, joined), runs=1)
+        matches = same(rollup, computed)
+        ok &= matches
+        print(f'{label} {scope:5}: rollup {len(rollup)} rows in {rollup_ms:.2f}ms, GROUP BY {group_ms:.0f}ms'
+              f'{"" if matches else "  MISMATCH"}')
+    return ok
+
+
+def time_writes(conn, writes):
+    #Add then delete trails one commit at a time; returns the median milliseconds of each
+    added, deleted = [], []
+    for i in range(writes):
+        start = time.perf_counter()
+        trail_id = conn.execute(queries.INSERT_TRAIL, (f'Rollup Trail {i}', 2.5, 600.0, 3, 'loop', 1,
+                                                       f'Rollup Trail {i}')).fetchone()[0]
+        conn.commit()
+        added.append((time.perf_counter() - start) * 1000)
+        start = time.perf_counter()
+        conn.execute(queries.DELETE_TRAIL, (trail_id,))
+        conn.commit()
+        deleted.append((time.perf_counter() - start) * 1000)
+    return statistics.median(added), statistics.median(deleted)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the statistics rollups')
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--writes', type=int, default=200)
+    args = parser.parse_args(argv)
+
+    tmp = Path(tempfile.gettempdir())
+    csv = write_trails_csv(args.rows, tmp / f'trails-{args.rows}.csv')
+    db_path = tmp / 'bench_rollups.db'
+    database.remove_database(db_path)
+    conn = database.connect(db_path)
+    database.create_tables(conn)
+    database.migrate(conn)
+    timings = {}
+    database.ingest(conn, pd.read_csv(csv, dtype=database.CSV_DTYPES), timings=timings)
+    print(f'load: {args.rows} trails in {timings["total"]:.1f}s, rollups and cards {timings["card"]:.1f}s')
+    ok = check(conn, 'after load  ')
+
+    add_ms, delete_ms = time_writes(conn, args.writes)
+    print(f'writes with rollups: add {add_ms:.2f}ms, delete {delete_ms:.2f}ms')
+    ok &= check(conn, 'after writes')
+    triggers = conn.execute("SELECT name FROM sqlite_master WHERE type='trigger' AND name LIKE '%_rollup_%'").fetchall()
+    for (name,) in triggers:
+        conn.execute(f'DROP TRIGGER {name}')
+    add_ms, delete_ms = time_writes(conn, args.writes)
+    print(f'writes without:      add {add_ms:.2f}ms, delete {delete_ms:.2f}ms')
+    conn.close()
+    database.remove_database(db_path)
+    if not ok:
+        print('rollups differ from the GROUP BY')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
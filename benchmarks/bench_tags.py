@@ -0,0 +1,76 @@
+### Features/Activities build: row loop vs vectorized explode ###
+#
+#   python benchmarks/bench_tags.py --rows 1000000
+#
+# Times building the (trailID, tag) rows for Features and Activities and bulk inserting them
+# into a scratch database, once with the old format_text + iterrows loop and once with
+# database.make_tags. Prints tag rows per second for each.
+
+import argparse
+import sqlite3
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+import database
+from synthetic import write_trails_csv
+
+
+#The original implementation, kept here as the baseline
+def format_text(text):
+    text = text[1:-1].split(', ')
+    new_string = [t.replace("'","") for t in text]
+    return new_string
+
+
+def make_tags_loop(df, source, column):
+    tags = df[['trail_id', source]].copy()
+    tags['tag_list'] = tags[source].apply(format_text)
+    new_rows = []
+    for _, row in tags.iterrows():
+        for tag in row['tag_list']:
+            new_rows.append([row['trail_id'], tag])
+    return pd.DataFrame(new_rows, columns=['trailID', column])
+
+
+def run(df, make_tags, db_path):
+    conn = sqlite3.connect(db_path)
+    database.create_tables(conn)
+    conn.execute('DELETE FROM Features')
+    conn.execute('DELETE FROM Activities')
+    start = time.perf_counter()
+    n = 0
+    with conn:
+        for source, column, table in [('features', 'feature', 'Features'), ('activities', 'activity', 'Activities')]:
+            tags = make_tags(df, source, column)
+            database.insert_rows(conn.cursor(), f'INSERT INTO {table} (trailID, {column}) VALUES (?,?)', tags)
+            n += len(tags)
+    elapsed = time.perf_counter() - start
+    conn.close()
+    return n, elapsed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the Features/Activities build')
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--skip-baseline', action='store_true', help='only time the vectorized build')
+    args = parser.parse_args(argv)
+
+    tmp = Path(tempfile.gettempdir())
+    csv = write_trails_csv(args.rows, tmp / f'trails-{args.rows}.csv')
+    df = pd.read_csv(csv)
+
+    cases = [('vectorized', database.make_tags)]
+    if not args.skip_baseline:
+        cases.insert(0, ('iterrows', make_tags_loop))
+    for name, make_tags in cases:
+        n, elapsed = run(df, make_tags, tmp / 'bench_tags.db')
+        print(f'{name:>10}: {n} tag rows from {len(df)} trails in {elapsed:.2f}s = {n/elapsed:,.0f} rows/sec')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+### Cold load of the normalized tables: csv vs sqlite vs Arrow snapshot ###
+#
+#   python benchmarks/cold_load.py --rows 1000000
+#
+# Builds a scratch database and snapshot from a synthetic csv, then times getting the
+# normalized tables into pandas three ways, each in a fresh python process so nothing is
+# cached in memory (the OS page cache stays warm for all three):
+#   csv      read_csv + the database.make_* functions
+#   sqlite   snapshot.read_tables, what the app did before there was a snapshot
+#   arrow    snapshot.load, memory-mapping the Arrow files
+
+import argparse
+import json
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import pandas as pd
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+import database
+import snapshot
+from synthetic import write_trails_csv
+
+
+def load_csv(csv, db):
+    df = pd.read_csv(csv, dtype=database.CSV_DTYPES)
+    _, parks = database.make_parks(df)
+    return [database.make_trails(df, parks), database.make_features(df),
+            database.make_activities(df), database.make_location(df), parks]
+
+
+def load_sqlite(csv, db):
+    conn = sqlite3.connect(db)
+    return snapshot.read_tables(conn)[2]
+
+
+def load_arrow(csv, db):
+    conn = sqlite3.connect(db)
+    tables = snapshot.load(conn, snapshot.snapshot_path(db))
+    if tables is None:
+        raise SystemExit('snapshot missing or stale')
+    return tables
+
+
+LOADERS = {'csv': load_csv, 'sqlite': load_sqlite, 'arrow': load_arrow}
+
+
+def build(csv, db):
+    conn = sqlite3.connect(db)
+    database.create_tables(conn)
+    database.migrate(conn)
+    database.ingest(conn, pd.read_csv(csv, dtype=database.CSV_DTYPES))
+    snapshot.write(conn, snapshot.snapshot_path(db))
+    conn.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Time loading the trail tables from csv, sqlite and Arrow')
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--json', help='also write the timings to this file')
+    parser.add_argument('--only', choices=LOADERS, help=argparse.SUPPRESS)
+    parser.add_argument('--db', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    tmp = Path(tempfile.gettempdir())
+    csv = write_trails_csv(args.rows, tmp / f'trails-{args.rows}.csv')
+    if args.only:
+        #Child process: time one loader and print the seconds
+        start = time.perf_counter()
+        LOADERS[args.only](csv, args.db)
+        print(time.perf_counter() - start)
+        return
+
+    db = tmp / f'cold_load-{args.rows}.db'
+    if not db.exists():
+        build(csv, db)
+    results = {'rows': args.rows}
+    for name in LOADERS:
+        out = subprocess.run([sys.executable, __file__, '--rows', str(args.rows), '--only', name, '--db', str(db)],
+                             check=True, capture_output=True, text=True).stdout
+        results[name] = float(out.split()[-1])
+        print(f'{name:>7}: {results[name]:.3f}s')
+    if args.json:
+        Path(args.json).write_text(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
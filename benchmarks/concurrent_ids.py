@@ -0,0 +1,120 @@
+### Concurrent "Add Trails" inserts: id collisions and allocation time ###
+#
+#   python benchmarks/concurrent_ids.py --threads 16 --inserts 50
+#
+# Loads trails-data.csv into a scratch database, then has many threads add trails through
+# repository.add_trail at the same time, as app sessions do: every insert goes through the
+# one Writer thread, and the in-memory indexes are refreshed after it. Exits with status 1
+# if two inserts got the same id or an insert went missing. Then times single inserts
+# (repository.new_trail submitted to a Writer) into a small and a 100x larger Trails table
+# to show that allocating an id does not grow with it, next to the old read-all-ids allocation.
+
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import pandas as pd
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+import database
+import profiling
+import queries
+import repository
+from synthetic import make_trails
+
+
+def load(db_path, df):
+    conn = sqlite3.connect(db_path)
+    database.create_tables(conn)
+    database.migrate(conn)
+    database.ingest(conn, df)
+    return conn
+
+
+def hammer(db_dir, threads, inserts):
+    #repository.py opens database.DB_PATH relative to the working directory
+    ids = []
+    errors = []
+    lock = threading.Lock()
+    start = threading.Barrier(threads)
+
+    def worker(n):
+        start.wait()
+        mine = []
+        try:
+            for i in range(inserts):
+                added = repository.add_trail(f'Concurrent {n}-{i}', 1.0, 100.0, 2, 'loop', 1)
+                mine.append(added[0] if added else None)
+        except Exception as e:
+            errors.append(e)
+        with lock:
+            ids.extend(mine)
+
+    cwd = os.getcwd()
+    os.chdir(db_dir)
+    try:
+        workers = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+        began = time.perf_counter()
+        for w in workers:
+            w.start()
+        for w in workers:
+            w.join()
+        return ids, errors, time.perf_counter() - began
+    finally:
+        os.chdir(cwd)
+
+
+def time_id_scan(conn, n=20):
+    #The old allocation: read every trail id, sort, take the last one + 1
+    began = time.perf_counter()
+    for _ in range(n):
+        ids = [r[0] for r in conn.execute('SELECT trailID FROM Trails')]
+        ids.sort()
+        ids[-1]+1
+    return (time.perf_counter() - began) / n * 1e6
+
+
+def time_inserts(writer, n=200):
+    began = time.perf_counter()
+    for i in range(n):
+        writer.submit(queries.INSERT_TRAIL, repository.new_trail(f'Timed {time.perf_counter_ns()}-{i}', 1.0, 100.0, 2, 'loop', 1))
+    return (time.perf_counter() - began) / n * 1e6
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Concurrent trail id allocation test')
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--inserts', type=int, default=50, help='inserts per thread')
+    args = parser.parse_args(argv)
+
+    real = pd.read_csv(ROOT / 'trails-data.csv', dtype=database.CSV_DTYPES)
+    with tempfile.TemporaryDirectory() as tmp:
+        load(Path(tmp) / database.DB_PATH, real).close()
+        ids, errors, elapsed = hammer(tmp, args.threads, args.inserts)
+        expected = args.threads * args.inserts
+        duplicates = len(ids) - len(set(ids))
+        print(f'{args.threads} threads x {args.inserts} inserts: {len(ids)} ids, {duplicates} duplicates, '
+              f'{len(errors)} errors, {expected/elapsed:,.0f} inserts/sec')
+
+        small = load(Path(tmp) / 'small.db', real)
+        large = load(Path(tmp) / 'large.db', make_trails(len(real)*100))
+        for name, conn in [('small', small), ('large', large)]:
+            n = conn.execute('SELECT COUNT(*) FROM Trails').fetchone()[0]
+            conn.commit()
+            writer = repository.Writer(Path(tmp) / f'{name}.db', profiling.QueryStats())
+            print(f'{name:>6}: {n:>7} trails, {time_inserts(writer):.0f} us per insert '
+                  f'(old id scan alone: {time_id_scan(conn):.0f} us)')
+            conn.close()
+
+    if duplicates or errors or len(ids) != expected or None in ids:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,161 @@
+### Load test: concurrent reading and writing sessions on one database ###
+#
+#   python benchmarks/load_test.py --readers 8 --writers 4 --seconds 10
+#   python benchmarks/load_test.py --rows 100000
+#
+# Loads trails-data.csv (or --rows synthetic trails) into a scratch database and runs reader
+# and writer threads, each standing for one Streamlit session, for a fixed time, twice:
+#   before   rollback journal, a connection per session, a commit per write (the old app)
+#   after    database.PRAGMAS (WAL), reads from repository.ConnectionPool, writes through
+#            repository.Writer, as the app does now
+# Readers run the key word search and detail lookups, writers queue a review and edit a
+# trail. Prints throughput, p95 latency and "database is locked" errors for each mode, and
+# exits with status 1 if the after mode had a lock error or lost a write.
+
+import argparse
+import json
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import pandas as pd
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+import database
+import profiling
+import queries
+import repository
+from synthetic import write_trails_csv
+
+
+def build(db_path, csv):
+    conn = sqlite3.connect(db_path)
+    database.create_tables(conn)
+    database.migrate(conn)
+    database.ingest(conn, pd.read_csv(csv, dtype=database.CSV_DTYPES))
+    conn.execute('PRAGMA journal_mode = DELETE')
+    trail_ids = [r[0] for r in conn.execute('SELECT trailID FROM Trails')]
+    conn.close()
+    return trail_ids
+
+
+## Sessions ##
+
+def read_once(conn, trail_ids):
+    ids = json.dumps(random.sample(trail_ids, 20))
+    match = queries.fts_prefix(random.choice(['lake', 'falls', 'ridge', 'loop']))
+    matches = [r[0] for r in conn.execute(queries.KEYWORD_MATCHES, (match,))]
+    conn.execute(queries.KEYWORD_DETAILS, (match, json.dumps(matches[:50]))).fetchall()
+    conn.execute(queries.TRAIL_ROWS_BY_ID, (ids,)).fetchall()
+
+
+def write_once(conn, trail_ids):
+    trail_id = random.choice(trail_ids)
+    conn.execute(queries.QUEUE_UPDATE, (trail_id, None, json.dumps({'action': 'delete'})))
+    conn.execute(queries.UPDATE_TRAIL, (json.dumps({'difficulty': random.randint(1, 5)}), trail_id))
+
+
+def before_mode(db_path):
+    #Every session opens its own connection with the defaults the app used to have
+    def session():
+        conn = sqlite3.connect(db_path, check_same_thread=False)
+
+        def write(ids):
+            try:
+                write_once(conn, ids)
+                conn.commit()
+            except sqlite3.OperationalError:
+                conn.rollback()
+                raise
+        return (lambda ids: read_once(conn, ids)), write
+    return session
+
+
+def after_mode(db_path):
+    pool = repository.ConnectionPool(db_path)
+    writer = repository.Writer(db_path, profiling.QueryStats())
+
+    def read(ids):
+        with pool.connection() as conn:
+            read_once(conn, ids)
+
+    def write(ids):
+        writer.submit('write', lambda conn, record: write_once(conn, ids))
+    return lambda: (read, write)
+
+
+def run(mode, readers, writers, seconds, trail_ids):
+    latencies = {'read': [], 'write': []}
+    errors = {'read': 0, 'write': 0}
+    lock = threading.Lock()
+    stop = time.perf_counter() + seconds
+    start = threading.Barrier(readers + writers)
+
+    def worker(kind):
+        read, write = mode()
+        call = read if kind == 'read' else write
+        mine, failed = [], 0
+        start.wait()
+        while time.perf_counter() < stop:
+            began = time.perf_counter()
+            try:
+                call(trail_ids)
+                mine.append(time.perf_counter() - began)
+            except sqlite3.OperationalError as e:
+                if 'locked' not in str(e):
+                    raise
+                failed += 1
+        with lock:
+            latencies[kind] += mine
+            errors[kind] += failed
+
+    threads = [threading.Thread(target=worker, args=('read',)) for _ in range(readers)]
+    threads += [threading.Thread(target=worker, args=('write',)) for _ in range(writers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    result = {}
+    for kind in ['read', 'write']:
+        done = latencies[kind]
+        p95 = statistics.quantiles(done, n=20)[-1] * 1000 if len(done) > 1 else None
+        result[kind] = {'per_sec': len(done) / seconds, 'p95_ms': p95, 'locked': errors[kind], 'done': len(done)}
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Concurrent readers and writers, before and after WAL + the writer thread')
+    parser.add_argument('--readers', type=int, default=8)
+    parser.add_argument('--writers', type=int, default=4)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--rows', type=int, default=0, help='synthetic trails instead of trails-data.csv')
+    args = parser.parse_args(argv)
+
+    csv = write_trails_csv(args.rows, Path(tempfile.gettempdir()) / f'trails-{args.rows}.csv') if args.rows else ROOT / 'trails-data.csv'
+    failed = False
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, mode in [('before', before_mode), ('after', after_mode)]:
+            db_path = Path(tmp) / f'{name}.db'
+            trail_ids = build(db_path, csv)
+            result = run(mode(db_path), args.readers, args.writers, args.seconds, trail_ids)
+            queued = sqlite3.connect(db_path).execute('SELECT COUNT(*) FROM TrailsUpdates').fetchone()[0]
+            print(f'{name:>6}: {args.readers} readers, {args.writers} writers, {args.seconds:.0f}s')
+            for kind, values in result.items():
+                p95 = f'{values["p95_ms"]:.1f}ms' if values['p95_ms'] is not None else '-'
+                print(f'        {kind:5} {values["per_sec"]:8.1f}/s  p95 {p95:>9}  {values["locked"]} locked')
+            print(f'        {queued} of {result["write"]["done"]} writes in the database')
+            if name == 'after':
+                failed = result['read']['locked'] or result['write']['locked'] or queued != result['write']['done']
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
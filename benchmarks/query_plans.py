@@ -0,0 +1,142 @@
+### Query plan check for every query in queries.py ###
+#
+#   python benchmarks/query_plans.py
+#
+# Loads trails-data.csv into a scratch database (schema + migrations), runs EXPLAIN QUERY PLAN
+# on every statement in queries.py and exits with status 1 if any of them scans a whole table,
+# or if one of the RANKED queries sorts its matches instead of reading them in rank order from
+# idx_card_rank. A query without sample parameters in SAMPLES also fails, so new queries
+# can't slip through.
+
+import itertools
+import re
+import sqlite3
+import sys
+import tempfile
+from pathlib import Path
+
+import pandas as pd
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+import database
+import queries
+
+#Parameters to explain each query with
+SAMPLES = {
+    'HOME_OVERVIEW': (),
+    'KEYWORD_MATCHES': ('"lake"*',),
+    'KEYWORD_DETAILS': ('"lake"*', '[10020048, 10236086]'),
+    'STATE_LIST': (),
+    'PARK_LIST': (),
+    'PARK_NAMES': (),
+    'NEAR_POINTS': (59.0, 61.0, -151.0, -148.0),
+    'NEAR_COUNT': (59.0, 61.0, -151.0, -148.0),
+    'NEAR_DETAILS': ('[10020048, 10236086]',),
+    'TRAIL_ROWS_BY_ID': ('[10020048, 10236086]',),
+    'FACET_FEATURES_BY_ID': ('[10020048, 10236086]',),
+    'FACET_ACTIVITIES_BY_ID': ('[10020048, 10236086]',),
+    'FACET_DETAILS': ('[10020048, 10236086]',),
+    'PARK_ID': ('Denali National Park',),
+    'INSERT_TRAIL': ('x', 1.0, 1.0, 1, 'loop', 1, 'x'),
+    'NEW_TRAIL': ('Harding Ice Field Trail',),
+    'TRAILS_BY_NAME': ('["Harding Ice Field Trail"]',),
+    'SIMILAR_TRAILS': ('Harding Ice Field Trail',),
+    'DELETE_TRAIL': (1,),
+    'UPDATE_TRAIL': ('{"trailName": "x", "length": 1.0}', 1),
+    'QUEUE_UPDATE': (1, None, '{}'),
+    'PENDING_UPDATES': (100,),
+    'UPDATES_BY_ID': ('[1, 2]',),
+    'SET_UPDATE_STATUS': ('applied', 1),
+    'PARK_STATISTICS': (),
+    'STATE_STATISTICS': (),
+    'SIMILAR_INPUT_TRAILS': (),
+    'SIMILAR_INPUT_TAGS': (),
+    'SIMILAR_STALE': (),
+    'SIMILAR_ANY': (),
+    'SIMILAR_KTH_SCORES': (10, '[10020048, 10236086]'),
+    'SIMILAR_LISTING': ('[10020048, 10236086]',),
+    'SIMILAR_CLEAR': (),
+    'SIMILAR_DELETE': ('[10020048, 10236086]',),
+    'SIMILAR_INSERT': (1, 1, 2, 0.5),
+    'SIMILAR_STALE_DONE': ('[10020048, 10236086]',),
+}
+
+#Queries that are allowed to scan a table, and why
+ALLOW_SCAN = {
+    'PARK_STATISTICS': 'the rollup rows of every park',
+    'STATE_STATISTICS': 'the rollup rows of every state',
+    'SIMILAR_INPUT_TRAILS': 'every trail, to build the similarity vectors',
+    'SIMILAR_INPUT_TAGS': 'every feature and activity, to build the similarity vectors',
+    'SIMILAR_STALE': 'every trail waiting for its similar list',
+}
+
+#Queries that return the best ranked trails, which must come off the index already in order
+RANKED = ['HOME_OVERVIEW']
+SORT = 'USE TEMP B-TREE FOR ORDER BY'
+
+#"SCAN Trails" or "SCAN t" is a full table scan; "SCAN t USING [COVERING] INDEX ..." is not
+FULL_SCAN = re.compile(r'^SCAN (\w+)$')
+
+
+def app_queries():
+    return {name: sql for name, sql in vars(queries).items() if name.isupper() and isinstance(sql, str)}
+
+
+def built_queries():
+    #Queries put together at run time: every sort/direction/cursor shape of the maintenance page
+    for sort, descending, after in itertools.product(queries.MAINTENANCE_SORTS, [False, True], [None, (1, 5), (None, 5)]):
+        for filters in [{}, {'name': 'lake', 'park_id': 3, 'difficulty': 2}]:
+            segments = queries.trails_page(sort, descending, after, **filters)
+            for i, (sql, params) in enumerate(segments):
+                label = f'trails_page({sort}, {"desc" if descending else "asc"}, {after}, {"filtered" if filters else "all"})[{i}]'
+                yield label, sql, params + [50]
+
+
+def explain(conn, sql, params):
+    return [row[3] for row in conn.execute('EXPLAIN QUERY PLAN ' + sql, params)]
+
+
+def cases():
+    for name, sql in app_queries().items():
+        yield name, sql, SAMPLES.get(name)
+    yield from built_queries()
+
+
+def check(conn):
+    failures = []
+    for name, sql, params in cases():
+        if params is None:
+            failures.append(f'{name}: no sample parameters in SAMPLES')
+            continue
+        plan = explain(conn, sql, params)
+        scans = [step for step in plan if FULL_SCAN.match(step)]
+        status = 'ok'
+        if scans and name in ALLOW_SCAN:
+            status = f'allowed scan ({ALLOW_SCAN[name]})'
+        elif scans:
+            status = 'FULL SCAN'
+            failures.append(f'{name}: {"; ".join(scans)}')
+        if name in RANKED and SORT in plan:
+            status = 'SORTS'
+            failures.append(f'{name}: {SORT}')
+        print(f'{name:20} {status:10} {" | ".join(plan)}')
+    return failures
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        conn = sqlite3.connect(Path(tmp) / 'plans.db')
+        database.create_tables(conn)
+        database.migrate(conn)
+        database.ingest(conn, pd.read_csv(ROOT / 'trails-data.csv', dtype=database.CSV_DTYPES))
+        failures = check(conn)
+        conn.close()
+    if failures:
+        print('\nQueries that fall back to a full table scan or a sort:')
+        print('\n'.join(failures))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,231 @@
+### Benchmark suite: load stages and every app query, saved as JSON ###
+#
+#   python benchmarks/suite.py                              10k and 100k rows
+#   python benchmarks/suite.py --sizes 10000 100000 1000000
+#   python benchmarks/suite.py --compare benchmarks/results/<older commit>.json
+#
+# For each size it writes a synthetic csv (synthetic.py, resampled from the real data so the
+# feature/activity mix is realistic), loads it into a fresh database timing every stage of
+# database.ingest, then times each statement in queries.py with parameters drawn from that
+# database, then the Search, Statistics, Add and Maintenance paths of repository.py as the app calls them.
+# Results go to benchmarks/results/<commit>.json. With --compare, every timing is divided by
+# the one in the older file, and the script exits with status 1 if any got slower than
+# --threshold times.
+
+import argparse
+import json
+import os
+import platform
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+import pandas as pd
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+import database
+import queries
+import snapshot
+import query_plans
+import repository as repo
+from synthetic import write_trails_csv
+
+RESULTS = Path(__file__).resolve().parent / 'results'
+#Below this many milliseconds a slowdown is noise, whatever the ratio
+NOISE_MS = 1.0
+
+
+def commit():
+    def git(*args):
+        return subprocess.run(['git', *args], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+    head = git('rev-parse', '--short', 'HEAD') or 'unknown'
+    return head + ('-dirty' if git('status', '--porcelain', '--untracked-files=no') else '')
+
+
+def measure(fn, min_seconds=0.2, max_runs=50):
+    #Runs fn at least 3 times and until min_seconds have passed; times in milliseconds
+    runs = []
+    while len(runs) < 3 or (sum(runs) < min_seconds and len(runs) < max_runs):
+        start = time.perf_counter()
+        result = fn()
+        runs.append(time.perf_counter() - start)
+    rows = len(result) if hasattr(result, '__len__') else None
+    return {'median_ms': statistics.median(runs)*1000, 'min_ms': min(runs)*1000, 'runs': len(runs), 'rows': rows}
+
+
+## Load ##
+
+def load(csv, db_path):
+    timings = {}
+    with database.timed(timings, 'read_csv'):
+        df = pd.read_csv(csv, dtype=database.CSV_DTYPES)
+    conn = database.connect(db_path)
+    database.create_tables(conn)
+    database.migrate(conn)
+    database.ingest(conn, df, timings=timings)
+    with database.timed(timings, 'snapshot'):
+        snapshot.write(conn, snapshot.snapshot_path(db_path))
+    conn.close()
+    return timings
+
+
+## Queries ##
+
+def samples(conn):
+    #query_plans.SAMPLES, with ids and names that exist in this database
+    ids = [r[0] for r in conn.execute('SELECT trailID FROM Trails ORDER BY random() LIMIT 100')]
+    name = conn.execute('SELECT trailName FROM Trails WHERE trailID=?', (ids[0],)).fetchone()[0]
+    park = conn.execute('SELECT parkName FROM NationalParks ORDER BY parkID LIMIT 1').fetchone()[0]
+    found = dict(query_plans.SAMPLES)
+    for key, params in found.items():
+        if params and isinstance(params[0], str) and params[0].startswith('[') and key not in ('UPDATES_BY_ID', 'TRAILS_BY_NAME'):
+            found[key] = (json.dumps(ids),) + params[1:]
+    found.update({'KEYWORD_DETAILS': ('"lake"*', json.dumps(ids)), 'NEW_TRAIL': (name,), 'TRAILS_BY_NAME': (json.dumps([name]),), 'SIMILAR_TRAILS': (name,), 'PARK_ID': (park,), 'DELETE_TRAIL': (ids[0],)})
+    return found
+
+
+def run_query(conn, sql, params):
+    #Statements that write run inside a savepoint that is rolled back, so every run sees the same data
+    if sql.lstrip().split()[0].upper() in ('INSERT', 'UPDATE', 'DELETE'):
+        conn.execute('SAVEPOINT bench')
+        try:
+            return conn.execute(sql, params).fetchall()
+        finally:
+            conn.execute('ROLLBACK TO bench')
+            conn.execute('RELEASE bench')
+    return conn.execute(sql, params).fetchall()
+
+
+def time_queries(db_path):
+    conn = database.connect(db_path)
+    params = samples(conn)
+    results = {}
+    for name, sql in query_plans.app_queries().items():
+        results[name] = measure(lambda: run_query(conn, sql, params[name]))
+    for name, sql, built_params in query_plans.built_queries():
+        results[name] = measure(lambda: run_query(conn, sql, built_params))
+    conn.close()
+    return results
+
+
+## App paths ##
+
+def time_app(db_dir):
+    #repository.py opens database.DB_PATH relative to the working directory, so run it from
+    #the scratch directory, with every cache cleared from the previous size
+    repo.clear_caches()
+    cwd = os.getcwd()
+    os.chdir(db_dir)
+    try:
+        results = {}
+        start = time.perf_counter()
+        repo.trail_store()
+        repo.facet_index()
+        repo.name_index()
+        repo.name_completions_index()
+        results['startup'] = {'median_ms': (time.perf_counter()-start)*1000, 'runs': 1}
+        states, parks = repo.state_list()[:2], repo.park_list()[:2]
+        paths = {
+            'home_overview': lambda: repo.read(queries.HOME_OVERVIEW),
+            'keyword_search': lambda: repo.keyword_search('lake'),
+            'state_search': lambda: repo.state_search(states),
+            'park_search': lambda: repo.park_search(parks),
+            'difficulty_search': lambda: repo.difficulty_search(3),
+            'faceted_search': lambda: repo.faceted_search({'state': states[:1], 'difficulty': [3]}, (1.0, 10.0)),
+            'fuzzy_search': lambda: repo.fuzzy_search('hardng ice feild'),
+            'name_completions': lambda: repo.name_completions('har'),
+            'tag_search': lambda: repo.tag_search('waterfall AND NOT camping'),
+            'trail_statistics': lambda: repo.trail_statistics.clear() or repo.trail_statistics('park'),
+            'trails_nearest': lambda: repo.trails_nearest(44.4280, -110.5885, 10),
+            'trails_within': lambda: repo.trails_within(44.4280, -110.5885, 25),
+            'trails_page': lambda: repo.trails_page(50),
+            'trails_page_sorted': lambda: repo.trails_page(50, sort='length', descending=True, after=(5.0, 0)),
+        }
+        for name, path in paths.items():
+            results[name] = measure(path)
+
+        #Add Trails and the Delete box of Trails Maintenance, including the index refreshes
+        added = iter(range(1000000))
+        def add_and_delete():
+            trail_id = repo.add_trail(f'Benchmark Trail {next(added)}', 1.0, 100.0, 1, 'loop', 1)
+            return repo.delete_trail(trail_id[0])
+        results['add_and_delete_trail'] = measure(add_and_delete, max_runs=20)
+        return results
+    finally:
+        os.chdir(cwd)
+
+
+## Compare ##
+
+def flatten(results):
+    for size, sections in results['sizes'].items():
+        for section, values in sections.items():
+            for name, value in values.items():
+                key = f'{size}/{section}/{name}'
+                #Load stages are seconds, queries and app paths milliseconds
+                yield key, value * 1000 if section == 'load' else value['median_ms']
+
+
+def compare(old, new, threshold):
+    before = dict(flatten(old))
+    regressions = []
+    print(f'\n{"":60} {old["commit"]:>12} {new["commit"]:>12}')
+    for key, ms in flatten(new):
+        if key not in before:
+            continue
+        ratio = ms / before[key] if before[key] else float('inf')
+        slower = ratio > threshold and ms - before[key] > NOISE_MS
+        if slower:
+            regressions.append(key)
+        print(f'{key:60} {before[key]:10.2f}ms {ms:10.2f}ms {ratio:6.2f}x{"  SLOWER" if slower else ""}')
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Time the load stages and app queries, and save them as JSON')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000])
+    parser.add_argument('--out', help='results file (default benchmarks/results/<commit>.json)')
+    parser.add_argument('--compare', help='an earlier results file to compare against')
+    parser.add_argument('--threshold', type=float, default=1.5, help='slowdown ratio that counts as a regression')
+    args = parser.parse_args(argv)
+
+    results = {'commit': commit(), 'date': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+               'python': platform.python_version(), 'sqlite': sqlite3.sqlite_version, 'sizes': {}}
+    tmp = Path(tempfile.gettempdir())
+    for rows in args.sizes:
+        csv = write_trails_csv(rows, tmp / f'trails-{rows}.csv')
+        with tempfile.TemporaryDirectory() as db_dir:
+            db_path = Path(db_dir) / database.DB_PATH
+            print(f'{rows} rows: loading', flush=True)
+            size = {'load': load(csv, db_path)}
+            print(f'{rows} rows: queries', flush=True)
+            size['queries'] = time_queries(db_path)
+            print(f'{rows} rows: app paths', flush=True)
+            size['app'] = time_app(db_dir)
+            results['sizes'][str(rows)] = size
+            for section in ['load', 'app']:
+                for name, value in size[section].items():
+                    shown = f'{value:.2f}s' if section == 'load' else f'{value["median_ms"]:.2f}ms'
+                    print(f'  {section:5} {name:24} {shown}')
+
+    out = Path(args.out) if args.out else RESULTS / f'{results["commit"]}.json'
+    out.parent.mkdir(exist_ok=True)
+    out.write_text(json.dumps(results, indent=2))
+    print(f'results written to {out}')
+
+    if args.compare:
+        regressions = compare(json.loads(Path(args.compare).read_text()), results, args.threshold)
+        if regressions:
+            print(f'\n{len(regressions)} timings got more than {args.threshold}x slower:')
+            print('\n'.join(regressions))
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+### Synthetic trails-data.csv generator for the benchmarks ###
+#
+#   python benchmarks/synthetic.py 1000000 /tmp/trails-1m.csv
+#
+# Rows are resampled from the real trails-data.csv, so the feature/activity lists, parks,
+# states and numeric columns keep their real distributions. Every row gets a unique
+# trail_id, a numbered name and a coordinate jittered by up to ~10 km.
+
+import argparse
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+ROOT = Path(__file__).resolve().parents[1]
+SOURCE_CSV = ROOT / 'trails-data.csv'
+
+
+def make_trails(rows, seed=0, source=SOURCE_CSV):
+    rng = np.random.default_rng(seed)
+    real = pd.read_csv(source)
+    df = real.iloc[rng.integers(0, len(real), rows)].reset_index(drop=True)
+
+    df['trail_id'] = np.arange(1, rows+1) + 20000000
+    df['name'] = df['name'] + ' #' + pd.Series(np.arange(rows)).astype(str)
+    for col in ['length', 'elevation_gain', 'popularity']:
+        df[col] = (df[col] * rng.uniform(0.8, 1.2, rows)).round(4)
+    df['num_reviews'] = (df['num_reviews'] * rng.uniform(0.5, 1.5, rows)).astype(int)
+
+    #_geoloc is a dict string "{'lat': 60.18852, 'lng': -149.63156}"
+    geo = df['_geoloc'].str.extract(r"'lat': ([-\d.]+), 'lng': ([-\d.]+)").astype(float)
+    lat = (geo[0] + rng.uniform(-0.1, 0.1, rows)).round(5).astype(str)
+    lng = (geo[1] + rng.uniform(-0.1, 0.1, rows)).round(5).astype(str)
+    df['_geoloc'] = "{'lat': " + lat + ", 'lng': " + lng + "}"
+    return df
+
+
+def write_trails_csv(rows, path, seed=0):
+    path = Path(path)
+    if not path.exists():
+        make_trails(rows, seed).to_csv(path, index=False)
+    return path
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Write a synthetic trails-data.csv')
+    parser.add_argument('rows', type=int)
+    parser.add_argument('path')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+    make_trails(args.rows, args.seed).to_csv(args.path, index=False)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,47 +1,83 @@
 ### Run this file to create sql database ###
+#
+#   python database.py              incremental refresh of the 'project' database (default)
+#   python database.py --prune      also remove trails that disappeared from the csv
+#   python database.py --rebuild    drop the csv tables and load everything from scratch
+#   python database.py --chunk-size 100000
+#                                   stream the csv in chunks with bounded memory
+#   python database.py --shadow     load into project.shadow, a copy, and copy it back at the end
+#                                   so a running app keeps serving (the Refresh Data page does this)
+#
+# Every run ends by writing an Arrow snapshot of the tables to project.snapshot/ (see
+# snapshot.py) that the app loads at start instead of reading sqlite; --no-snapshot skips it.
+# Before that, the similar-trails lists of every trail the load touched are recomputed (see
+# similar.py).
+#
+# The incremental refresh keeps Users, TrailsUpdates and every trail added through the app.
+# Each csv row is hashed and the hash is kept in SourceRows, so rows that did not change
+# since the last run are skipped and only new or changed trails are written.
 
+import argparse
 import sqlite3
+import sys
+import time
+from contextlib import contextmanager
+from pathlib import Path
 import pandas as pd
 import numpy as np
 
-#Connect to the server
-conn = sqlite3.connect('project')
-c = conn.cursor()
+import facets
+import similar
+import snapshot
 
-## Parks Table & dataset ##
+DB_PATH = 'project'
+CSV_PATH = 'trails-data.csv'
+#Rows handed to one executemany call
+INSERT_CHUNK = 50000
+#Explicit csv dtypes, so every chunk of a streamed read parses the same way
+CSV_DTYPES = {
+    'trail_id': 'int64', 'name': 'str', 'national_park': 'str', 'city_name': 'str',
+    'state_name': 'str', 'country_name': 'str', '_geoloc': 'str', 'popularity': 'float64',
+    'length': 'float64', 'elevation_gain': 'float64', 'difficulty_rating': 'int64',
+    'route_type': 'str', 'visitor_usage': 'float64', 'avg_rating': 'float64',
+    'num_reviews': 'int64', 'features': 'str', 'activities': 'str',
+}
+
+## Storage ##
+
+#Settings every connection to the database gets from connect(). In WAL mode readers never
+#block on a writer or the other way round, and NORMAL sync is still safe from corruption
+#(a power cut can only lose the last commits). journal_mode is stored in the file, the
+#rest is per connection.
+PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    #Milliseconds to wait for a lock before "database is locked"
+    'busy_timeout': 5000,
+    #Bytes of the file read through a memory map instead of read() calls
+    'mmap_size': 256 * 1024 * 1024,
+    #Page cache per connection, negative is KiB
+    'cache_size': -16 * 1024,
+    #Bytes the WAL file is truncated back to after a checkpoint
+    'journal_size_limit': 64 * 1024 * 1024,
+}
+
+
+def connect(path, **options):
+    #sqlite3.connect with PRAGMAS applied; options go to sqlite3.connect
+    conn = sqlite3.connect(path, **options)
+    for pragma, value in PRAGMAS.items():
+        conn.execute(f'PRAGMA {pragma} = {value}')
+    return conn
 
-#Read master dataset
-df = pd.read_csv('trails-data.csv')
-#Create parks DataFrame
-parks = df[['national_park']]
-#Drop duplicates
-parks = parks.drop_duplicates()
-#Create a column that ranges from 1 to the maximum row
-parks['park_id'] = range(1, len(parks)+1)
-#Rename columns
-parks = parks.rename(columns={'national_park':'parkName', 'park_id':'parkID'})
-try:
-    c.execute('DROP TABLE NationalParks;')
-except:
-    print("Nothing Happened")
-c.execute('CREATE TABLE NationalParks (\
+
+## Schema ##
+
+CREATE_TABLES = [
+    'CREATE TABLE IF NOT EXISTS NationalParks (\
     parkName VARCHAR(100),\
-    parkID INT PRIMARY KEY NOT NULL);')
-parks.to_sql('NationalParks', conn, if_exists='append', index=False)
-
-## Trails table & dataset
-trails = df[['trail_id', 'name', 'national_park', 'length', 'elevation_gain',
-       'difficulty_rating', 'route_type', 'num_reviews']]
-trails = trails.rename(columns={'trail_id':'trailID', 'name':'trailName', 'national_park':'parkName', 'elevation_gain':'elevation_feet', 'difficulty_rating':'difficulty', 'route_type':'routeType', 'num_reviews':'reviews'})
-trails = pd.merge(trails, parks, on='parkName')
-trails.drop('parkName', axis=1, inplace=True)
-trails['length'] = trails['length']*0.000621371
-trails['trailID'].duplicated().any()
-try:
-    c.execute('DROP TABLE Trails;')
-except:
-    print("Nothing Happened")
-c.execute('CREATE TABLE Trails (\
+    parkID INT PRIMARY KEY NOT NULL);',
+    'CREATE TABLE IF NOT EXISTS Trails (\
     trailID INT PRIMARY KEY NOT NULL,\
     trailName VARCHAR(50) NOT NULL,\
     elevation_feet DECIMAL(10,4),\
@@ -49,96 +85,867 @@ c.execute('CREATE TABLE Trails (\
     difficulty INT,\
     routeType VARCHAR(20),\
     reviews INT,\
-    parkID INT);')
-trails.to_sql('Trails', conn, if_exists='append', index=False)
-
-## Features Table & dataset ##
-
-features = df[['trail_id', 'features']]
-def format_text(text):
-    text = text[1:-1].split(', ')
-    new_string = [t.replace("'","") for t in text]
-    return new_string
-features['feature_list'] = features['features'].apply(format_text)
-features.drop('features', axis=1, inplace=True)
-new_rows = []
-for _, row in features.iterrows():
-    feature_list = row['feature_list']
-    for feature in feature_list:
-        new_rows.append([row['trail_id'], feature])
-
-new_feature = pd.DataFrame(new_rows, columns=['trail_id', 'feature'])
-new_feature.head()
-new_feature.rename(columns={'trail_id':'trailID'}, inplace=True)
-try:
-    c.execute('DROP TABLE Features;')
-except:
-    print("Nothing Happened")
-c.execute('CREATE TABLE Features (\
+    parkID INT);',
+    'CREATE TABLE IF NOT EXISTS Features (\
     trailID INT, \
     feature VARCHAR(200),\
-    FOREIGN KEY (trailID) REFERENCES Trails (trailID) ON DELETE CASCADE);')
-new_feature.to_sql('Features', conn, if_exists='append', index=False)
-
-## Activities dataset ##
-activities = df[['trail_id', 'activities']]
-activities['activity_list'] = activities['activities'].apply(format_text)
-activities.drop('activities', axis=1, inplace=True)
-new_rows = []
-for _, row in activities.iterrows():
-    activity_list = row['activity_list']
-    for activity in activity_list:
-        new_rows.append([row['trail_id'], activity])
-
-new_activities = pd.DataFrame(new_rows, columns=['trail_id', 'activity'])
-new_activities.head()
-new_activities.rename(columns={'trail_id':'trailID'}, inplace=True)
-try:
-    c.execute('DROP TABLE Activities;')
-except:
-    print("Nothing Happened")
-c.execute('CREATE TABLE Activities (\
+    FOREIGN KEY (trailID) REFERENCES Trails (trailID) ON DELETE CASCADE);',
+    'CREATE TABLE IF NOT EXISTS Activities (\
     trailID INT, \
     activity VARCHAR(200),\
-    FOREIGN KEY (trailID) REFERENCES Trails (trailID) ON DELETE CASCADE);')
-new_activities.to_sql('Activities', conn, if_exists='append', index=False)
-
-
-## Location dataset ##
-
-loc = df[['trail_id', 'city_name', 'state_name', '_geoloc']].rename(columns={'trail_id':'trailID', 'city_name':'area_name','state_name':'state', '_geoloc':'geolocation'})
-try:
-    c.execute('DROP TABLE Location;')
-except:
-    print("Nothing Happened")
-c.execute('CREATE TABLE Location (\
+    FOREIGN KEY (trailID) REFERENCES Trails (trailID) ON DELETE CASCADE);',
+    'CREATE TABLE IF NOT EXISTS Location (\
     trailID INT, \
     area_name VARCHAR(100),\
     state varchar(50),\
     geolocation varchar(100),\
-    FOREIGN KEY (trailID) REFERENCES Trails (trailID) ON DELETE CASCADE);')
-loc.to_sql('Location', conn, if_exists='append', index=False)
-
-## Users Table
-try:
-    c.execute('DROP TABLE Users;')
-except:
-    print("Nothing Happened")
-c.execute('CREATE TABLE Users (userID INTEGER PRIMARY KEY AUTOINCREMENT,\
+    FOREIGN KEY (trailID) REFERENCES Trails (trailID) ON DELETE CASCADE);',
+    'CREATE TABLE IF NOT EXISTS Users (userID INTEGER PRIMARY KEY AUTOINCREMENT,\
     username VARCHAR(100),\
-    uPassword VARCHAR(100));')
-
-
-## TrailsUpdates Table ##
-
-try:
-    c.execute('DROP TABLE TrailsUpdates;')
-except:
-    print("Nothing Happened")
-c.execute('CREATE TABLE TrailsUpdates (\
+    uPassword VARCHAR(100));',
+    'CREATE TABLE IF NOT EXISTS TrailsUpdates (\
     updateID INTEGER PRIMARY KEY AUTOINCREMENT,\
     trailID INT,\
     userID INT,\
     content TEXT,\
     FOREIGN KEY (trailID) REFERENCES Trails (trailID),\
-    FOREIGN KEY (userID) REFERENCES Users (userID));')
+    FOREIGN KEY (userID) REFERENCES Users (userID));',
+    #One content hash per csv row, used to skip unchanged rows on the next refresh
+    'CREATE TABLE IF NOT EXISTS SourceRows (\
+    trailID INTEGER PRIMARY KEY,\
+    rowHash INTEGER NOT NULL);',
+]
+
+#Tables that are rebuilt from the csv. Users and TrailsUpdates are never dropped.
+CSV_TABLES = ['NationalParks', 'Trails', 'Features', 'Activities', 'Location', 'SourceRows', 'TrailSearch', 'TrailGeo', 'TrailIDSequence', 'TrailCard',
+              'SimilarTrails', 'SimilarStale', 'ParkStats', 'StateStats']
+#Tables that hold one or more rows per trail and are replaced when the trail changes
+CHILD_TABLES = ['Features', 'Activities', 'Location']
+#foreign_keys is off, so ON DELETE CASCADE never runs: deleting a trail removes its child
+#rows here instead, and with its Location goes its TrailGeo point (see GEO_TRIGGERS)
+CHILD_TRIGGERS = [
+    'CREATE TRIGGER IF NOT EXISTS trails_children_del AFTER DELETE ON Trails BEGIN '
+    + ''.join(f'DELETE FROM {table} WHERE trailID=OLD.trailID;' for table in CHILD_TABLES) + ' END;',
+]
+
+
+## Full-text search ##
+
+#TrailSearch is an FTS5 index with one document per trail (rowid = trailID). Triggers on
+#Trails, NationalParks, Location, Features and Activities rebuild a trail's document
+#whenever one of its rows changes, so the index never needs a separate refresh.
+SEARCH_COLUMNS = 'trailName, parkName, area_name, state, features, activities'
+SEARCH_DOC = "SELECT t.trailID, t.trailName, p.parkName,\
+    (SELECT group_concat(area_name, ' ') FROM Location l WHERE l.trailID=t.trailID),\
+    (SELECT group_concat(state, ' ') FROM Location l WHERE l.trailID=t.trailID),\
+    (SELECT group_concat(feature, ' ') FROM Features f WHERE f.trailID=t.trailID),\
+    (SELECT group_concat(activity, ' ') FROM Activities a WHERE a.trailID=t.trailID)\
+    FROM Trails t LEFT JOIN NationalParks p ON t.parkID=p.parkID"
+
+
+def search_refresh(where, trail_ids):
+    #Trigger body that rewrites the documents of the trails matched by where / trail_ids
+    return f'DELETE FROM TrailSearch WHERE rowid IN ({trail_ids});\
+    INSERT INTO TrailSearch (rowid, {SEARCH_COLUMNS}) {SEARCH_DOC} WHERE {where};'
+
+
+def search_triggers():
+    statements = [
+        f'CREATE TRIGGER IF NOT EXISTS trails_search_ins AFTER INSERT ON Trails BEGIN\
+        {search_refresh("t.trailID=NEW.trailID", "NEW.trailID")} END;',
+        f'CREATE TRIGGER IF NOT EXISTS trails_search_upd AFTER UPDATE ON Trails BEGIN\
+        DELETE FROM TrailSearch WHERE rowid=OLD.trailID;\
+        {search_refresh("t.trailID=NEW.trailID", "NEW.trailID")} END;',
+        'CREATE TRIGGER IF NOT EXISTS trails_search_del AFTER DELETE ON Trails BEGIN\
+        DELETE FROM TrailSearch WHERE rowid=OLD.trailID; END;',
+        f'CREATE TRIGGER IF NOT EXISTS parks_search_upd AFTER UPDATE OF parkName ON NationalParks BEGIN\
+        {search_refresh("t.parkID=NEW.parkID", "SELECT trailID FROM Trails WHERE parkID=NEW.parkID")} END;',
+    ]
+    for table in CHILD_TABLES:
+        name = table.lower()
+        statements += [
+            f'CREATE TRIGGER IF NOT EXISTS {name}_search_ins AFTER INSERT ON {table} BEGIN\
+            {search_refresh("t.trailID=NEW.trailID", "NEW.trailID")} END;',
+            f'CREATE TRIGGER IF NOT EXISTS {name}_search_del AFTER DELETE ON {table} BEGIN\
+            {search_refresh("t.trailID=OLD.trailID", "OLD.trailID")} END;',
+            f'CREATE TRIGGER IF NOT EXISTS {name}_search_upd AFTER UPDATE ON {table} BEGIN\
+            {search_refresh("t.trailID=OLD.trailID", "OLD.trailID")}\
+            {search_refresh("t.trailID=NEW.trailID", "NEW.trailID")} END;',
+        ]
+    return statements
+
+
+## Trail cards ##
+
+#TrailCard is a denormalized copy of each trail with its park, location and tags, so the read
+#paths of the app (Home, key word, near me and the detail lookups behind the in-memory
+#searches) read one row per trail without joins. Like TrailSearch it is kept in sync by
+#triggers on every table it is built from.
+CARD_COLUMNS = 'trailID, trailName, parkID, parkName, area_name, state, lat, lng, \
+    elevation_feet, length, difficulty, routeType, reviews, features, activities, \
+    popularity, avg_rating, visitor_usage, rank'
+#A trail has one Location row; if there were more, the first one wins. Tags are JSON arrays.
+CARD_ROW = "SELECT t.trailID, t.trailName, t.parkID, p.parkName, l.area_name, l.state, l.lat, l.lng,\
+    t.elevation_feet, t.length, t.difficulty, t.routeType, t.reviews,\
+    (SELECT json_group_array(feature) FROM Features f WHERE f.trailID=t.trailID),\
+    (SELECT json_group_array(activity) FROM Activities a WHERE a.trailID=t.trailID),\
+    t.popularity, t.avg_rating, t.visitor_usage, t.rank\
+    FROM Trails t LEFT JOIN NationalParks p ON p.parkID=t.parkID\
+    LEFT JOIN Location l ON l.rowid=(SELECT min(rowid) FROM Location WHERE trailID=t.trailID)"
+CARD_TABLE = 'CREATE TABLE IF NOT EXISTS TrailCard (\
+    trailID INTEGER PRIMARY KEY,\
+    trailName TEXT,\
+    parkID INT,\
+    parkName TEXT,\
+    area_name TEXT,\
+    state TEXT,\
+    lat REAL,\
+    lng REAL,\
+    elevation_feet REAL,\
+    length REAL,\
+    difficulty INT,\
+    routeType TEXT,\
+    reviews INT,\
+    features TEXT,\
+    activities TEXT,\
+    popularity REAL,\
+    avg_rating REAL,\
+    visitor_usage REAL,\
+    rank REAL);'
+#rank DESC is the order of Home and every search, read straight off idx_card_rank
+CARD_INDEXES = [
+    'CREATE INDEX IF NOT EXISTS idx_card_name ON TrailCard (trailName);',
+    'CREATE INDEX IF NOT EXISTS idx_card_park ON TrailCard (parkID);',
+    'CREATE INDEX IF NOT EXISTS idx_card_rank ON TrailCard (rank);',
+]
+
+
+def card_refresh(where, trail_ids):
+    #Trigger body that rewrites the cards of the trails matched by where / trail_ids
+    return f'DELETE FROM TrailCard WHERE trailID IN ({trail_ids});\
+    INSERT INTO TrailCard ({CARD_COLUMNS}) {CARD_ROW} WHERE {where};'
+
+
+def card_triggers():
+    statements = [
+        f'CREATE TRIGGER IF NOT EXISTS trails_card_ins AFTER INSERT ON Trails BEGIN\
+        {card_refresh("t.trailID=NEW.trailID", "NEW.trailID")} END;',
+        f'CREATE TRIGGER IF NOT EXISTS trails_card_upd AFTER UPDATE ON Trails BEGIN\
+        DELETE FROM TrailCard WHERE trailID=OLD.trailID;\
+        {card_refresh("t.trailID=NEW.trailID", "NEW.trailID")} END;',
+        'CREATE TRIGGER IF NOT EXISTS trails_card_del AFTER DELETE ON Trails BEGIN\
+        DELETE FROM TrailCard WHERE trailID=OLD.trailID; END;',
+        'CREATE TRIGGER IF NOT EXISTS parks_card_upd AFTER UPDATE OF parkName ON NationalParks BEGIN\
+        UPDATE TrailCard SET parkName=NEW.parkName WHERE parkID=NEW.parkID; END;',
+    ]
+    for table in CHILD_TABLES:
+        name = table.lower()
+        statements += [
+            f'CREATE TRIGGER IF NOT EXISTS {name}_card_ins AFTER INSERT ON {table} BEGIN\
+            {card_refresh("t.trailID=NEW.trailID", "NEW.trailID")} END;',
+            f'CREATE TRIGGER IF NOT EXISTS {name}_card_del AFTER DELETE ON {table} BEGIN\
+            {card_refresh("t.trailID=OLD.trailID", "OLD.trailID")} END;',
+            f'CREATE TRIGGER IF NOT EXISTS {name}_card_upd AFTER UPDATE ON {table} BEGIN\
+            {card_refresh("t.trailID=OLD.trailID", "OLD.trailID")}\
+            {card_refresh("t.trailID=NEW.trailID", "NEW.trailID")} END;',
+        ]
+    return statements
+
+
+## Rollups ##
+
+#ParkStats and StateStats hold the statistics page's numbers per park (parkID) and per state:
+#one row per (measure, bucket) with the trails in it and the sum of their values, so a mean
+#is total / trails. Measure 'trails' has the trail count in bucket 0, 'difficulty' one bucket
+#per level, and 'length' (miles) and 'elevation' (feet) one bucket per band of the filters
+#search, named by its lower edge. They are built from TrailCard, whose state is the trail's
+#first Location, and triggers on TrailCard add each new card and take away each old one, so
+#the page reads under 20 rows per park or state whatever the number of trails.
+ROLLUP_TABLES = {'ParkStats': ('parkID', 'INT'), 'StateStats': ('state', 'TEXT')}
+ROLLUP_BUCKETS = {'length': facets.LENGTH_BANDS, 'elevation': facets.ELEVATION_BANDS}
+ROLLUP_VALUES = {'difficulty': 'difficulty', 'length': 'length', 'elevation': 'elevation_feet'}
+
+
+def rollup_numeric(column):
+    #Only numbers are bucketed and summed: Add Trails stores a blank length or elevation as '',
+    #which sqlite sorts above every number. facets.bands leaves the same values out.
+    return f"typeof({column}) IN ('integer', 'real')"
+
+
+def rollup_bucket(measure, column):
+    edges = ROLLUP_BUCKETS.get(measure)
+    if edges is None:
+        return column
+    steps = ' '.join(f'WHEN {column}>={edge} THEN {edge}' for edge in reversed(edges[1:]))
+    return f'CASE {steps} ELSE 0 END'
+
+
+def rollup_change(table, cards, sign):
+    #Adds (sign 1) or takes away (sign -1) the trails of cards, a subquery with TrailCard's
+    #columns, in one upsert; the rows left with no trails are removed by the caller
+    key = ROLLUP_TABLES[table][0]
+    parts = [f"SELECT {key} AS groupKey, 'trails' AS measure, 0 AS bucket, NULL AS value FROM {cards}"]
+    parts += [f"SELECT {key}, '{measure}', {rollup_bucket(measure, column)}, {column} FROM {cards} WHERE {rollup_numeric(column)}"
+              for measure, column in ROLLUP_VALUES.items()]
+    return f"INSERT INTO {table} ({key}, measure, bucket, trails, total) \
+    SELECT groupKey, measure, bucket, {sign}*count(*), {sign}*total(value) FROM ({' UNION ALL '.join(parts)}) \
+    WHERE groupKey IS NOT NULL GROUP BY groupKey, measure, bucket \
+    ON CONFLICT ({key}, measure, bucket) DO UPDATE SET trails=trails+excluded.trails, total=total+excluded.total;"
+
+
+def rollup_card(row):
+    #The card NEW or OLD of a trigger as a one-row subquery for rollup_change
+    return f"(SELECT {', '.join(f'{row}.{column} AS {column}' for column in ['parkID', 'state', *ROLLUP_VALUES.values()])})"
+
+
+def rollup_triggers():
+    add = ''.join(rollup_change(table, rollup_card('NEW'), 1) for table in ROLLUP_TABLES)
+    remove = ''.join(rollup_change(table, rollup_card('OLD'), -1) for table in ROLLUP_TABLES)
+    empty = ''.join(f'DELETE FROM {table} WHERE {key}=OLD.{key} AND trails=0;' for table, (key, _) in ROLLUP_TABLES.items())
+    return [
+        f'CREATE TRIGGER IF NOT EXISTS cards_rollup_ins AFTER INSERT ON TrailCard BEGIN {add} END;',
+        f'CREATE TRIGGER IF NOT EXISTS cards_rollup_del AFTER DELETE ON TrailCard BEGIN {remove} {empty} END;',
+        f'CREATE TRIGGER IF NOT EXISTS cards_rollup_upd AFTER UPDATE OF parkID, state, {", ".join(ROLLUP_VALUES.values())} \
+        ON TrailCard BEGIN {remove} {add} {empty} END;',
+    ]
+
+
+def rebuild_rollups(conn):
+    #Migration step: the rollup tables, filled from TrailCard, and their triggers
+    #Triggers are dropped first, so a rebuild also replaces the ones an older version made
+    for (name,) in conn.execute("SELECT name FROM sqlite_master WHERE type='trigger' AND name LIKE '%_rollup_%'").fetchall():
+        conn.execute(f'DROP TRIGGER {name}')
+    for table, (key, declaration) in ROLLUP_TABLES.items():
+        conn.execute(f'DROP TABLE IF EXISTS {table}')
+        conn.execute(f'CREATE TABLE {table} (\
+            {key} {declaration} NOT NULL,\
+            measure TEXT NOT NULL,\
+            bucket REAL NOT NULL,\
+            trails INT NOT NULL,\
+            total REAL NOT NULL,\
+            PRIMARY KEY ({key}, measure, bucket)) WITHOUT ROWID;')
+        conn.execute(rollup_change(table, 'TrailCard', 1))
+    for statement in rollup_triggers():
+        conn.execute(statement)
+
+
+## Similar trails ##
+
+#SimilarTrails holds the K most similar trails of each trail (see similar.py). The triggers
+#only note the trails whose similarity inputs changed in SimilarStale; similar.update()
+#recomputes the lists that depend on them, after a load here and after writes in the app.
+SIMILAR_EVENTS = {
+    'Trails': 'UPDATE OF trailID, parkID, elevation_feet, length, difficulty, routeType',
+    'Features': 'UPDATE',
+    'Activities': 'UPDATE',
+    'Location': 'UPDATE OF trailID, state',
+}
+
+
+def similar_triggers():
+    statements = []
+    for table, update in SIMILAR_EVENTS.items():
+        name = table.lower()
+        statements += [
+            f'CREATE TRIGGER IF NOT EXISTS {name}_similar_ins AFTER INSERT ON {table} BEGIN\
+            INSERT OR IGNORE INTO SimilarStale VALUES (NEW.trailID); END;',
+            f'CREATE TRIGGER IF NOT EXISTS {name}_similar_del AFTER DELETE ON {table} BEGIN\
+            INSERT OR IGNORE INTO SimilarStale VALUES (OLD.trailID); END;',
+            f'CREATE TRIGGER IF NOT EXISTS {name}_similar_upd AFTER {update} ON {table} BEGIN\
+            INSERT OR IGNORE INTO SimilarStale VALUES (OLD.trailID);\
+            INSERT OR IGNORE INTO SimilarStale VALUES (NEW.trailID); END;',
+        ]
+    return statements
+
+
+## Bulk loads ##
+
+@contextmanager
+def bulk_refresh(c, id_table, timings=None):
+    #Bulk loads write many rows per trail, and the triggers would rebuild a trail's search
+    #document and card (and mark it for similar.update, and move it between rollup rows)
+    #once per row. Inside the load transaction, drop those triggers, and once the block is
+    #done rebuild the documents and cards of the trails in temp.<id_table> in one pass each,
+    #take their old cards out of the rollups and add the new ones, and restore the triggers.
+    triggers = c.execute("SELECT name, sql FROM sqlite_master WHERE type='trigger' \
+        AND (name LIKE '%_search_%' OR name LIKE '%_card_%' OR name LIKE '%_similar_%' \
+        OR name LIKE '%_rollup_%')").fetchall()
+    for name, _ in triggers:
+        c.execute(f'DROP TRIGGER {name}')
+    yield
+    ids = f'SELECT trailID FROM temp.{id_table}'
+    if any('_search_' in name for name, _ in triggers):
+        with timed(timings, 'search'):
+            c.execute(f'DELETE FROM TrailSearch WHERE rowid IN ({ids})')
+            c.execute(f'INSERT INTO TrailSearch (rowid, {SEARCH_COLUMNS}) {SEARCH_DOC} WHERE t.trailID IN ({ids})')
+    rollups = any('_rollup_' in name for name, _ in triggers)
+    if any('_card_' in name for name, _ in triggers):
+        with timed(timings, 'card'):
+            cards = f'(SELECT * FROM TrailCard WHERE trailID IN ({ids}))'
+            for table in ROLLUP_TABLES if rollups else []:
+                c.execute(rollup_change(table, cards, -1))
+            c.execute(f'DELETE FROM TrailCard WHERE trailID IN ({ids})')
+            c.execute(f'INSERT INTO TrailCard ({CARD_COLUMNS}) {CARD_ROW} WHERE t.trailID IN ({ids})')
+            for table in ROLLUP_TABLES if rollups else []:
+                c.execute(rollup_change(table, cards, 1))
+                c.execute(f'DELETE FROM {table} WHERE trails=0')
+    if any('_similar_' in name for name, _ in triggers):
+        c.execute(f'INSERT OR IGNORE INTO SimilarStale {ids}')
+    for _, sql in triggers:
+        c.execute(sql)
+
+
+## Spatial index ##
+
+#TrailGeo is an R*Tree over Location.lat/lng (a point is a box with min=max), kept in sync
+#by triggers on Location. Bounding-box lookups on it drive the "near me" search.
+GEO_TRIGGERS = [
+    'CREATE TRIGGER IF NOT EXISTS location_geo_ins AFTER INSERT ON Location WHEN NEW.lat IS NOT NULL BEGIN\
+    INSERT OR REPLACE INTO TrailGeo VALUES (NEW.trailID, NEW.lat, NEW.lat, NEW.lng, NEW.lng); END;',
+    'CREATE TRIGGER IF NOT EXISTS location_geo_del AFTER DELETE ON Location BEGIN\
+    DELETE FROM TrailGeo WHERE trailID=OLD.trailID; END;',
+    'CREATE TRIGGER IF NOT EXISTS location_geo_upd AFTER UPDATE OF trailID, lat, lng ON Location BEGIN\
+    DELETE FROM TrailGeo WHERE trailID=OLD.trailID;\
+    INSERT OR REPLACE INTO TrailGeo SELECT NEW.trailID, NEW.lat, NEW.lat, NEW.lng, NEW.lng WHERE NEW.lat IS NOT NULL; END;',
+]
+
+
+## Data version ##
+
+#DataVersion holds a random id for this database file and a counter that every insert, update
+#or delete on Trails bumps. snapshot.py stamps both into each snapshot, so the app can tell
+#whether a snapshot still matches the database.
+VERSION_TRIGGERS = [
+    f'CREATE TRIGGER IF NOT EXISTS trails_version_{event.lower()} AFTER {event} ON Trails BEGIN\
+    UPDATE DataVersion SET version=version+1 WHERE id=1; END;'
+    for event in ['INSERT', 'UPDATE', 'DELETE']
+]
+
+
+## Ranking ##
+
+#Trails.rank is a Bayesian average of avg_rating: the trail's reviews pulled towards a prior
+#of RANK_PRIOR_REVIEWS reviews of RANK_PRIOR_RATING, so 5.0 from two reviews ranks below 4.7
+#from two hundred. The priors are the mean rating and median review count of trails-data.csv.
+#It is a generated column, so every insert and update gets it without a trigger; changing
+#the priors takes a migration that recreates the column.
+RANK_PRIOR_RATING = 4.3
+RANK_PRIOR_REVIEWS = 17
+RANK = f'(coalesce(avg_rating*reviews, 0) + {RANK_PRIOR_RATING}*{RANK_PRIOR_REVIEWS}) \
+    / (coalesce(reviews*(avg_rating IS NOT NULL), 0) + {RANK_PRIOR_REVIEWS})'
+RANK_COLUMNS = {
+    'popularity': 'REAL',
+    'avg_rating': 'REAL',
+    'visitor_usage': 'REAL',
+    'rank': f'REAL GENERATED ALWAYS AS ({RANK}) VIRTUAL',
+}
+
+
+## Migrations ##
+
+def add_column(table, column, declaration):
+    #Migration step for a table that --rebuild keeps, where the column may already exist
+    def step(conn):
+        columns = [row[1] for row in conn.execute(f'PRAGMA table_xinfo({table})')]
+        if column not in columns:
+            conn.execute(f'ALTER TABLE {table} ADD COLUMN {column} {declaration};')
+    return step
+
+
+def table_exists(conn, table):
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (table,)).fetchone() is not None
+
+
+def rebuild_cards(conn):
+    #Migration step: TrailCard as CARD_TABLE defines it now, filled and with its indexes and
+    #triggers. Any step that changes the card runs it again. The card reads the rank columns
+    #of Trails, so they are added first for a database migrating from before they existed.
+    #Dropping TrailCard drops the rollup triggers on it, so the rollups are rebuilt too once
+    #they exist.
+    for column, declaration in RANK_COLUMNS.items():
+        add_column('Trails', column, declaration)(conn)
+    for (name,) in conn.execute("SELECT name FROM sqlite_master WHERE type='trigger' AND name LIKE '%_card_%'").fetchall():
+        conn.execute(f'DROP TRIGGER {name}')
+    conn.execute('DROP TABLE IF EXISTS TrailCard')
+    conn.execute(CARD_TABLE)
+    conn.execute(f'INSERT INTO TrailCard ({CARD_COLUMNS}) {CARD_ROW}')
+    for statement in CARD_INDEXES + card_triggers():
+        conn.execute(statement)
+    if table_exists(conn, 'ParkStats'):
+        rebuild_rollups(conn)
+
+
+#Schema changes on top of CREATE_TABLES. Each step runs once per database, in order, and
+#PRAGMA user_version records how many steps have run. Only ever append new steps.
+#A step is a list of SQL statements or functions taking the connection.
+MIGRATIONS = [
+    #1: secondary indexes for the search paths of the app
+    [
+        'CREATE INDEX IF NOT EXISTS idx_location_state ON Location (state, trailID);',
+        'CREATE INDEX IF NOT EXISTS idx_location_trail ON Location (trailID, state, area_name);',
+        'CREATE INDEX IF NOT EXISTS idx_trails_park ON Trails (parkID);',
+        'CREATE INDEX IF NOT EXISTS idx_trails_difficulty ON Trails (difficulty, parkID);',
+        'CREATE INDEX IF NOT EXISTS idx_trails_name ON Trails (trailName);',
+        'CREATE INDEX IF NOT EXISTS idx_parks_name ON NationalParks (parkName, parkID);',
+        'CREATE INDEX IF NOT EXISTS idx_features_trail ON Features (trailID, feature);',
+        'CREATE INDEX IF NOT EXISTS idx_features_feature ON Features (feature, trailID);',
+        'CREATE INDEX IF NOT EXISTS idx_activities_trail ON Activities (trailID, activity);',
+        'CREATE INDEX IF NOT EXISTS idx_activities_activity ON Activities (activity, trailID);',
+    ],
+    #2: full-text index for the key word search, filled from the existing rows
+    [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS TrailSearch USING fts5({SEARCH_COLUMNS}, prefix='2 3');",
+        f'INSERT INTO TrailSearch (rowid, {SEARCH_COLUMNS}) {SEARCH_DOC};',
+    ] + search_triggers(),
+    #3: numeric lat/lng parsed out of Location.geolocation, and the R*Tree over them
+    [
+        'ALTER TABLE Location ADD COLUMN lat REAL;',
+        'ALTER TABLE Location ADD COLUMN lng REAL;',
+        "UPDATE Location SET lat=CAST(substr(geolocation, instr(geolocation, ':')+1) AS REAL),\
+        lng=CAST(substr(geolocation, instr(geolocation, 'lng')+6) AS REAL) WHERE geolocation LIKE '{''lat'':%';",
+        'CREATE VIRTUAL TABLE IF NOT EXISTS TrailGeo USING rtree(trailID, minLat, maxLat, minLng, maxLng);',
+        'INSERT OR REPLACE INTO TrailGeo SELECT trailID, lat, lat, lng, lng FROM Location WHERE lat IS NOT NULL;',
+    ] + GEO_TRIGGERS,
+    #4: (column, trailID) indexes for the keyset-paginated maintenance editor, one per sort column
+    [
+        'DROP INDEX IF EXISTS idx_trails_name;',
+        'CREATE INDEX IF NOT EXISTS idx_trails_name ON Trails (trailName, trailID);',
+        'CREATE INDEX IF NOT EXISTS idx_trails_length ON Trails (length, trailID);',
+        'CREATE INDEX IF NOT EXISTS idx_trails_elevation ON Trails (elevation_feet, trailID);',
+        'CREATE INDEX IF NOT EXISTS idx_trails_reviews ON Trails (reviews, trailID);',
+        'CREATE INDEX IF NOT EXISTS idx_trails_difficulty_id ON Trails (difficulty, trailID);',
+    ],
+    #5: one-row sequence for new trail ids, so Add Trails never reads all ids. The trigger
+    #keeps it ahead of every id inserted, including csv trails loaded later.
+    [
+        'CREATE TABLE IF NOT EXISTS TrailIDSequence (\
+        id INTEGER PRIMARY KEY CHECK (id = 1),\
+        lastID INTEGER NOT NULL);',
+        'INSERT OR REPLACE INTO TrailIDSequence SELECT 1, COALESCE(MAX(trailID), 0) FROM Trails;',
+        'CREATE TRIGGER IF NOT EXISTS trails_id_seq AFTER INSERT ON Trails\
+        WHEN NEW.trailID > (SELECT lastID FROM TrailIDSequence) BEGIN\
+        UPDATE TrailIDSequence SET lastID=NEW.trailID; END;',
+    ],
+    #6: review state for the community edits queued in TrailsUpdates
+    [
+        add_column('TrailsUpdates', 'status', "TEXT NOT NULL DEFAULT 'pending'"),
+        add_column('TrailsUpdates', 'submitted', 'TEXT'),
+        'CREATE INDEX IF NOT EXISTS idx_updates_status ON TrailsUpdates (status, updateID);',
+    ],
+    #7: change counter for snapshot versioning. Not a csv table, so --rebuild keeps counting up.
+    [
+        'CREATE TABLE IF NOT EXISTS DataVersion (\
+        id INTEGER PRIMARY KEY CHECK (id = 1),\
+        databaseID TEXT NOT NULL,\
+        version INTEGER NOT NULL);',
+        'INSERT OR IGNORE INTO DataVersion VALUES (1, lower(hex(randomblob(8))), 0);',
+    ] + VERSION_TRIGGERS,
+    #8: TrailCard, the denormalized read table, filled from the existing rows. It replaces the
+    #ad-hoc trail_set/trail_mix/trail_mix_q views, which nothing reads.
+    [
+        'DROP VIEW IF EXISTS trail_set;',
+        'DROP VIEW IF EXISTS trail_mix;',
+        'DROP VIEW IF EXISTS trail_mix_q;',
+        rebuild_cards,
+    ],
+    #9: similar trails, all of them stale so the next similar.update() computes every list
+    [
+        'CREATE TABLE IF NOT EXISTS SimilarTrails (\
+        trailID INTEGER NOT NULL,\
+        rank INTEGER NOT NULL,\
+        similarID INTEGER NOT NULL,\
+        score REAL NOT NULL,\
+        PRIMARY KEY (trailID, rank)) WITHOUT ROWID;',
+        'CREATE INDEX IF NOT EXISTS idx_similar_similar ON SimilarTrails (similarID);',
+        'CREATE TABLE IF NOT EXISTS SimilarStale (trailID INTEGER PRIMARY KEY);',
+        'INSERT OR IGNORE INTO SimilarStale SELECT trailID FROM Trails;',
+    ] + similar_triggers(),
+    #10: popularity, avg_rating, visitor_usage and rank on Trails and TrailCard. SourceRows is
+    #emptied so the next load writes every csv trail again, with the columns filled.
+    [add_column('Trails', column, declaration) for column, declaration in RANK_COLUMNS.items()] + [
+        rebuild_cards,
+        lambda conn: conn.execute('DELETE FROM SourceRows') if table_exists(conn, 'SourceRows') else None,
+    ],
+    #11: per-park and per-state rollups for the statistics page, filled from the cards
+    [rebuild_rollups],
+    #12: child rows go with their trail, and the ones left behind by earlier deletes are removed
+    CHILD_TRIGGERS + [f'DELETE FROM {table} WHERE trailID NOT IN (SELECT trailID FROM Trails);'
+                      for table in CHILD_TABLES + ['TrailGeo']],
+    #13: the rollups again, without the blank ('') lengths and elevations 11 put in the top band
+    [rebuild_rollups],
+]
+
+
+def create_tables(conn):
+    for statement in CREATE_TABLES:
+        conn.execute(statement)
+
+
+def migrate(conn):
+    version = conn.execute('PRAGMA user_version').fetchone()[0]
+    for step in MIGRATIONS[version:]:
+        for statement in step:
+            if callable(statement):
+                statement(conn)
+            else:
+                conn.execute(statement)
+    conn.execute(f'PRAGMA user_version = {len(MIGRATIONS)}')
+    conn.commit()
+
+
+def drop_tables(conn):
+    for table in CSV_TABLES:
+        conn.execute(f'DROP TABLE IF EXISTS {table};')
+    #Dropping the tables dropped their indexes too, so every migration has to run again
+    conn.execute('PRAGMA user_version = 0')
+
+
+@contextmanager
+def timed(timings, stage):
+    #Adds the seconds spent in the block to timings[stage]; with timings=None it only runs it
+    start = time.perf_counter()
+    yield
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + time.perf_counter() - start
+
+
+def records(frame):
+    #sqlite3 cannot bind numpy scalars, so hand it plain python values (NaN binds as NULL)
+    return list(zip(*(frame[col].tolist() for col in frame.columns)))
+
+
+def insert_rows(c, sql, frame, chunk_size=INSERT_CHUNK):
+    #Bulk insert with executemany, converting at most chunk_size rows to python at a time
+    for start in range(0, len(frame), chunk_size):
+        c.executemany(sql, records(frame.iloc[start:start+chunk_size]))
+
+
+## Parks Table & dataset ##
+
+def make_parks(df, existing=None):
+    #Create parks DataFrame without duplicates
+    parks = df[['national_park']].drop_duplicates().rename(columns={'national_park':'parkName'})
+    if existing is None or existing.empty:
+        #Create a column that ranges from 1 to the maximum row
+        parks['parkID'] = range(1, len(parks)+1)
+        return parks, parks
+    #Only parks we have not seen yet get a new id, after the largest id in use
+    new_parks = parks[~parks['parkName'].isin(existing['parkName'])].copy()
+    start = int(existing['parkID'].max()) + 1
+    new_parks['parkID'] = range(start, start+len(new_parks))
+    return new_parks, pd.concat([existing, new_parks], ignore_index=True)
+
+
+## Trails table & dataset ##
+
+def make_trails(df, parks):
+    trails = df[['trail_id', 'name', 'national_park', 'length', 'elevation_gain',
+           'difficulty_rating', 'route_type', 'num_reviews', 'popularity', 'avg_rating', 'visitor_usage']]
+    trails = trails.rename(columns={'trail_id':'trailID', 'name':'trailName', 'national_park':'parkName', 'elevation_gain':'elevation_feet', 'difficulty_rating':'difficulty', 'route_type':'routeType', 'num_reviews':'reviews'})
+    trails = pd.merge(trails, parks, on='parkName')
+    trails = trails.drop('parkName', axis=1)
+    trails['length'] = trails['length']*0.000621371
+    return trails[['trailID', 'trailName', 'elevation_feet', 'length', 'difficulty', 'routeType', 'reviews', 'parkID',
+                   'popularity', 'avg_rating', 'visitor_usage']]
+
+
+## Features & Activities datasets ##
+
+def make_tags(df, source, column):
+    #The csv stores tags as a python-list string such as "['forest', 'river']".
+    #Parse the whole column at once and explode it into one (trailID, tag) row per tag.
+    tags = df[source].str.slice(1, -1).str.replace("'", '', regex=False).str.split(', ')
+    tags = pd.DataFrame({'trailID': df['trail_id'].to_numpy(), column: tags.to_numpy()}).explode(column)
+    #An empty list "[]" parses to a single empty tag, which is not a tag
+    tags = tags[tags[column].notna() & (tags[column] != '')]
+    return tags.reset_index(drop=True)
+
+
+def make_features(df):
+    return make_tags(df, 'features', 'feature')
+
+
+def make_activities(df):
+    return make_tags(df, 'activities', 'activity')
+
+
+## Location dataset ##
+
+def make_location(df):
+    loc = df[['trail_id', 'city_name', 'state_name', '_geoloc']].rename(columns={'trail_id':'trailID', 'city_name':'area_name','state_name':'state', '_geoloc':'geolocation'})
+    #_geoloc is a dict string "{'lat': 60.18852, 'lng': -149.63156}"; keep it and add numeric columns
+    coords = loc['geolocation'].str.extract(r"'lat':\s*([-\d.]+),\s*'lng':\s*([-\d.]+)")
+    loc['lat'] = pd.to_numeric(coords[0], errors='coerce')
+    loc['lng'] = pd.to_numeric(coords[1], errors='coerce')
+    return loc
+
+
+## Incremental load ##
+
+def row_hashes(df):
+    #One 64 bit hash per csv row, stored signed because sqlite integers are signed
+    hashes = pd.util.hash_pandas_object(df, index=False).to_numpy().view(np.int64)
+    return pd.Series(hashes, index=df['trail_id'].to_numpy())
+
+
+def temp_ids(c, name, ids):
+    #Load a list of trail ids into a temp table so sqlite can join against it
+    c.execute(f'CREATE TEMP TABLE IF NOT EXISTS {name} (trailID INTEGER PRIMARY KEY)')
+    c.execute(f'DELETE FROM temp.{name}')
+    c.executemany(f'INSERT OR IGNORE INTO temp.{name} VALUES (?)', ((int(t),) for t in ids))
+
+
+def diff_rows(conn, df):
+    #Split the csv into new and changed rows; unchanged rows are dropped here.
+    #Only the stored hashes of the trails in df are read, so this stays cheap per chunk.
+    hashes = row_hashes(df)
+    temp_ids(conn.cursor(), 'incoming', hashes.index)
+    stored = pd.read_sql_query('SELECT s.trailID, s.rowHash FROM SourceRows s JOIN temp.incoming i ON s.trailID=i.trailID',
+                               conn).set_index('trailID')['rowHash']
+    #Nullable ints keep the full 64 bits where a float NaN column would round them
+    stored = stored.astype('Int64').reindex(hashes.index)
+    is_new = stored.isna().to_numpy()
+    is_changed = ~is_new & (stored.fillna(0).to_numpy(dtype=np.int64) != hashes.to_numpy())
+    return df[is_new | is_changed], hashes[is_new | is_changed], int(is_new.sum()), int(is_changed.sum())
+
+
+def write_trails(conn, df, hashes, timings=None):
+    c = conn.cursor()
+    with timed(timings, 'parks'):
+        existing = pd.read_sql_query('SELECT parkName, parkID FROM NationalParks', conn)
+        new_parks, parks = make_parks(df, existing)
+        c.executemany('INSERT INTO NationalParks (parkName, parkID) VALUES (?,?)', records(new_parks))
+
+    temp_ids(c, 'changed', df['trail_id'])
+    with bulk_refresh(c, 'changed', timings):
+        with timed(timings, 'trails'):
+            trails = make_trails(df, parks)
+            insert_rows(c, 'INSERT INTO Trails (trailID, trailName, elevation_feet, length, difficulty, routeType, reviews, parkID, \
+                popularity, avg_rating, visitor_usage) \
+                VALUES (?,?,?,?,?,?,?,?,?,?,?) \
+                ON CONFLICT (trailID) DO UPDATE SET trailName=excluded.trailName, elevation_feet=excluded.elevation_feet, \
+                length=excluded.length, difficulty=excluded.difficulty, routeType=excluded.routeType, \
+                reviews=excluded.reviews, parkID=excluded.parkID, popularity=excluded.popularity, \
+                avg_rating=excluded.avg_rating, visitor_usage=excluded.visitor_usage', trails)
+
+        #Replace the per-trail rows of every trail we touched in one pass per table
+        with timed(timings, 'features'):
+            c.execute('DELETE FROM Features WHERE trailID IN (SELECT trailID FROM temp.changed)')
+            insert_rows(c, 'INSERT INTO Features (trailID, feature) VALUES (?,?)', make_features(df))
+        with timed(timings, 'activities'):
+            c.execute('DELETE FROM Activities WHERE trailID IN (SELECT trailID FROM temp.changed)')
+            insert_rows(c, 'INSERT INTO Activities (trailID, activity) VALUES (?,?)', make_activities(df))
+        with timed(timings, 'location'):
+            c.execute('DELETE FROM Location WHERE trailID IN (SELECT trailID FROM temp.changed)')
+            insert_rows(c, 'INSERT INTO Location (trailID, area_name, state, geolocation, lat, lng) VALUES (?,?,?,?,?,?)', make_location(df))
+
+    c.executemany('INSERT OR REPLACE INTO SourceRows (trailID, rowHash) VALUES (?,?)',
+                  zip(hashes.index.tolist(), hashes.tolist()))
+
+
+def prune_trails(conn, trail_ids):
+    #Remove trails that came from an earlier csv but are not in trail_ids any more. Trails
+    #added in the app never have a SourceRows entry, so they are left alone.
+    c = conn.cursor()
+    temp_ids(c, 'seen', trail_ids)
+    temp_ids(c, 'gone', [])
+    c.execute('INSERT INTO temp.gone SELECT trailID FROM SourceRows WHERE trailID NOT IN (SELECT trailID FROM temp.seen)')
+    gone = 'SELECT trailID FROM temp.gone'
+    with bulk_refresh(c, 'gone'):
+        for table in CHILD_TABLES + ['Trails']:
+            c.execute(f'DELETE FROM {table} WHERE trailID IN ({gone})')
+    c.execute(f'DELETE FROM SourceRows WHERE trailID IN ({gone})')
+    return c.rowcount
+
+
+def ingest(conn, df, prune=False, timings=None):
+    #timings, if given, collects the seconds spent in each stage (see write_trails)
+    df = df.drop_duplicates('trail_id', keep='last')
+    n_pruned = 0
+    #Everything below runs in one transaction, so a failed refresh leaves the old data in place
+    with timed(timings, 'total'), conn:
+        with timed(timings, 'diff'):
+            changed, hashes, n_new, n_changed = diff_rows(conn, df)
+        if not changed.empty:
+            write_trails(conn, changed, hashes, timings)
+        if prune:
+            with timed(timings, 'prune'):
+                n_pruned = prune_trails(conn, df['trail_id'])
+    return {'new': n_new, 'changed': n_changed, 'unchanged': len(df) - n_new - n_changed, 'pruned': n_pruned}
+
+
+def ingest_chunks(conn, csv_path, chunk_size, prune=False, timings=None):
+    #Streaming mode: every chunk is normalized into all tables and committed before the
+    #next one is read, so memory depends on chunk_size and not on the size of the csv.
+    #Only the trail ids are kept across chunks, for --prune.
+    totals = {'new': 0, 'changed': 0, 'unchanged': 0, 'pruned': 0}
+    seen = []
+    for chunk in pd.read_csv(csv_path, dtype=CSV_DTYPES, chunksize=chunk_size):
+        for key, value in ingest(conn, chunk, timings=timings).items():
+            totals[key] += value
+        if prune:
+            seen.append(chunk['trail_id'].to_numpy())
+    if prune and seen:
+        with conn:
+            totals['pruned'] = prune_trails(conn, np.concatenate(seen))
+    return totals
+
+
+def peak_rss_mb():
+    #Peak resident memory of this process; the resource module only exists on unix
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    #Linux reports kilobytes, macOS bytes
+    return peak / (1024*1024 if sys.platform == 'darwin' else 1024)
+
+
+## Refresh while the app runs ##
+
+#Tables only the app writes to; a shadow build takes them from the live file at the swap
+APP_TABLES = ['Users', 'TrailsUpdates']
+
+
+def shadow_path(db_path):
+    return Path(f'{db_path}.shadow')
+
+
+def load(conn, csv_path, rebuild=False, prune=False, chunk_size=0, timings=None):
+    #Everything a run of this file does to the database before the snapshot
+    if rebuild:
+        drop_tables(conn)
+    create_tables(conn)
+    migrate(conn)
+    if chunk_size > 0:
+        stats = ingest_chunks(conn, csv_path, chunk_size, prune=prune, timings=timings)
+    else:
+        #Read master dataset
+        with timed(timings, 'read_csv'):
+            df = pd.read_csv(csv_path, dtype=CSV_DTYPES)
+        stats = ingest(conn, df, prune=prune, timings=timings)
+    with timed(timings, 'similar'), conn:
+        similar.update(conn)
+    return stats
+
+
+def write_snapshot(conn, db_path, timings=None):
+    with timed(timings, 'snapshot'):
+        return snapshot.write(conn, snapshot.snapshot_path(db_path))
+
+
+def refresh_shadow(db_path, csv_path, rebuild=False, prune=False, chunk_size=0, with_snapshot=True,
+                   timings=None, progress=None, writer=None):
+    #Loads the csv into <db>.shadow, a copy of db_path taken with sqlite's online backup,
+    #while db_path carries on serving, then copies the result back over db_path the same way.
+    #Returns (stats, snapshot manifest). progress(stage) is called as each step starts.
+    #writer(swap), if given, must call swap(conn) with a connection to db_path that nothing
+    #else writes through meanwhile (repository.Writer); without it one is opened here.
+    progress = progress or (lambda stage: None)
+    shadow = shadow_path(db_path)
+    remove_database(shadow)
+    #The swap may run on another thread (the app's writer)
+    conn = connect(shadow, check_same_thread=False)
+    try:
+        progress('copy')
+        with timed(timings, 'copy'):
+            live = connect(db_path)
+            create_tables(live)
+            migrate(live)
+            live.backup(conn)
+            live.close()
+        version = conn.execute(snapshot.DATA_VERSION).fetchone()[1]
+        #A different database from here on, so it must never match the live file's snapshots
+        with conn:
+            conn.execute('UPDATE DataVersion SET databaseID=lower(hex(randomblob(8))) WHERE id=1')
+
+        progress('load')
+        stats = load(conn, csv_path, rebuild, prune, chunk_size, timings)
+        manifest = None
+        if with_snapshot:
+            progress('snapshot')
+            manifest = write_snapshot(conn, db_path, timings)
+
+        progress('swap')
+        with timed(timings, 'swap'):
+            swap = lambda live: swap_in(conn, live, db_path, version)
+            if writer:
+                writer(swap)
+            else:
+                live = connect(db_path, isolation_level=None)
+                try:
+                    swap(live)
+                finally:
+                    live.close()
+        return stats, manifest
+    finally:
+        conn.close()
+        remove_database(shadow)
+
+
+def swap_in(shadow, live, db_path, version):
+    #Copies the shadow database over the live one. Users and TrailsUpdates are first taken
+    #from the live file, with it locked for writing, to keep what was written to them during
+    #the load. If trails were changed in the meantime (DataVersion moved on) nothing is
+    #copied and RuntimeError is raised. The backup runs as one write transaction on live,
+    #so its readers see the old data until it commits and the new data after.
+    live.execute('BEGIN IMMEDIATE')
+    try:
+        if live.execute(snapshot.DATA_VERSION).fetchone()[1] != version:
+            raise RuntimeError('trails were changed in the app during the refresh, run it again')
+        shadow.execute('ATTACH DATABASE ? AS live', (str(db_path),))
+        with shadow:
+            for table in APP_TABLES:
+                shadow.execute(f'DELETE FROM main.{table}')
+                shadow.execute(f'INSERT INTO main.{table} SELECT * FROM live.{table}')
+        shadow.execute('DETACH DATABASE live')
+    finally:
+        live.rollback()
+    shadow.backup(live)
+    live.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+
+
+def remove_database(path):
+    for name in [path, f'{path}-journal', f'{path}-wal', f'{path}-shm']:
+        Path(name).unlink(missing_ok=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Load trails-data.csv into the project database')
+    parser.add_argument('--csv', default=CSV_PATH)
+    parser.add_argument('--db', default=DB_PATH)
+    parser.add_argument('--rebuild', action='store_true', help='drop the csv tables and reload everything')
+    parser.add_argument('--prune', action='store_true', help='delete csv trails that are no longer in the file')
+    parser.add_argument('--chunk-size', type=int, default=0,
+                        help='stream the csv in chunks of this many rows, committing after each chunk')
+    parser.add_argument('--shadow', action='store_true',
+                        help='load into a copy and swap it in at the end, so a running app keeps serving')
+    parser.add_argument('--no-snapshot', action='store_true', help='do not write the Arrow snapshot for the app')
+    parser.add_argument('--timings', action='store_true', help='print the seconds spent in each load stage')
+    args = parser.parse_args(argv)
+
+    timings = {} if args.timings else None
+    if args.shadow:
+        stats, manifest = refresh_shadow(args.db, args.csv, args.rebuild, args.prune, args.chunk_size,
+                                         not args.no_snapshot, timings, progress=lambda stage: print(f'{stage}...'))
+    else:
+        #Connect to the server
+        conn = connect(args.db)
+        stats = load(conn, args.csv, args.rebuild, args.prune, args.chunk_size, timings)
+        manifest = None if args.no_snapshot else write_snapshot(conn, args.db, timings)
+        conn.close()
+    print('{new} new, {changed} changed, {unchanged} unchanged, {pruned} pruned trails'.format(**stats))
+    if manifest is not None:
+        print(f'snapshot {manifest["databaseID"]}-{manifest["version"]}')
+    elif not args.no_snapshot:
+        print('pyarrow is not installed, no snapshot written')
+    if timings:
+        print(', '.join(f'{stage} {seconds:.2f}s' for stage, seconds in timings.items()))
+    peak = peak_rss_mb()
+    if peak is not None:
+        print(f'peak RSS: {peak:.0f} MB')
+
+
+if __name__ == '__main__':
+    main()
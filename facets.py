@@ -0,0 +1,246 @@
+### In-memory bitmap index for the faceted search ###
+#
+# Every trail gets a position, and every facet value (a state, a park, a difficulty, ...) a
+# bitmap of the positions that have it, held as a python int. A search ANDs one OR-of-values
+# per facet, and the count shown next to a value is the popcount of its bitmap ANDed with the
+# filters of all the other facets, so changing a filter never re-aggregates the tables.
+# Deleting a trail clears its bit in `alive`; editing one deletes it and adds it again at a
+# new position, so the value bitmaps are only ever appended to. The feature and activity
+# bitmaps double as the inverted index behind tag expressions like 'lake AND NOT camping'.
+# Matches are returned best rank first by walking a ranking.RankOrder of the positions.
+
+import re
+import threading
+
+import numpy as np
+import pandas as pd
+
+import ranking
+
+FACETS = ['state', 'park', 'difficulty', 'routeType', 'length_band', 'elevation_band', 'feature', 'activity']
+#Band edges for the length (mi) and elevation (ft) facets; the last band is open ended
+LENGTH_BANDS = [0, 1, 3, 5, 10, 20]
+ELEVATION_BANDS = [0, 250, 500, 1000, 2000, 4000]
+
+
+def band_labels(edges, unit):
+    return [f'{lo}-{hi} {unit}' for lo, hi in zip(edges, edges[1:])] + [f'{edges[-1]}+ {unit}']
+
+
+def bands(values, edges, unit):
+    #Band label for each value, e.g. '3-5 mi' or '20+ mi'; None where the value isn't a number
+    labels = band_labels(edges, unit)
+    values = pd.to_numeric(pd.Series(values), errors='coerce')
+    cut = pd.cut(values, [-np.inf] + edges[1:] + [np.inf], labels=labels, right=False)
+    return cut.astype(object).where(values.notna(), None)
+
+
+TAG_TOKEN = re.compile(r'\(|\)|[^\s()]+')
+
+
+def parse_tags(expression):
+    #'dogs-leash AND (waterfall OR lake) NOT camping' -> ('and', ('tag', 'dogs-leash'),
+    #('or', ('tag', 'waterfall'), ('tag', 'lake')), ('not', ('tag', 'camping'))).
+    #NOT binds tightest, then AND, then OR; tags written next to each other are ANDed.
+    tokens = TAG_TOKEN.findall(expression)
+    position = 0
+
+    def peek():
+        return tokens[position].upper() if position < len(tokens) else None
+
+    def take():
+        nonlocal position
+        position += 1
+        return tokens[position-1]
+
+    def either():
+        terms = [both()]
+        while peek() == 'OR':
+            take()
+            terms.append(both())
+        return terms[0] if len(terms) == 1 else ('or', *terms)
+
+    def both():
+        terms = [negated()]
+        while peek() not in (None, 'OR', ')'):
+            if peek() == 'AND':
+                take()
+            terms.append(negated())
+        return terms[0] if len(terms) == 1 else ('and', *terms)
+
+    def negated():
+        if peek() == 'NOT':
+            take()
+            return ('not', negated())
+        if peek() == '(':
+            take()
+            node = either()
+            if peek() != ')':
+                raise ValueError('missing )')
+            take()
+            return node
+        if peek() in (None, 'AND', 'OR', ')'):
+            raise ValueError(f'expected a tag, found {take() if peek() else "the end"}')
+        return ('tag', take().lower())
+
+    if not tokens:
+        raise ValueError('empty expression')
+    tree = either()
+    if position < len(tokens):
+        raise ValueError(f'unexpected {tokens[position]}')
+    return tree
+
+
+def to_bitmap(mask):
+    #Boolean array -> int with bit i set where mask[i]
+    return int.from_bytes(np.packbits(mask, bitorder='little').tobytes(), 'little')
+
+
+def to_mask(bitmap, size):
+    #int -> boolean array of its bits below size
+    raw = np.frombuffer(bitmap.to_bytes((size+7)//8, 'little'), dtype=np.uint8)
+    return np.unpackbits(raw, bitorder='little')[:size].view(bool)
+
+
+def to_positions(bitmap, size):
+    #int -> sorted array of the set bit positions below size
+    return np.flatnonzero(to_mask(bitmap, size))
+
+
+class FacetIndex:
+    #trails has one row per trail with at least trailID, state, parkName, difficulty,
+    #routeType, length, elevation_feet and rank. features and activities have
+    #(trailID, tag) rows.
+
+    def __init__(self, trails, features, activities):
+        self.lock = threading.Lock()
+        self.size = 0
+        self.alive = 0
+        self.positions = {}
+        self.trail_ids = np.empty(0, dtype=np.int64)
+        self.length = np.empty(0)
+        self.elevation = np.empty(0)
+        self.ranks = ranking.RankOrder()
+        self.bitmaps = {facet: {} for facet in FACETS}
+        #Bands are listed in order, not in the order they are first seen
+        self.bitmaps['length_band'] = dict.fromkeys(band_labels(LENGTH_BANDS, 'mi'), 0)
+        self.bitmaps['elevation_band'] = dict.fromkeys(band_labels(ELEVATION_BANDS, 'ft'), 0)
+        self.append(trails, features, activities)
+
+    def append(self, trails, features, activities):
+        #Gives each trail the next free position and ORs it into its values' bitmaps
+        trails = trails.drop_duplicates('trailID', keep='last').reset_index(drop=True)
+        start = self.size
+        self.size += len(trails)
+        for trail_id in trails['trailID'].tolist():
+            old = self.positions.get(trail_id)
+            if old is not None:
+                self.alive &= ~(1 << old)
+        self.positions.update(zip(trails['trailID'].tolist(), range(start, self.size)))
+        self.alive |= ((1 << len(trails)) - 1) << start
+
+        self.trail_ids = np.concatenate([self.trail_ids, trails['trailID'].to_numpy(dtype=np.int64)])
+        for name, column in [('length', 'length'), ('elevation', 'elevation_feet')]:
+            values = pd.to_numeric(trails[column], errors='coerce').to_numpy(dtype=float)
+            setattr(self, name, np.concatenate([getattr(self, name), values]))
+        self.ranks.insert(pd.to_numeric(trails['rank'], errors='coerce').to_numpy(dtype=float), start)
+
+        values = trails[['state', 'parkName', 'difficulty', 'routeType']].rename(columns={'parkName': 'park'})
+        values['length_band'] = bands(trails['length'], LENGTH_BANDS, 'mi').to_numpy()
+        values['elevation_band'] = bands(trails['elevation_feet'], ELEVATION_BANDS, 'ft').to_numpy()
+        pairs = [(facet, values[facet].to_numpy(), np.arange(start, self.size)) for facet in values.columns]
+        for facet, tags, column in [('feature', features, 'feature'), ('activity', activities, 'activity')]:
+            tags = tags[tags['trailID'].isin(trails['trailID'])]
+            pairs.append((facet, tags[column].to_numpy(), tags['trailID'].map(self.positions).to_numpy()))
+
+        for facet, keys, positions in pairs:
+            found = pd.Series(positions).groupby(keys, dropna=True, sort=False).indices
+            for value, rows in found.items():
+                if value == '':
+                    continue
+                value = value.item() if isinstance(value, np.generic) else value
+                mask = np.zeros(self.size, dtype=bool)
+                mask[positions[rows]] = True
+                bitmaps = self.bitmaps[facet]
+                bitmaps[value] = bitmaps.get(value, 0) | to_bitmap(mask)
+
+    def refresh(self, trail_ids, trails, features, activities):
+        #Drops trail_ids, then adds back the ones still in the database (the rows passed in)
+        with self.lock:
+            for trail_id in trail_ids:
+                position = self.positions.pop(trail_id, None)
+                if position is not None:
+                    self.alive &= ~(1 << position)
+            if len(trails):
+                self.append(trails, features, activities)
+
+    def ranges(self, length_range=None, elevation_range=None):
+        #Bitmap of trails inside both ranges; None means no limit
+        mask = np.ones(self.size, dtype=bool)
+        for values, limits in [(self.length, length_range), (self.elevation, elevation_range)]:
+            if limits is not None:
+                mask &= (values >= limits[0]) & (values <= limits[1])
+        return to_bitmap(mask)
+
+    def search(self, selected, length_range=None, elevation_range=None, limit=500):
+        #selected maps a facet to the values picked for it (OR within a facet, AND across).
+        #Returns (total, trailIDs of the top `limit` by rank, {facet: {value: count}}) with
+        #each facet's counts taken under every filter except its own.
+        with self.lock:
+            filters = {facet: self.union(facet, values) for facet, values in selected.items() if values}
+            base = self.alive
+            if length_range is not None or elevation_range is not None:
+                base &= self.ranges(length_range, elevation_range)
+            counts = {}
+            for facet in FACETS:
+                others = base
+                for other, bitmap in filters.items():
+                    if other != facet:
+                        others &= bitmap
+                counts[facet] = {value: (others & bitmap).bit_count() for value, bitmap in self.bitmaps[facet].items()}
+            found = base
+            for bitmap in filters.values():
+                found &= bitmap
+            return *self.top(found, limit), counts
+
+    def top(self, found, limit):
+        #(number of trails in the bitmap, trailIDs of the `limit` best ranked of them)
+        if not limit:
+            return found.bit_count(), []
+        return found.bit_count(), self.trail_ids[self.ranks.top(to_mask(found, self.size), limit)].tolist()
+
+    def tag_search(self, expression, limit=500):
+        #(total, top trailIDs) for a tag expression over features and activities; see parse_tags
+        tree = parse_tags(expression)
+        with self.lock:
+            return self.top(self.alive & self.evaluate(tree), limit)
+
+    def evaluate(self, node):
+        if node[0] == 'tag':
+            tag = node[1]
+            if tag not in self.bitmaps['feature'] and tag not in self.bitmaps['activity']:
+                raise ValueError(f'unknown feature or activity: {tag}')
+            return self.bitmaps['feature'].get(tag, 0) | self.bitmaps['activity'].get(tag, 0)
+        if node[0] == 'not':
+            return self.alive & ~self.evaluate(node[1])
+        bitmaps = [self.evaluate(child) for child in node[1:]]
+        found = bitmaps[0]
+        for bitmap in bitmaps[1:]:
+            found = found & bitmap if node[0] == 'and' else found | bitmap
+        return found
+
+    def tags(self):
+        return sorted(set(self.bitmaps['feature']) | set(self.bitmaps['activity']))
+
+    def union(self, facet, values):
+        bitmap = 0
+        for value in values:
+            bitmap |= self.bitmaps[facet].get(value, 0)
+        return bitmap
+
+    def limits(self):
+        #(min, max) of length and elevation over the live trails, for the range sliders
+        with self.lock:
+            live = to_positions(self.alive, self.size)
+            return {name: (float(np.nanmin(values[live], initial=0)), float(np.nanmax(values[live], initial=0)))
+                    for name, values in [('length', self.length), ('elevation', self.elevation)]}
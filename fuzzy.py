@@ -0,0 +1,215 @@
+### Typo-tolerant name search: trigram index + edit distance ###
+#
+# Every distinct trail, park and area name is lowercased, stripped of accents and
+# punctuation and padded ('  harding ice field trail '), and each of its three-letter
+# slices (trigrams) is listed in a posting array of the names that contain it. A search
+# counts, for every name, how many trigrams of the term it shares (one np.bincount over the
+# postings of the term's rarer trigrams, leaving out those so common they would match
+# nearly every name), keeps the CANDIDATES names sharing the most, and ranks only those by edit
+# distance between the term and the closest-matching part of the name. So 'hardng ice
+# feild' finds 'Harding Ice Field Trail' without comparing the term to every name.
+#
+# The postings built at start are one sorted array; names added later go to small
+# per-trigram lists next to it. A name stays in the index once added, but only names that
+# a live trail still carries are returned: like store.TrailStore, trails are appended to
+# positions, and a deleted or edited trail gives up its position and its share of the name.
+
+import threading
+import unicodedata
+
+import numpy as np
+import pandas as pd
+
+KINDS = {'trail': 'trailName', 'park': 'parkName', 'area': 'area_name'}
+#Most postings read per search, taking the term's rarest trigrams first...
+HITS = 150000
+#...but never fewer than this many trigrams
+MIN_TRIGRAMS = 3
+#Share of the term's (used) trigrams a name must have to be a candidate
+MIN_OVERLAP = 0.3
+#Candidates ranked by edit distance
+CANDIDATES = 100
+#Longest name compared, in characters
+MAX_NAME = 120
+
+#Byte table: letters to lower case, everything but letters and digits to a space
+FOLD = bytes(ord(chr(c).lower()) if chr(c).isalnum() else ord(' ') for c in range(128)) + b' ' * 128
+NO_TRIGRAM = 1 << 21
+
+
+def normalize(name):
+    #'Hárding Ice-Field  Trail' -> 'harding ice field trail'
+    name = str(name)
+    if not name.isascii():
+        name = unicodedata.normalize('NFKD', name).encode('ascii', 'ignore').decode()
+    return ' '.join(name.encode().translate(FOLD).decode().split())[:MAX_NAME]
+
+
+def trigram_codes(keys, chunk=50000):
+    #(name number, trigram code) of every distinct trigram of each normalized key, a trigram
+    #packed as three 7-bit characters; chunk names at a time keep the work arrays small
+    rows, codes = [np.empty(0, dtype=np.int64)], [np.empty(0, dtype=np.int64)]
+    for start in range(0, len(keys), chunk):
+        padded = np.array([f'  {key} ' for key in keys[start:start+chunk]], dtype=f'S{MAX_NAME+3}')
+        chars = padded.view(np.uint8).reshape(len(padded), -1).astype(np.int32)
+        packed = chars[:, :-2] << 14 | chars[:, 1:-1] << 7 | chars[:, 2:]
+        #Sort each name's trigrams, with the slots past its end last, to drop the repeats
+        packed[np.arange(packed.shape[1]) >= (np.char.str_len(padded) - 2)[:, None]] = NO_TRIGRAM
+        packed.sort(axis=1)
+        keep = packed != NO_TRIGRAM
+        keep[:, 1:] &= packed[:, 1:] != packed[:, :-1]
+        rows.append(np.nonzero(keep)[0] + start)
+        codes.append(packed[keep].astype(np.int64))
+    return np.concatenate(rows), np.concatenate(codes)
+
+
+def edit_distances(term, names):
+    #Fewest single-character edits turning term into some substring of each name, for
+    #all names at once: one row of the dynamic program per character of term, with the
+    #insertions along the row done by a running minimum
+    width = max(map(len, names))
+    chars = np.array(names, dtype=f'S{width}').view(np.uint8).reshape(len(names), width)
+    steps = np.arange(width + 1)
+    row = np.zeros((len(names), width + 1), dtype=np.int16)
+    for i, char in enumerate(term.encode(), 1):
+        above = row
+        row = np.empty_like(above)
+        row[:, 0] = i
+        row[:, 1:] = np.minimum(above[:, :-1] + (chars != char), above[:, 1:] + 1)
+        row = np.minimum.accumulate(row - steps, axis=1) + steps
+    lengths = np.array([len(n) for n in names])
+    return np.where(steps <= lengths[:, None], row, np.iinfo(np.int16).max).min(axis=1)
+
+
+class NameIndex:
+    #trails has trailID and the KINDS columns, one row per trail
+
+    def __init__(self, trails):
+        self.lock = threading.Lock()
+        self.keys, self.names = [], []
+        self.kinds = np.empty(0, dtype=np.int8)
+        self.sizes = np.empty(0, dtype=np.int64)
+        self.lookup = {}
+        self.carried = np.empty(0, dtype=np.int64)
+        self.positions = {}
+        self.alive = np.empty(0, dtype=bool)
+        self.entries = np.empty((0, len(KINDS)), dtype=np.int64)
+        self.added = {}
+        self.codes = None
+        rows, codes = self.append(trails)
+        #The names so far go into one posting array sorted by trigram, instead of the added lists
+        pairs = np.sort(codes << 32 | rows)
+        codes = pairs >> 32
+        starts = np.flatnonzero(np.diff(codes, prepend=-1))
+        self.codes = codes[starts]
+        self.offsets = np.append(starts, len(pairs))
+        self.postings = pairs & 0xFFFFFFFF
+
+    def append(self, trails):
+        #Returns the (name number, trigram code) pairs of the names it added
+        trails = trails.drop_duplicates('trailID', keep='last').reset_index(drop=True)
+        start, named = len(self.alive), len(self.keys)
+        entries = np.full((len(trails), len(KINDS)), -1, dtype=np.int64)
+        kinds = []
+        for k, (kind, column) in enumerate(KINDS.items()):
+            present = trails[column].notna().to_numpy()
+            names = trails.loc[present, column]
+            ids = {}
+            for name in names.unique().tolist():
+                key = normalize(name)
+                if key:
+                    found = self.lookup.get((kind, key))
+                    if found is None:
+                        found = self.lookup[(kind, key)] = len(self.keys)
+                        self.keys.append(key)
+                        self.names.append(str(name))
+                        kinds.append(k)
+                    ids[name] = found
+            entries[present, k] = names.map(ids).fillna(-1).to_numpy(dtype=np.int64)
+        self.kinds = np.concatenate([self.kinds, np.array(kinds, dtype=np.int8)])
+        self.carried = np.concatenate([self.carried, np.zeros(len(self.keys) - named, dtype=np.int64)])
+        rows, codes = trigram_codes(self.keys[named:])
+        self.sizes = np.concatenate([self.sizes, np.bincount(rows, minlength=len(self.keys) - named)])
+        rows += named
+        if self.codes is not None:
+            for row, code in zip(rows.tolist(), codes.tolist()):
+                self.added.setdefault(code, []).append(row)
+
+        alive = np.concatenate([self.alive, np.ones(len(trails), dtype=bool)])
+        trail_ids = trails['trailID'].tolist()
+        for trail_id in trail_ids:
+            if trail_id in self.positions:
+                alive[self.positions[trail_id]] = False
+                self.release(self.positions[trail_id])
+        self.carried += np.bincount(entries[entries >= 0], minlength=len(self.carried))
+        self.entries = np.concatenate([self.entries, entries])
+        self.positions.update(zip(trail_ids, range(start, start+len(trails))))
+        self.alive = alive
+        return rows, codes
+
+    def release(self, position):
+        held = self.entries[position]
+        self.carried[held[held >= 0]] -= 1
+
+    def refresh(self, trail_ids, trails):
+        #Drops trail_ids, then adds back the ones still in the database (the rows passed in)
+        with self.lock:
+            alive = self.alive.copy()
+            for trail_id in trail_ids:
+                position = self.positions.pop(trail_id, None)
+                if position is not None and alive[position]:
+                    alive[position] = False
+                    self.release(position)
+            self.alive = alive
+            if len(trails):
+                self.append(trails)
+
+    def posting(self, code):
+        at = np.searchsorted(self.codes, code)
+        found = self.postings[self.offsets[at]:self.offsets[at+1]] if at < len(self.codes) and self.codes[at] == code \
+            else np.empty(0, dtype=np.int64)
+        added = self.added.get(code)
+        return np.concatenate([found, added]) if added else found
+
+    def search(self, term, limit=20, kinds=tuple(KINDS)):
+        #DataFrame of kind, name and distance (edits) for the names closest to term, fewest
+        #edits first; names needing more than a quarter of the term's length in edits are left out
+        key = normalize(term)
+        found = pd.DataFrame({'kind': pd.Series(dtype=object), 'name': pd.Series(dtype=object),
+                              'distance': pd.Series(dtype=np.int64)})
+        if not key:
+            return found
+        term_codes = trigram_codes([key])[1]
+        with self.lock:
+            #The rarest trigrams the index has, until HITS postings are read (at least MIN_TRIGRAMS)
+            postings = sorted((p for p in map(self.posting, term_codes.tolist()) if len(p)), key=len)
+            hits = np.cumsum([len(p) for p in postings])
+            used = postings[:max(MIN_TRIGRAMS, int(np.searchsorted(hits, HITS, side='right')))]
+            if not used:
+                return found
+            #How many of the used trigrams each name shares, counted into an array over all
+            #names; only the names over the bar are looked at after that
+            shared = np.bincount(np.concatenate(used), minlength=len(self.keys))
+            candidates = np.flatnonzero(shared >= max(1, int(np.ceil(MIN_OVERLAP * len(used)))))
+            overlap = shared[candidates]
+            #Raise the bar while at least CANDIDATES names still clear it
+            clearing = np.cumsum(np.bincount(overlap)[::-1])[::-1]
+            need = int(np.flatnonzero(clearing >= CANDIDATES)[-1:].sum())
+            keep = (overlap >= need) & (self.carried[candidates] > 0)
+            if set(kinds) != set(KINDS):
+                keep &= np.isin(self.kinds[candidates], [list(KINDS).index(k) for k in kinds])
+            candidates, overlap = candidates[keep], overlap[keep]
+            #Jaccard similarity of the trigram sets, so a short name sharing as many trigrams wins
+            similarity = overlap / (self.sizes[candidates] + len(term_codes) - overlap)
+            if len(candidates) > CANDIDATES:
+                best = np.argpartition(-similarity, CANDIDATES-1)[:CANDIDATES]
+                candidates, similarity = candidates[best], similarity[best]
+            if not len(candidates):
+                return found
+            distance = edit_distances(key, [self.keys[c] for c in candidates])
+            close = distance <= max(1, len(key) // 4)
+            candidates, similarity, distance = candidates[close], similarity[close], distance[close]
+            order = np.lexsort((-similarity, distance))[:limit]
+            return pd.DataFrame({'kind': [list(KINDS)[k] for k in self.kinds[candidates[order]]],
+                                 'name': [self.names[c] for c in candidates[order]],
+                                 'distance': distance[order].astype(np.int64)})
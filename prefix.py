@@ -0,0 +1,173 @@
+### Name completions: sorted prefix index over trail and park names ###
+#
+# Every distinct trail and park name is normalized as in fuzzy.py ('Mt. Rainier' ->
+# 'mt rainier') and kept in one sorted list per kind, so the names starting with what was
+# typed are one bisect range. Each name scores the reviews of the live trails carrying it,
+# and a completion is the highest scoring names in the range: ranges of up to SCAN names are
+# ranked when asked, longer ones (short prefixes at scale) are ranked at build and cached
+# until a name in them changes score.
+#
+# Names added after the build go to a small sorted list per kind that is merged in at
+# query time. Like store.TrailStore, trails are appended to positions, and a deleted or
+# edited trail gives up its position and its reviews. Park names from NationalParks stay
+# offered with no trails, so the first trail of a park can be added.
+
+import bisect
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+import fuzzy
+
+KINDS = {'trail': 'trailName', 'park': 'parkName'}
+#Ranges of up to this many names are ranked when asked instead of cached
+SCAN = 512
+#Completions kept per cached prefix, the most a caller gets
+CACHED = 100
+#Sorts after every character of a normalized name
+END = '\x7f'
+
+
+class PrefixIndex:
+    #trails has trailID, trailName, parkName and reviews, one row per trail; parks is every
+    #park name, offered even before it has trails
+
+    def __init__(self, trails, parks=()):
+        self.lock = threading.Lock()
+        self.keys, self.names = [], []
+        self.kinds = np.empty(0, dtype=np.int8)
+        self.reviews = np.empty(0, dtype=np.float64)
+        self.carried = np.empty(0, dtype=np.int64)
+        self.kept = np.empty(0, dtype=bool)
+        self.lookup = {}
+        self.positions = {}
+        self.alive = np.empty(0, dtype=bool)
+        self.entries = np.empty((0, len(KINDS)), dtype=np.int64)
+        self.trail_reviews = np.empty(0, dtype=np.float64)
+        self.cache = {}
+        self.sorted = None
+        self.added = {kind: [] for kind in KINDS}
+        self.new_kinds = []
+        self.append(trails, parks)
+        self.sorted = {}
+        for k, kind in enumerate(KINDS):
+            ids = sorted(np.flatnonzero(self.kinds == k).tolist(), key=self.keys.__getitem__)
+            keys = [self.keys[i] for i in ids]
+            self.sorted[kind] = (keys, np.array(ids, dtype=np.int64))
+            #Every range of 2*SCAN names or more holds a pair SCAN apart at a multiple of
+            #SCAN, and its prefix is a prefix of what that pair has in common
+            shared = {os.path.commonprefix([keys[i], keys[i+SCAN]]) for i in range(0, len(keys) - SCAN, SCAN)}
+            for key in {key[:length] for key in shared for length in range(len(key) + 1)}:
+                self.ranked(kind, key)
+
+    def entry(self, kind, name):
+        #Id of the (kind, name) entry, added if new; None for a name with no letters or digits
+        found = self.lookup.get((kind, name))
+        if found is None:
+            key = fuzzy.normalize(name)
+            if not key:
+                return None
+            found = self.lookup[(kind, name)] = len(self.keys)
+            self.keys.append(key)
+            self.names.append(name)
+            self.new_kinds.append(list(KINDS).index(kind))
+            if self.sorted is not None:
+                bisect.insort(self.added[kind], (key, found))
+        return found
+
+    def append(self, trails, parks=()):
+        trails = trails.drop_duplicates('trailID', keep='last').reset_index(drop=True)
+        start, named = len(self.alive), len(self.keys)
+        entries = np.full((len(trails), len(KINDS)), -1, dtype=np.int64)
+        for k, (kind, column) in enumerate(KINDS.items()):
+            present = trails[column].notna().to_numpy()
+            names = trails.loc[present, column].astype(str)
+            ids = {name: self.entry(kind, name) for name in names.unique().tolist()}
+            entries[present, k] = names.map(ids).fillna(-1).to_numpy(dtype=np.int64)
+        parks = [self.entry('park', str(name)) for name in parks]
+        self.kinds = np.concatenate([self.kinds, np.array(self.new_kinds, dtype=np.int8)])
+        self.new_kinds = []
+        grown = len(self.keys) - named
+        self.reviews = np.concatenate([self.reviews, np.zeros(grown)])
+        self.carried = np.concatenate([self.carried, np.zeros(grown, dtype=np.int64)])
+        self.kept = np.concatenate([self.kept, np.zeros(grown, dtype=bool)])
+        self.kept[[p for p in parks if p is not None]] = True
+
+        reviews = pd.to_numeric(trails['reviews'], errors='coerce').fillna(0).to_numpy(dtype=np.float64)
+        alive = np.concatenate([self.alive, np.ones(len(trails), dtype=bool)])
+        trail_ids = trails['trailID'].tolist()
+        for trail_id in trail_ids:
+            if trail_id in self.positions:
+                alive[self.positions[trail_id]] = False
+                self.release(self.positions[trail_id])
+        held = entries >= 0
+        self.carried += np.bincount(entries[held], minlength=len(self.keys))
+        self.reviews += np.bincount(entries[held], weights=np.broadcast_to(reviews[:, None], entries.shape)[held],
+                                    minlength=len(self.keys))
+        self.entries = np.concatenate([self.entries, entries])
+        self.trail_reviews = np.concatenate([self.trail_reviews, reviews])
+        self.positions.update(zip(trail_ids, range(start, start+len(trails))))
+        self.alive = alive
+        if self.sorted is not None:
+            self.touch(np.unique(entries[held]))
+
+    def release(self, position):
+        held = self.entries[position]
+        held = held[held >= 0]
+        self.carried[held] -= 1
+        self.reviews[held] -= self.trail_reviews[position]
+        self.touch(held)
+
+    def touch(self, ids):
+        #Drops the cached completions of every prefix of these names, whose scores changed
+        for i in ids.tolist():
+            kind, key = list(KINDS)[self.kinds[i]], self.keys[i]
+            for length in range(len(key) + 1):
+                self.cache.pop((kind, key[:length]), None)
+
+    def refresh(self, trail_ids, trails):
+        #Drops trail_ids, then adds back the ones still in the database (the rows passed in)
+        with self.lock:
+            alive = self.alive.copy()
+            for trail_id in trail_ids:
+                position = self.positions.pop(trail_id, None)
+                if position is not None and alive[position]:
+                    alive[position] = False
+                    self.release(position)
+            self.alive = alive
+            if len(trails):
+                self.append(trails)
+
+    def top(self, ids):
+        #The CACHED highest scoring of ids that are offered, best first; ties in name order
+        #when ids are
+        ids = ids[(self.carried[ids] > 0) | self.kept[ids]]
+        if len(ids) > CACHED:
+            ids = ids[np.sort(np.argpartition(-self.reviews[ids], CACHED-1)[:CACHED])]
+        return ids[np.argsort(-self.reviews[ids], kind='stable')]
+
+    def ranked(self, kind, key):
+        keys, ids = self.sorted[kind]
+        found = self.cache.get((kind, key))
+        if found is None:
+            lo, hi = bisect.bisect_left(keys, key), bisect.bisect_left(keys, key + END)
+            found = self.top(ids[lo:hi])
+            if hi - lo > SCAN:
+                self.cache[(kind, key)] = found
+        added = self.added[kind]
+        lo, hi = bisect.bisect_left(added, (key,)), bisect.bisect_left(added, (key + END,))
+        if hi > lo:
+            found = self.top(np.concatenate([found, [i for _, i in added[lo:hi]]]).astype(np.int64))
+        return found
+
+    def complete(self, prefix, limit=10, kinds=tuple(KINDS)):
+        #[(kind, name)] of the limit (at most CACHED) most reviewed names starting with prefix
+        key = fuzzy.normalize(prefix)
+        if prefix[-1:].isspace() and key:
+            key += ' '
+        with self.lock:
+            found = np.concatenate([self.ranked(kind, key)[:limit] for kind in kinds])
+            found = found[np.argsort(-self.reviews[found], kind='stable')][:limit]
+            return [(list(KINDS)[self.kinds[i]], self.names[i]) for i in found.tolist()]
@@ -0,0 +1,95 @@
+### Query timing for the Performance page ###
+#
+# repository.py runs every database call (and every in-memory search) inside
+# QueryStats.measure, which records its wall time, the rows it returned, how many sqlite VM
+# steps it took (counted with set_progress_handler) and how many statements it ran (counted
+# with set_trace_callback, which also sees the statements pandas and executemany issue).
+# Calls are grouped by a fingerprint of the SQL with literals and IN lists folded, and the
+# last ROLLING_WINDOW calls are kept for the p50/p95/p99 on the Performance page. With a
+# dump path set, every call is also appended to that file as one JSON line.
+
+import json
+import re
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+import pandas as pd
+
+ROLLING_WINDOW = 10000
+#The progress handler runs every PROGRESS_STEP sqlite VM instructions
+PROGRESS_STEP = 1000
+QUERY_LOG = 'query-log.jsonl'
+
+LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+LISTS = re.compile(r'\?(?:\s*,\s*\?)+')
+
+
+def fingerprint(sql):
+    #"SELECT * FROM t WHERE a IN (1, 2, 'x')  LIMIT 5" -> "SELECT * FROM t WHERE a IN (?, ...) LIMIT ?"
+    sql = LITERALS.sub('?', ' '.join(sql.split()))
+    return LISTS.sub('?, ...', sql)
+
+
+class QueryStats:
+
+    def __init__(self, size=ROLLING_WINDOW):
+        self.lock = threading.Lock()
+        self.calls = deque(maxlen=size)
+        self.dump_path = None
+
+    @contextmanager
+    def measure(self, sql, conn=None):
+        #Yields a dict; set record['rows'] inside the block to record the rows returned
+        record = {'rows': None}
+        steps, statements = [0], [0]
+        if conn is not None:
+            def tick():
+                steps[0] += 1
+            def trace(statement):
+                statements[0] += 1
+            conn.set_progress_handler(tick, PROGRESS_STEP)
+            conn.set_trace_callback(trace)
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            elapsed = time.perf_counter() - start
+            if conn is not None:
+                conn.set_progress_handler(None, 0)
+                conn.set_trace_callback(None)
+            self.add({'fingerprint': fingerprint(sql), 'ms': elapsed*1000, 'rows': record['rows'],
+                      'vm_steps': steps[0]*PROGRESS_STEP, 'statements': statements[0],
+                      'at': datetime.now(timezone.utc).isoformat(timespec='milliseconds')})
+
+    def add(self, call):
+        with self.lock:
+            self.calls.append(call)
+            if self.dump_path:
+                with open(self.dump_path, 'a') as log:
+                    log.write(json.dumps(call) + '\n')
+
+    def reset(self):
+        with self.lock:
+            self.calls.clear()
+
+    def summary(self):
+        #One row per fingerprint, slowest total first
+        with self.lock:
+            calls = pd.DataFrame(list(self.calls), columns=['fingerprint', 'ms', 'rows', 'vm_steps', 'statements', 'at'])
+        calls = calls.astype({'ms': float, 'rows': float, 'vm_steps': float, 'statements': float})
+        grouped = calls.groupby('fingerprint')
+        found = pd.DataFrame({
+            'calls': grouped.size(),
+            'p50_ms': grouped['ms'].quantile(0.5),
+            'p95_ms': grouped['ms'].quantile(0.95),
+            'p99_ms': grouped['ms'].quantile(0.99),
+            'max_ms': grouped['ms'].max(),
+            'total_ms': grouped['ms'].sum(),
+            'rows': grouped['rows'].mean(),
+            'vm_steps': grouped['vm_steps'].mean(),
+            'statements': grouped['statements'].mean(),
+        })
+        return found.sort_values('total_ms', ascending=False).reset_index()
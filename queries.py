@@ -0,0 +1,173 @@
+### Every SQL statement issued by trails_app_USE_THIS.py ###
+#
+# Keeping them in one place lets benchmarks/query_plans.py run EXPLAIN QUERY PLAN on each of
+# them. Any new query the app needs goes here, not inline in the app. Reads of whole trails
+# go to TrailCard (see database.py), which already holds the park, location and tags. User input only ever
+# travels as a ? parameter (lists as one JSON array, read back with json_each), so each
+# statement has one fixed text that sqlite3 compiles once per connection and then reuses
+# from its statement cache. trails_page() is the only one built at run time, from a fixed
+# set of shapes.
+
+
+def fts_prefix(term):
+    #Turn free text into an FTS5 query where every word is a quoted prefix: lake tr -> "lake"* "tr"*
+    words = term.replace('"', ' ').split()
+    return ' '.join(f'"{word}"*' for word in words)
+
+
+## Home ##
+#Every list of trails the app shows is best rank first (Trails.rank, see database.py): read in
+#order from idx_card_rank here, and from ranking.RankOrder in the in-memory searches
+HOME_OVERVIEW = 'SELECT trailName, parkName, elevation_feet, length, difficulty, routeType, reviews, avg_rating \
+    FROM TrailCard ORDER BY rank DESC LIMIT 10'
+
+## Search ##
+#Every trail the key word matches; the trail store puts them in rank order (see repository.py)
+KEYWORD_MATCHES = 'SELECT rowid FROM TrailSearch WHERE TrailSearch MATCH ?'
+#The chosen matches (?2, a JSON array of trail ids) with the text that matched. The + keeps
+#FTS5 from running the MATCH again for every id, it filters the one pass over the matches.
+KEYWORD_DETAILS = "SELECT c.trailID, c.trailName, c.parkName, c.elevation_feet, c.length, c.difficulty, c.routeType, \
+    c.avg_rating, snippet(TrailSearch, -1, '[', ']', '...', 8) AS match \
+    FROM TrailSearch JOIN TrailCard c ON c.trailID=TrailSearch.rowid \
+    WHERE TrailSearch MATCH ?1 AND +TrailSearch.rowid IN (SELECT value FROM json_each(?2))"
+STATE_LIST = 'SELECT DISTINCT state FROM Location'
+PARK_LIST = 'SELECT DISTINCT parkName FROM NationalParks'
+#The park names shown for the parkID column of the maintenance editor, in name order
+PARK_NAMES = 'SELECT parkID, parkName FROM NationalParks ORDER BY parkName'
+#Trail points in a lat/lng box, straight from the TrailGeo R*Tree
+NEAR_POINTS = 'SELECT trailID, minLat AS lat, minLng AS lng FROM TrailGeo \
+    WHERE maxLat>=? AND minLat<=? AND maxLng>=? AND minLng<=?'
+NEAR_COUNT = 'SELECT COUNT(*) FROM TrailGeo WHERE maxLat>=? AND minLat<=? AND maxLng>=? AND minLng<=?'
+#Details for a JSON array of trail ids
+NEAR_DETAILS = 'SELECT trailID, trailName, parkName, area_name, state, lat, lng, \
+    elevation_feet, length, difficulty, routeType \
+    FROM TrailCard WHERE trailID IN (SELECT value FROM json_each(?))'
+#store.TrailStore and facets.FacetIndex are loaded from snapshot.py at start. After a write
+#these re-read the trails it touched, for a JSON array of trail ids.
+TRAIL_ROWS_BY_ID = 'SELECT trailID, trailName, parkName, area_name, state, elevation_feet, length, \
+    difficulty, routeType, reviews, rank \
+    FROM TrailCard WHERE trailID IN (SELECT value FROM json_each(?))'
+FACET_FEATURES_BY_ID = 'SELECT trailID, feature FROM Features WHERE trailID IN (SELECT value FROM json_each(?))'
+FACET_ACTIVITIES_BY_ID = 'SELECT trailID, activity FROM Activities WHERE trailID IN (SELECT value FROM json_each(?))'
+FACET_DETAILS = 'SELECT trailID, trailName, parkName, state, elevation_feet, length, difficulty, routeType, reviews, avg_rating \
+    FROM TrailCard WHERE trailID IN (SELECT value FROM json_each(?))'
+#Trails for a JSON array of names, the trail names the fuzzy search (fuzzy.py) came up with
+TRAILS_BY_NAME = 'SELECT trailName, parkName, state, elevation_feet, length, difficulty, routeType \
+    FROM TrailCard WHERE trailName IN (SELECT value FROM json_each(?))'
+#The similar trails of the trail(s) with this name, most similar first (see similar.py)
+SIMILAR_TRAILS = 'SELECT c.trailName, c.parkName, c.state, c.elevation_feet, c.length, c.difficulty, \
+    c.routeType, round(s.score, 3) AS similarity \
+    FROM TrailCard t JOIN SimilarTrails s ON s.trailID=t.trailID JOIN TrailCard c ON c.trailID=s.similarID \
+    WHERE t.trailName=? ORDER BY t.trailID, s.rank'
+
+## Add Trails ##
+PARK_ID = 'SELECT parkID FROM NationalParks WHERE parkName=?'
+#Takes the next id from TrailIDSequence and inserts in one statement, unless the name is
+#taken. Returns the new trailID, or no row if the trail already exists.
+INSERT_TRAIL = 'INSERT INTO Trails(trailID, trailName, length, elevation_feet, difficulty, routeType, parkID) \
+    SELECT lastID+1, ?, ?, ?, ?, ?, ? FROM TrailIDSequence \
+    WHERE id=1 AND NOT EXISTS (SELECT 1 FROM Trails WHERE trailName=?) RETURNING trailID'
+NEW_TRAIL = 'SELECT trailName, parkName, elevation_feet, length, difficulty, routeType \
+    FROM TrailCard WHERE trailName=?'
+
+## Trails Maintenance ##
+MAINTENANCE_SORTS = ['trailID', 'trailName', 'length', 'elevation_feet', 'difficulty', 'reviews']
+
+
+def trails_page(sort='trailID', descending=False, after=None, name='', park_id=None, difficulty=None):
+    #One page of Trails for the maintenance editor, by keyset pagination on (sort, trailID).
+    #after is the (sort value, trailID) of the last row of the previous page, None for the first.
+    #Returns a list of (sql, params) segments ending in LIMIT ?: run them in order, each with
+    #the rows still missing from the page. Every sort column has a (column, trailID) index.
+    if sort not in MAINTENANCE_SORTS:
+        raise ValueError(f'cannot sort by {sort}')
+    where, params = [], []
+    match = fts_prefix(name)
+    if match:
+        where.append('trailID IN (SELECT rowid FROM TrailSearch WHERE TrailSearch MATCH ?)')
+        params.append(f'trailName : ({match})')
+    if park_id is not None:
+        where.append('parkID=?')
+        params.append(park_id)
+    if difficulty is not None:
+        where.append('difficulty=?')
+        params.append(difficulty)
+
+    #Row values never compare with NULL, and NULLs sort first ascending and last descending,
+    #so a cursor inside or next to the NULL block continues in a second segment
+    op = '<' if descending else '>'
+    if after is None:
+        keysets = [(None, [])]
+    elif sort == 'trailID':
+        keysets = [(f'trailID {op} ?', [after[1]])]
+    elif after[0] is None and descending:
+        keysets = [(f'{sort} IS NULL AND trailID < ?', [after[1]])]
+    elif after[0] is None:
+        keysets = [(f'{sort} IS NULL AND trailID > ?', [after[1]]), (f'{sort} IS NOT NULL', [])]
+    elif descending:
+        keysets = [(f'({sort}, trailID) < (?, ?)', list(after)), (f'{sort} IS NULL', [])]
+    else:
+        keysets = [(f'({sort}, trailID) > (?, ?)', list(after))]
+
+    order = ' DESC' if descending else ''
+    order_by = f'trailID{order}' if sort == 'trailID' else f'{sort}{order}, trailID{order}'
+    segments = []
+    for keyset, keyset_params in keysets:
+        conditions = where + [keyset] if keyset else where
+        sql = 'SELECT * FROM Trails'
+        if conditions:
+            sql += ' WHERE ' + ' AND '.join(conditions)
+        segments.append((sql + f' ORDER BY {order_by} LIMIT ?', params + keyset_params))
+    return segments
+
+
+#Its Location, Features, Activities and TrailGeo rows go with it (CHILD_TRIGGERS in database.py)
+DELETE_TRAIL = 'DELETE FROM Trails WHERE trailID=?'
+
+## Review queue ##
+#Columns a community edit may change; anything else in a queued edit is ignored
+EDITABLE_COLUMNS = ['trailName', 'elevation_feet', 'length', 'difficulty', 'routeType', 'parkID']
+
+
+#Applies a JSON object of {column: value} (?1) to trail ?2. Columns missing from the object
+#keep their value, so every edit runs the same statement whichever columns it changes.
+UPDATE_TRAIL = 'UPDATE Trails SET ' + ', '.join(
+    f"{c}=iif(json_type(?1, '$.{c}') IS NULL, {c}, json_extract(?1, '$.{c}'))" for c in EDITABLE_COLUMNS) + \
+    ' WHERE trailID=?2'
+
+QUEUE_UPDATE = "INSERT INTO TrailsUpdates (trailID, userID, content, status, submitted) \
+    VALUES (?, ?, ?, 'pending', datetime('now'))"
+PENDING_UPDATES = "SELECT u.updateID, u.trailID, t.trailName, u.content, u.submitted \
+    FROM TrailsUpdates u LEFT JOIN Trails t ON t.trailID=u.trailID \
+    WHERE u.status='pending' ORDER BY u.updateID LIMIT ?"
+#Pending updates for a JSON array of update ids
+UPDATES_BY_ID = "SELECT updateID, trailID, content FROM TrailsUpdates \
+    WHERE status='pending' AND updateID IN (SELECT value FROM json_each(?))"
+SET_UPDATE_STATUS = 'UPDATE TrailsUpdates SET status=? WHERE updateID=?'
+
+## Statistics ##
+#Every rollup row of every park / state (see database.py), so both read a few rows per park
+#or state and never the trails
+PARK_STATISTICS = 'SELECT p.parkName AS name, s.measure, s.bucket, s.trails, s.total \
+    FROM ParkStats s JOIN NationalParks p ON p.parkID=s.parkID'
+STATE_STATISTICS = 'SELECT state AS name, measure, bucket, trails, total FROM StateStats'
+
+## Similar trails lists ##
+#similar.py's reads and writes, for building the trail vectors and keeping SimilarTrails
+#up to date after every write (see similar.update)
+SIMILAR_INPUT_TRAILS = 'SELECT t.trailID, p.parkName, l.state, t.elevation_feet, t.length, t.difficulty, t.routeType \
+    FROM Trails t LEFT JOIN NationalParks p ON p.parkID=t.parkID \
+    LEFT JOIN Location l ON l.rowid=(SELECT min(rowid) FROM Location WHERE trailID=t.trailID)'
+#Activities are prefixed, so a feature and an activity with the same name stay two columns
+SIMILAR_INPUT_TAGS = "SELECT trailID, feature AS tag FROM Features \
+    UNION ALL SELECT trailID, 'activity:' || activity FROM Activities"
+SIMILAR_STALE = 'SELECT trailID FROM SimilarStale'
+SIMILAR_ANY = 'SELECT 1 FROM SimilarTrails LIMIT 1'
+#K-th best score of each trail in a JSON array of ids; trails with fewer neighbours have none
+SIMILAR_KTH_SCORES = 'SELECT trailID, score FROM SimilarTrails WHERE rank=? AND trailID IN (SELECT value FROM json_each(?))'
+#Trails listing any of a JSON array of ids as a neighbour
+SIMILAR_LISTING = 'SELECT DISTINCT trailID FROM SimilarTrails WHERE similarID IN (SELECT value FROM json_each(?))'
+SIMILAR_CLEAR = 'DELETE FROM SimilarTrails'
+SIMILAR_DELETE = 'DELETE FROM SimilarTrails WHERE trailID IN (SELECT value FROM json_each(?))'
+SIMILAR_INSERT = 'INSERT INTO SimilarTrails (trailID, rank, similarID, score) VALUES (?,?,?,?)'
+SIMILAR_STALE_DONE = 'DELETE FROM SimilarStale WHERE trailID IN (SELECT value FROM json_each(?))'
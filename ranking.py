@@ -0,0 +1,43 @@
+### Rank order for the in-memory indexes: top-k by rank without sorting the matches ###
+#
+# store.TrailStore and facets.FacetIndex keep their positions sorted by Trails.rank (see
+# database.py), best first, the in-memory counterpart of idx_card_rank on TrailCard. top()
+# walks that order in blocks and keeps the positions a search matched until it has enough,
+# so the cost is about limit / (share of trails matched) steps instead of a sort of every
+# match. Positions appended later are merged in at their place with np.searchsorted.
+
+import numpy as np
+
+
+class RankOrder:
+
+    def __init__(self):
+        self.order = np.empty(0, dtype=np.int64)
+        #-rank of each position in order, so it ascends; unranked positions go last
+        self.keys = np.empty(0, dtype=np.float64)
+
+    def insert(self, ranks, start):
+        #Adds positions start, start+1, ... with the given ranks
+        keys = -np.nan_to_num(np.asarray(ranks, dtype=np.float64), nan=-np.inf)
+        added = np.argsort(keys, kind='stable')
+        at = np.searchsorted(self.keys, keys[added], side='right')
+        self.order = np.insert(self.order, at, added + start)
+        self.keys = np.insert(self.keys, at, keys[added])
+
+    def top(self, mask, limit=None):
+        #Positions where mask is set, best rank first, at most limit of them (all for None)
+        order = self.order
+        matched = np.count_nonzero(mask)
+        if limit is None or limit >= matched:
+            return order[mask[order]]
+        #The first block is sized to hold limit matches if they are spread evenly
+        block = int(limit * len(order) / matched * 1.25) + 64
+        found, count, start = [], 0, 0
+        while count < limit:
+            positions = order[start:start+block]
+            positions = positions[mask[positions]]
+            found.append(positions)
+            count += len(positions)
+            start += block
+            block *= 2
+        return np.concatenate(found)[:limit]
@@ -0,0 +1,78 @@
+### Background data refresh for the Refresh Data page ###
+#
+# Runs database.refresh_shadow in a thread of the Streamlit process, so every session keeps
+# reading the live database while the new one is loaded next to it. The job records the
+# stage it is in and the seconds each finished stage took, which the page polls.
+
+import threading
+import time
+
+import database
+
+#Steps of database.refresh_shadow, in order, for the progress bar
+STAGES = ['copy', 'load', 'snapshot', 'swap']
+
+
+class RefreshJob:
+
+    def __init__(self, db_path, csv_path, rebuild=False, prune=False, writer=None, on_done=None):
+        self.db_path = db_path
+        self.csv_path = csv_path
+        self.rebuild = rebuild
+        self.prune = prune
+        self.writer = writer
+        self.on_done = on_done
+        self.stage = 'waiting'
+        self.timings = {}
+        self.stats = None
+        self.error = None
+        self.started = self.finished = None
+        self.thread = threading.Thread(target=self.run, name='refresh', daemon=True)
+
+    def start(self):
+        self.started = time.time()
+        self.thread.start()
+        return self
+
+    def progress(self, stage):
+        self.stage = stage
+
+    def run(self):
+        try:
+            self.stats, _ = database.refresh_shadow(self.db_path, self.csv_path, self.rebuild, self.prune,
+                                                    timings=self.timings, progress=self.progress, writer=self.writer)
+            self.stage = 'done'
+            if self.on_done:
+                self.on_done()
+        except Exception as error:
+            self.error = f'{type(error).__name__}: {error}'
+            self.stage = 'failed'
+        finally:
+            self.finished = time.time()
+
+    def running(self):
+        return self.thread.is_alive()
+
+    def fraction(self):
+        #Share of STAGES finished, for st.progress
+        if self.stage == 'done':
+            return 1.0
+        return STAGES.index(self.stage) / len(STAGES) if self.stage in STAGES else 0.0
+
+
+class RefreshJobs:
+    #The refreshes started in this process, newest last; only one runs at a time
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.jobs = []
+
+    def start(self, *args, **kwargs):
+        with self.lock:
+            if self.jobs and self.jobs[-1].running():
+                raise ValueError('a refresh is already running')
+            self.jobs.append(RefreshJob(*args, **kwargs).start())
+            return self.jobs[-1]
+
+    def latest(self):
+        return self.jobs[-1] if self.jobs else None
@@ -0,0 +1,681 @@
+### Data access for trails_app_USE_THIS.py ###
+#
+# The app never opens sqlite itself. Reads borrow a connection from one pool per process
+# (kept across Streamlit reruns and sessions by st.cache_resource) for the length of one
+# call. Writes are handed to writer(), one thread with its own connection that commits
+# whatever has queued up together, so sessions never fight over the write lock. Reference
+# data (state list, park list, Home overview, statistics) is memoized with a TTL and cleared by every
+# write below, so it never goes stale. The trail store, the facet index, the fuzzy name
+# index, the name completions and the similar trails vectors are built once per process and
+# patched with the trails each write touched, and the similar-trails lists those trails
+# affect are recomputed. Every call is timed into
+# query_stats() for the Performance page.
+
+import json
+import queue
+import threading
+from concurrent.futures import Future
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+import database
+import facets
+import fuzzy
+import prefix
+import profiling
+import refresh
+import similar
+import snapshot
+import store
+import queries as q
+
+POOL_SIZE = 4
+#Compiled statements kept per connection: every constant in queries.py plus all the shapes of
+#queries.trails_page() fit, so nothing the app runs is parsed twice (sqlite3's default is 128)
+STATEMENT_CACHE = 512
+#Most writes the writer thread commits in one transaction
+GROUP_COMMIT = 64
+#Seconds reference data stays cached if nothing writes in between
+REFERENCE_TTL = 600
+#Rows returned by the key word search
+KEYWORD_LIMIT = 500
+#Rows returned by the faceted search
+FACET_LIMIT = 500
+#Rows returned by the state, park and difficulty searches
+STORE_LIMIT = 500
+#Names returned by the fuzzy name search
+FUZZY_LIMIT = 20
+#Completions offered for the key word box, and parks offered in Add Trails
+NAME_COMPLETIONS = 8
+PARK_COMPLETIONS = 100
+#Defaults the Data refresh and Performance pages show
+CSV_PATH = database.CSV_PATH
+QUERY_WINDOW = profiling.ROLLING_WINDOW
+QUERY_LOG = profiling.QUERY_LOG
+#Columns the maintenance grid may change; apply_updates drops edits to any other
+EDITABLE_COLUMNS = q.EDITABLE_COLUMNS
+EARTH_RADIUS_MI = 3958.8
+MILES_PER_DEGREE_LAT = 69.05
+#Columns shown by the state search, and by the park and difficulty searches
+STATE_COLUMNS = ['trailName', 'area_name', 'state', 'elevation_feet', 'length', 'difficulty', 'routeType']
+PARK_COLUMNS = ['trailName', 'parkName', 'elevation_feet', 'length', 'difficulty', 'routeType']
+
+
+class ConnectionPool:
+    #A fixed set of read-only connections handed out to one thread at a time
+
+    def __init__(self, path, size=POOL_SIZE):
+        conn = database.connect(path)
+        database.migrate(conn)
+        conn.close()
+        self.connections = queue.Queue()
+        for _ in range(size):
+            conn = database.connect(path, check_same_thread=False, cached_statements=STATEMENT_CACHE)
+            #Writes go through Writer; one sent here by mistake fails instead of taking the lock
+            conn.execute('PRAGMA query_only = 1')
+            self.connections.put(conn)
+
+    @contextmanager
+    def connection(self):
+        conn = self.connections.get()
+        try:
+            yield conn
+        finally:
+            self.connections.put(conn)
+
+
+class Writer:
+    #The one thread that writes to the database. submit() queues a call and waits for it;
+    #the thread takes everything queued (up to GROUP_COMMIT calls) and runs it in a single
+    #transaction, each call in a savepoint so a failing one is rolled back on its own, then
+    #commits once for all of them.
+
+    def __init__(self, path, stats):
+        self.stats = stats
+        self.conn = database.connect(path, check_same_thread=False, isolation_level=None,
+                                     cached_statements=STATEMENT_CACHE)
+        self.calls = queue.Queue()
+        threading.Thread(target=self.run, name='writer', daemon=True).start()
+
+    def submit(self, label, call, alone=False):
+        #Runs call(conn, record) on the writer thread and returns what it returns, or raises
+        #what it raised. alone=True runs it outside any transaction, with nothing else queued.
+        done = Future()
+        self.calls.put((label, call, alone, done))
+        return done.result()
+
+    def run(self):
+        held = None
+        while True:
+            first = held or self.calls.get()
+            held = None
+            if first[2]:
+                self.run_alone(first)
+                continue
+            group = [first]
+            while len(group) < GROUP_COMMIT:
+                try:
+                    call = self.calls.get_nowait()
+                except queue.Empty:
+                    break
+                if call[2]:
+                    held = call
+                    break
+                group.append(call)
+            self.run_group(group)
+
+    def run_alone(self, call):
+        label, call, _, done = call
+        try:
+            with self.stats.measure(label, self.conn) as record:
+                done.set_result(call(self.conn, record))
+        except Exception as error:
+            done.set_exception(error)
+
+    def run_group(self, group):
+        results = []
+        try:
+            self.conn.execute('BEGIN IMMEDIATE')
+            for label, call, _, done in group:
+                self.conn.execute('SAVEPOINT call')
+                try:
+                    with self.stats.measure(label, self.conn) as record:
+                        results.append((done, call(self.conn, record), None))
+                    self.conn.execute('RELEASE call')
+                except Exception as error:
+                    self.conn.execute('ROLLBACK TO call')
+                    self.conn.execute('RELEASE call')
+                    results.append((done, None, error))
+            self.conn.execute('COMMIT')
+        except Exception as error:
+            #BEGIN or COMMIT failed, so none of the calls happened
+            if self.conn.in_transaction:
+                self.conn.execute('ROLLBACK')
+            results = [(done, None, error) for _, _, _, done in group]
+        for done, result, error in results:
+            if error is None:
+                done.set_result(result)
+            else:
+                done.set_exception(error)
+
+
+@st.cache_resource
+def pool(path=database.DB_PATH):
+    return ConnectionPool(path)
+
+
+@st.cache_resource
+def writer(path=database.DB_PATH):
+    pool(path)
+    return Writer(path, query_stats())
+
+
+@st.cache_resource
+def query_stats():
+    return profiling.QueryStats()
+
+
+@contextmanager
+def connection(label):
+    #A pooled connection whose use is timed under label (the SQL, or a name for several
+    #statements); set record['rows'] to record the rows returned
+    with pool().connection() as conn, query_stats().measure(label, conn) as record:
+        yield conn, record
+
+
+def read(sql, params=()):
+    with connection(sql) as (conn, record):
+        found = pd.read_sql_query(sql, con=conn, params=params)
+        record['rows'] = len(found)
+    return found
+
+
+def rows(sql, params=()):
+    with connection(sql) as (conn, record):
+        found = conn.execute(sql, params).fetchall()
+        record['rows'] = len(found)
+    return found
+
+
+def write(sql, params=(), trail_ids=()):
+    #Runs one statement through the writer and returns the number of rows it changed
+    def run(conn, record):
+        record['rows'] = conn.execute(sql, params).rowcount
+        return record['rows']
+    rowcount = writer().submit(sql, run)
+    invalidate(trail_ids)
+    return rowcount
+
+
+def invalidate(trail_ids=()):
+    #Called after every write so the cached reference data is read again and the
+    #in-memory indexes pick up the trails that were added, edited or deleted
+    home_overview.clear()
+    state_list.clear()
+    park_list.clear()
+    park_names.clear()
+    trail_statistics.clear()
+    if trail_ids:
+        ids = (json.dumps([int(i) for i in trail_ids]),)
+        trails = read(q.TRAIL_ROWS_BY_ID, ids)
+        features, activities = read(q.FACET_FEATURES_BY_ID, ids), read(q.FACET_ACTIVITIES_BY_ID, ids)
+        trail_store().refresh(trail_ids, trails)
+        facet_index().refresh(trail_ids, trails, features, activities)
+        name_index().refresh(trail_ids, trails)
+        name_completions_index().refresh(trail_ids, trails)
+        similar_vectors().refresh(trail_ids, trails, similar.tag_rows(features, activities))
+        update_similar()
+
+
+## Reference data ##
+
+@st.cache_data(ttl=REFERENCE_TTL)
+def home_overview():
+    return read(q.HOME_OVERVIEW)
+
+
+@st.cache_data(ttl=REFERENCE_TTL)
+def state_list():
+    return [r[0] for r in rows(q.STATE_LIST)]
+
+
+@st.cache_data(ttl=REFERENCE_TTL)
+def park_list():
+    return [r[0] for r in rows(q.PARK_LIST)]
+
+
+@st.cache_data(ttl=REFERENCE_TTL)
+def park_names():
+    #{parkID: parkName} of every park, in name order
+    return dict(rows(q.PARK_NAMES))
+
+
+## Search ##
+
+def keyword_search(term):
+    #FTS5 finds the matching trails, the trail store picks the KEYWORD_LIMIT best ranked of
+    #them, and only those are read from TrailCard, with the text that matched
+    match = q.fts_prefix(term)
+    if not match:
+        return pd.DataFrame()
+    matches = [r[0] for r in rows(q.KEYWORD_MATCHES, (match,))]
+    trail_ids = in_memory('store: keyword_rank', lambda: trail_store().best(matches, KEYWORD_LIMIT))
+    found = read(q.KEYWORD_DETAILS, (match, json.dumps(trail_ids)))
+    order = pd.Series(range(len(trail_ids)), index=trail_ids)
+    found = found.sort_values('trailID', key=lambda ids: ids.map(order), ignore_index=True)
+    return found.drop(columns='trailID')
+
+
+@st.cache_resource
+def name_index():
+    return fuzzy.NameIndex(snapshot.trail_rows(startup_tables()))
+
+
+def fuzzy_search(term):
+    #For misspelled names, when the key word search finds nothing. Returns (the closest
+    #trail, park and area names with the edits each needs, the trails among them)
+    names = in_memory('fuzzy: search', lambda: name_index().search(term, FUZZY_LIMIT))
+    #Only the closest: at most one edit more than the best match
+    names = names[names['distance'] <= names['distance'].min() + 1]
+    trail_names = names.loc[names['kind'] == 'trail', 'name'].tolist()
+    trails = read(q.TRAILS_BY_NAME, (json.dumps(trail_names),))
+    order = pd.Series(range(len(trail_names)), index=trail_names)
+    trails = trails.sort_values('trailName', key=lambda found: found.map(order), kind='stable', ignore_index=True)
+    return names, trails
+
+
+@st.cache_resource
+def name_completions_index():
+    tables = startup_tables()
+    return prefix.PrefixIndex(snapshot.trail_rows(tables), tables['NationalParks']['parkName'].dropna())
+
+
+def name_completions(term):
+    #The NAME_COMPLETIONS most reviewed trail and park names starting with term
+    found = in_memory('prefix: names', lambda: name_completions_index().complete(term, NAME_COMPLETIONS))
+    return [name for _, name in found]
+
+
+def park_completions(term=''):
+    #The PARK_COMPLETIONS most reviewed parks starting with term, for the Add Trails park box
+    found = in_memory('prefix: parks', lambda: name_completions_index().complete(term, PARK_COMPLETIONS, ('park',)))
+    return [name for _, name in found]
+
+
+@st.cache_resource
+def startup_tables():
+    #Tables every in-memory index is built from, memory-mapped from the Arrow snapshot once
+    #per start and shared by the builders. A missing or stale snapshot is written again
+    #first, so only the first start after a change reads sqlite; without pyarrow every start does.
+    #Kept until the next refresh: every write builds all the indexes (see invalidate), so none
+    #is built later from tables older than the database.
+    path = snapshot.snapshot_path(database.DB_PATH)
+    with connection('startup_tables') as (conn, _):
+        tables = snapshot.load(conn, path)
+        if tables is None and snapshot.write(conn, path) is not None:
+            tables = snapshot.load(conn, path)
+        if tables is None:
+            tables = snapshot.read_tables(conn)[2]
+    return tables
+
+
+@st.cache_resource
+def trail_store():
+    return store.TrailStore(snapshot.trail_rows(startup_tables()))
+
+
+def in_memory(label, search):
+    #Runs a search over the in-memory store or index and times it under label
+    with query_stats().measure(label) as record:
+        found = search()
+        record['rows'] = len(found) if isinstance(found, (pd.DataFrame, list)) else found[0]
+    return found
+
+
+def state_search(states):
+    trails = trail_store()
+    return in_memory('store: state_search', lambda: trails.select(trails.isin('state', states), STATE_COLUMNS, STORE_LIMIT))
+
+
+def park_search(parks):
+    trails = trail_store()
+    return in_memory('store: park_search', lambda: trails.select(trails.isin('parkName', parks), PARK_COLUMNS, STORE_LIMIT))
+
+
+def difficulty_search(level):
+    trails = trail_store()
+    return in_memory('store: difficulty_search', lambda: trails.select(trails.isin('difficulty', [level]), PARK_COLUMNS, STORE_LIMIT))
+
+
+def difficulty_count(level):
+    return facet_counts()['difficulty'].get(level, 0)
+
+
+## Faceted search ##
+
+@st.cache_resource
+def facet_index():
+    tables = startup_tables()
+    return facets.FacetIndex(snapshot.trail_rows(tables), tables['Features'], tables['Activities'])
+
+
+def facet_counts():
+    #Trails per value of every facet, with nothing selected
+    return facet_index().search({}, limit=0)[2]
+
+
+def facet_limits():
+    return facet_index().limits()
+
+
+def faceted_search(selected, length_range=None, elevation_range=None):
+    #Returns (number of matches, the FACET_LIMIT best ranked of them, counts per facet value)
+    total, trail_ids, counts = in_memory('facets: search', lambda: facet_index().search(
+        selected, length_range, elevation_range, FACET_LIMIT))
+    return total, trail_details(trail_ids), counts
+
+
+def tag_search(expression):
+    #Features & activities search, e.g. 'dogs-leash AND waterfall AND NOT camping'. Returns
+    #(number of matches, the FACET_LIMIT best ranked); ValueError if it doesn't parse.
+    total, trail_ids = in_memory('facets: tag_search', lambda: facet_index().tag_search(expression, FACET_LIMIT))
+    return total, trail_details(trail_ids)
+
+
+def tag_list():
+    return facet_index().tags()
+
+
+def trail_details(trail_ids):
+    #FACET_DETAILS rows in the order of trail_ids
+    found = read(q.FACET_DETAILS, (json.dumps(trail_ids),))
+    order = pd.Series(range(len(trail_ids)), index=trail_ids)
+    found = found.sort_values('trailID', key=lambda ids: ids.map(order), ignore_index=True)
+    return found.drop(columns='trailID')
+
+
+## Similar trails ##
+
+@st.cache_resource
+def similar_vectors():
+    tables = startup_tables()
+    vectors = similar.TrailVectors(snapshot.trail_rows(tables), similar.tag_rows(tables['Features'], tables['Activities']))
+    #Lists still missing, e.g. right after the migration that added SimilarTrails
+    writer().submit('similar: update', lambda conn, record: similar.update(conn, vectors))
+    return vectors
+
+
+def update_similar():
+    #Recomputes the lists the last write made stale, on the writer thread
+    vectors = similar_vectors()
+    def run(conn, record):
+        record['rows'] = similar.update(conn, vectors)
+        return record['rows']
+    return writer().submit('similar: update', run)
+
+
+def similar_trails(trail_name):
+    similar_vectors()
+    return read(q.SIMILAR_TRAILS, (trail_name,))
+
+
+## Near me ##
+
+def haversine_mi(lat, lng, lats, lngs):
+    #Great-circle distance in miles from one point to arrays of points
+    lat, lng, lats, lngs = map(np.radians, (lat, lng, lats, lngs))
+    a = np.sin((lats-lat)/2)**2 + np.cos(lat)*np.cos(lats)*np.sin((lngs-lng)/2)**2
+    return 2*EARTH_RADIUS_MI*np.arcsin(np.sqrt(a))
+
+
+def bounding_box(lat, lng, radius_mi):
+    #The lat/lng box that holds the circle of radius_mi around the point
+    dlat = radius_mi / MILES_PER_DEGREE_LAT
+    dlng = radius_mi / max(MILES_PER_DEGREE_LAT*np.cos(np.radians(lat)), 1e-6)
+    return (lat-dlat, lat+dlat, max(lng-dlng, -180.0), min(lng+dlng, 180.0))
+
+
+def near_points(lat, lng, radius_mi):
+    #Trail ids within radius_mi and their distances, from the R*Tree alone (no joins)
+    points = read(q.NEAR_POINTS, bounding_box(lat, lng, radius_mi))
+    points['distance'] = haversine_mi(lat, lng, points['lat'].to_numpy(), points['lng'].to_numpy())
+    return points[points['distance'] <= radius_mi].sort_values('distance', ignore_index=True)
+
+
+def near_details(lat, lng, points):
+    #Trail, park and area for the chosen points, with the distance from the exact Location coordinates
+    found = read(q.NEAR_DETAILS, (json.dumps(points['trailID'].tolist()),))
+    found.insert(0, 'distance', haversine_mi(lat, lng, found['lat'].to_numpy(), found['lng'].to_numpy()))
+    return found.sort_values('distance', ignore_index=True).drop(columns='trailID')
+
+
+def trails_within(lat, lng, radius_mi):
+    return near_details(lat, lng, near_points(lat, lng, radius_mi))
+
+
+def trails_nearest(lat, lng, k, start_mi=10.0):
+    #Double the box until the R*Tree counts k trails in it, then take the circle through
+    #the box corners. Everything inside a circle is exact, so once it holds k trails
+    #they are the k nearest; otherwise keep growing.
+    radius = start_mi
+    limit = np.pi*EARTH_RADIUS_MI
+    while True:
+        if radius < limit and rows(q.NEAR_COUNT, bounding_box(lat, lng, radius))[0][0] < k:
+            radius *= 2
+            continue
+        points = near_points(lat, lng, radius*1.5)
+        if len(points) >= k or radius >= limit:
+            return near_details(lat, lng, points.head(k))
+        radius *= 2
+
+
+## Add Trails ##
+
+def park_id(park_name):
+    #None if there is no park of that name
+    found = rows(q.PARK_ID, (park_name,))
+    return found[0][0] if found else None
+
+
+def add_trail(name, length, elevation, difficulty, route_type, park):
+    #Returns the new trail id, or None if a trail with this name already exists; ValueError
+    #without a park id
+    if park is None or park == '':
+        raise ValueError('A new trail needs a national park')
+    trail_id = writer().submit(q.INSERT_TRAIL, new_trail(name, length, elevation, difficulty, route_type, park))
+    invalidate([trail_id[0]] if trail_id else ())
+    return trail_id
+
+
+def new_trail(name, length, elevation, difficulty, route_type, park):
+    #The Writer call behind add_trail: the INSERT_TRAIL for this trail, returning its id row
+    def run(conn, record):
+        added = conn.execute(q.INSERT_TRAIL, (name, length, elevation, difficulty, route_type, park, name)).fetchall()
+        record['rows'] = len(added)
+        return added[0] if added else None
+    return run
+
+
+def trail_by_name(trail_name):
+    return read(q.NEW_TRAIL, (trail_name,))
+
+
+## Trails Maintenance ##
+
+MAINTENANCE_SORTS = q.MAINTENANCE_SORTS
+
+
+def trails_page(page_size, **options):
+    #Runs the keyset segments from queries.trails_page until the page is full
+    pages = []
+    remaining = page_size
+    for sql, params in q.trails_page(**options):
+        pages.append(read(sql, params + [remaining]))
+        remaining -= len(pages[-1])
+        if remaining <= 0:
+            break
+    return pd.concat(pages, ignore_index=True)
+
+
+def delete_trail(trail_id):
+    return write(q.DELETE_TRAIL, (trail_id,), [trail_id])
+
+
+## Review queue ##
+
+def queue_updates(edited, added, deleted, user_id=None):
+    #Saves editor changes to TrailsUpdates for review: edited is {trailID: {column: value}},
+    #added a list of new rows, deleted a list of trailIDs. One executemany.
+    updates = [(trail_id, user_id, json.dumps({'action': 'edit', 'changes': change}))
+               for trail_id, change in edited.items()]
+    updates += [(None, user_id, json.dumps({'action': 'add', 'row': row})) for row in added]
+    updates += [(trail_id, user_id, json.dumps({'action': 'delete'})) for trail_id in deleted]
+    def run(conn, record):
+        record['rows'] = conn.executemany(q.QUEUE_UPDATE, updates).rowcount
+    writer().submit(q.QUEUE_UPDATE, run)
+    return len(updates)
+
+
+def pending_updates(limit=1000):
+    return read(q.PENDING_UPDATES, (limit,))
+
+
+def apply_updates(update_ids):
+    #Applies the chosen pending updates together, in one savepoint of the writer's
+    #transaction, one statement each so every update gets its own status; the adds run
+    #INSERT_TRAIL as in Add Trails. An add without a park, or with the name of a trail that
+    #exists, and an edit or delete of a trail that is gone, are rejected. Returns (updates
+    #applied, updates rejected).
+    def run(conn, record):
+        updates = conn.execute(q.UPDATES_BY_ID, (json.dumps(update_ids),)).fetchall()
+        touched, statuses = [], []
+        for update_id, trail_id, content in updates:
+            change = json.loads(content)
+            status = 'applied'
+            if change['action'] == 'edit':
+                #A park can be changed but not taken away
+                changes = {c: v for c, v in change['changes'].items()
+                           if c in q.EDITABLE_COLUMNS and not (c == 'parkID' and v is None)}
+                if changes and not conn.execute(q.UPDATE_TRAIL, (json.dumps(changes), trail_id)).rowcount:
+                    status = 'rejected'
+            elif change['action'] == 'add':
+                row = change['row']
+                found = [] if row.get('parkID') is None else conn.execute(q.INSERT_TRAIL, (
+                    row.get('trailName'), row.get('length'), row.get('elevation_feet'), row.get('difficulty'),
+                    row.get('routeType'), row['parkID'], row.get('trailName'))).fetchall()
+                if found:
+                    trail_id = found[0][0]
+                else:
+                    status = 'rejected'
+            elif change['action'] == 'delete':
+                if not conn.execute(q.DELETE_TRAIL, (trail_id,)).rowcount:
+                    status = 'rejected'
+            if status == 'applied' and trail_id is not None:
+                touched.append(trail_id)
+            statuses.append((status, update_id))
+        conn.executemany(q.SET_UPDATE_STATUS, statuses)
+        record['rows'] = len(updates)
+        rejected = sum(status == 'rejected' for status, _ in statuses)
+        return len(updates) - rejected, rejected, touched
+    applied, rejected, touched = writer().submit('apply_updates', run)
+    invalidate(touched)
+    return applied, rejected
+
+
+def reject_updates(update_ids):
+    def run(conn, record):
+        record['rows'] = conn.executemany(q.SET_UPDATE_STATUS, [('rejected', u) for u in update_ids]).rowcount
+    writer().submit(q.SET_UPDATE_STATUS, run)
+    return len(update_ids)
+
+
+## Data refresh ##
+
+@st.cache_resource
+def refresh_jobs():
+    return refresh.RefreshJobs()
+
+
+def start_refresh(csv_path, rebuild=False, prune=False):
+    #Loads csv_path into a copy of the database in the background and copies it back when
+    #done, on the writer thread. Raises ValueError if a refresh is running.
+    swap = lambda call: writer().submit('refresh swap', lambda conn, record: call(conn), alone=True)
+    return refresh_jobs().start(database.DB_PATH, csv_path, rebuild, prune, writer=swap, on_done=after_refresh)
+
+
+def latest_refresh():
+    return refresh_jobs().latest()
+
+
+def after_refresh():
+    #Every trail may have changed: drop the cached data and build the store and facet index
+    #again from the new file's snapshot, before the next search has to wait for them
+    invalidate()
+    clear_indexes()
+    trail_store()
+    facet_index()
+
+
+def clear_indexes():
+    #The startup tables and every in-memory index built from them
+    for cached in [startup_tables, trail_store, facet_index, name_index, name_completions_index, similar_vectors]:
+        cached.clear()
+
+
+def clear_caches():
+    #Everything kept from the database file, for switching to another one (benchmarks/suite.py):
+    #the connections, the writer, the reference data and the in-memory indexes
+    pool.clear()
+    writer.clear()
+    invalidate()
+    clear_indexes()
+
+
+## Statistics ##
+
+#Unit of the length and elevation bands
+STATISTICS_UNITS = {'length': 'mi', 'elevation': 'ft'}
+
+
+@st.cache_data(ttl=REFERENCE_TTL)
+def trail_statistics(scope):
+    #Per park (scope 'park') or per state, from the rollup tables (see database.py), so the
+    #rows read depend on the number of parks and states, not trails. Returns a DataFrame of
+    #name, trails and for each measure its mean and its histogram as a list of trail counts,
+    #and {measure: trails per band} summed over all of them.
+    rollup = read(q.PARK_STATISTICS if scope == 'park' else q.STATE_STATISTICS)
+    groups = rollup[rollup['measure'] == 'trails'].groupby('name')[['trails']].sum()
+    totals = {}
+    for measure, column in database.ROLLUP_VALUES.items():
+        part = rollup[rollup['measure'] == measure]
+        counts = part.pivot_table(index='name', columns='bucket', values='trails', aggfunc='sum', fill_value=0)
+        edges = database.ROLLUP_BUCKETS.get(measure)
+        if edges is None:
+            labels = [str(int(bucket)) for bucket in counts.columns]
+        else:
+            counts = counts.reindex(columns=[float(edge) for edge in edges], fill_value=0)
+            labels = facets.band_labels(edges, STATISTICS_UNITS[measure])
+        counts = counts.reindex(groups.index, fill_value=0)
+        totals[measure] = pd.Series(counts.sum().to_numpy(), index=labels)
+        sums = part.groupby('name')[['trails', 'total']].sum().reindex(groups.index)
+        groups[column] = sums['total'] / sums['trails']
+        groups[f'{measure}_histogram'] = pd.Series(counts.to_numpy().tolist(), index=groups.index)
+    return groups.sort_values('trails', ascending=False).reset_index(), totals
+
+
+## Performance ##
+
+def query_summary():
+    return query_stats().summary()
+
+
+def reset_query_stats():
+    query_stats().reset()
+
+
+def dump_queries(path):
+    #Also append every call to path as JSON lines; None stops
+    query_stats().dump_path = path
@@ -0,0 +1,215 @@
+### Similar trails: the K nearest neighbours of every trail, kept in SimilarTrails ###
+#
+# Each trail is a row of a float32 matrix: log length, log elevation and difficulty
+# (z-scored), its route type one-hot and its features and activities one-hot, each block
+# weighted by WEIGHTS and every row scaled to unit length, so the dot product of two rows is
+# their cosine similarity. A trail's candidates are the other trails in its state (or, with
+# no Location row, in the state most of its park's trails are in), so the work is the sum of
+# the squared state sizes instead of the square of all trails. Scores are computed a block
+# of rows at a time with one matrix product, at most BLOCK_CELLS scores per block, and the
+# top K of each row taken with argpartition.
+#
+# Triggers add every trail that is inserted, edited, deleted or has its tags or location
+# changed to SimilarStale (see database.py). update() then recomputes only the lists that
+# can have changed: the stale trails', those that listed a stale trail, and those a stale
+# trail now scores higher than their K-th neighbour. Like store.TrailStore, trails are
+# only ever appended to the matrix: a deleted trail is dropped from `alive`, an edited one
+# is appended again. The scaling and the route/tag columns are fixed when it is built.
+
+import json
+import threading
+
+import numpy as np
+import pandas as pd
+
+import queries as q
+
+K = 10
+#Weight of each block of columns before the rows are normalized
+WEIGHTS = {'numeric': 1.0, 'routeType': 0.5, 'tags': 1.0}
+#Most similarity scores held in memory at once (64 MB of float32)
+BLOCK_CELLS = 1 << 24
+#Past this share of stale trails, update() recomputes every list
+REBUILD_SHARE = 0.2
+
+def tag_rows(features, activities):
+    #(trailID, tag) rows of queries.SIMILAR_INPUT_TAGS from the Features and Activities tables
+    return pd.concat([features.rename(columns={'feature': 'tag'})[['trailID', 'tag']],
+                      activities.assign(tag='activity:' + activities['activity'])[['trailID', 'tag']]],
+                     ignore_index=True)
+
+
+def numeric(trails):
+    values = [np.log1p(pd.to_numeric(trails['length'], errors='coerce').clip(lower=0)),
+              np.log1p(pd.to_numeric(trails['elevation_feet'], errors='coerce').clip(lower=0)),
+              pd.to_numeric(trails['difficulty'], errors='coerce')]
+    return np.column_stack([v.to_numpy(dtype=np.float64) for v in values])
+
+
+class TrailVectors:
+    #trails has trailID, parkName, state, elevation_feet, length, difficulty and routeType,
+    #one row per trail; tags has (trailID, tag) rows
+
+    def __init__(self, trails, tags):
+        self.lock = threading.Lock()
+        self.positions = {}
+        self.alive = np.empty(0, dtype=bool)
+        self.trail_ids = np.empty(0, dtype=np.int64)
+        self.groups = np.empty(0, dtype=np.int32)
+        values = numeric(trails)
+        self.mean = np.nanmean(values, axis=0) if len(trails) else np.zeros(3)
+        self.std = np.nanstd(values, axis=0) if len(trails) else np.ones(3)
+        self.std[~(self.std > 0)] = 1.0
+        self.routes = {v: i for i, v in enumerate(sorted(trails['routeType'].dropna().astype(str).unique()))}
+        self.tags = {v: i for i, v in enumerate(sorted(tags['tag'].dropna().astype(str).unique()))}
+        self.matrix = np.empty((0, 3 + len(self.routes) + len(self.tags)), dtype=np.float32)
+        self.states = {}
+        #The state most of a park's trails are in, for trails without a Location row
+        located = trails.dropna(subset=['parkName', 'state'])
+        self.park_states = located.groupby('parkName')['state'].agg(lambda s: s.mode().iat[0]).to_dict()
+        self.append(trails, tags)
+
+    def vectors(self, trails, tags):
+        rows = np.zeros((len(trails), self.matrix.shape[1]), dtype=np.float32)
+        z = np.nan_to_num((numeric(trails) - self.mean) / self.std)
+        rows[:, :3] = z * (WEIGHTS['numeric'] / np.sqrt(3))
+        routes = trails['routeType'].map(self.routes).to_numpy(dtype=float)
+        known = np.flatnonzero(~np.isnan(routes))
+        rows[known, 3 + routes[known].astype(int)] = WEIGHTS['routeType']
+
+        order = pd.Series(range(len(trails)), index=trails['trailID'].to_numpy())
+        tags = tags[tags['trailID'].isin(order.index)]
+        row = order.reindex(tags['trailID']).to_numpy()
+        column = tags['tag'].map(self.tags).to_numpy(dtype=float)
+        known = ~np.isnan(column)
+        row, column = row[known], 3 + len(self.routes) + column[known].astype(int)
+        counts = np.bincount(row, minlength=len(trails))
+        rows[row, column] = WEIGHTS['tags'] / np.sqrt(counts[row])
+
+        norms = np.linalg.norm(rows, axis=1, keepdims=True)
+        return rows / np.where(norms > 0, norms, 1)
+
+    def group(self, trails):
+        #Code of the state candidates are taken from; -1 (no candidates) if it can't be told
+        states = trails['state'].where(trails['state'].notna(), trails['parkName'].map(self.park_states))
+        codes = np.full(len(trails), -1, dtype=np.int32)
+        for i, state in enumerate(states.tolist()):
+            if isinstance(state, str):
+                codes[i] = self.states.setdefault(state, len(self.states))
+        return codes
+
+    def append(self, trails, tags):
+        trails = trails.drop_duplicates('trailID', keep='last').reset_index(drop=True)
+        start = len(self.alive)
+        self.matrix = np.concatenate([self.matrix, self.vectors(trails, tags)])
+        self.groups = np.concatenate([self.groups, self.group(trails)])
+        trail_ids = trails['trailID'].to_numpy(dtype=np.int64)
+        self.trail_ids = np.concatenate([self.trail_ids, trail_ids])
+        alive = np.concatenate([self.alive, np.ones(len(trails), dtype=bool)])
+        for trail_id in trail_ids.tolist():
+            if trail_id in self.positions:
+                alive[self.positions[trail_id]] = False
+        self.positions.update(zip(trail_ids.tolist(), range(start, start+len(trails))))
+        self.alive = alive
+
+    def refresh(self, trail_ids, trails, tags):
+        #Drops trail_ids, then adds back the ones still in the database (the rows passed in)
+        with self.lock:
+            alive = self.alive.copy()
+            for trail_id in trail_ids:
+                position = self.positions.pop(trail_id, None)
+                if position is not None:
+                    alive[position] = False
+            self.alive = alive
+            if len(trails):
+                self.append(trails, tags)
+
+    def live(self, trail_ids=None):
+        #Positions of the given trails (all trails for None) that are alive
+        if trail_ids is None:
+            return np.flatnonzero(self.alive)
+        found = [self.positions[t] for t in trail_ids if t in self.positions]
+        return np.array(sorted(found), dtype=np.int64)
+
+    def candidates(self, group):
+        return np.flatnonzero(self.alive & (self.groups == group))
+
+    def top_k(self, positions, k=K):
+        #Yields (trailID, rank, similarID, score) rows, rank 1 the most similar, for the
+        #trails at positions
+        for group in np.unique(self.groups[positions]):
+            if group < 0:
+                continue
+            rows = positions[self.groups[positions] == group]
+            candidates = self.candidates(group)
+            others = self.matrix[candidates].T
+            take = min(k, len(candidates))
+            block = max(1, BLOCK_CELLS // len(candidates))
+            for start in range(0, len(rows), block):
+                queried = rows[start:start+block]
+                scores = self.matrix[queried] @ others
+                #A trail is never its own neighbour
+                own = np.searchsorted(candidates, queried)
+                found = own < len(candidates)
+                found[found] = candidates[own[found]] == queried[found]
+                scores[np.flatnonzero(found), own[found]] = -np.inf
+                best = np.argpartition(-scores, take-1, axis=1)[:, :take]
+                best_scores = np.take_along_axis(scores, best, axis=1)
+                order = np.argsort(-best_scores, axis=1, kind='stable')
+                best = np.take_along_axis(best, order, axis=1)
+                best_scores = np.take_along_axis(best_scores, order, axis=1)
+                trail_ids = np.repeat(self.trail_ids[queried], take)
+                ranks = np.tile(np.arange(1, take+1), len(queried))
+                keep = np.isfinite(best_scores.ravel())
+                yield from zip(trail_ids[keep].tolist(), ranks[keep].tolist(),
+                               self.trail_ids[candidates[best.ravel()[keep]]].tolist(),
+                               best_scores.ravel()[keep].astype(float).tolist())
+
+    def overtaken(self, conn, positions, k=K):
+        #Trails, other than those at positions, that one of them now scores above the K-th
+        #neighbour in their stored list
+        found = []
+        for group in np.unique(self.groups[positions]):
+            if group < 0:
+                continue
+            candidates = self.candidates(group)
+            kth = np.full(len(candidates), -np.inf)
+            stored = dict(conn.execute(q.SIMILAR_KTH_SCORES, (k, json.dumps(self.trail_ids[candidates].tolist()))).fetchall())
+            for i, trail_id in enumerate(self.trail_ids[candidates].tolist()):
+                kth[i] = stored.get(trail_id, -np.inf)
+            rows = positions[self.groups[positions] == group]
+            block = max(1, BLOCK_CELLS // len(candidates))
+            beaten = np.zeros(len(candidates), dtype=bool)
+            for start in range(0, len(rows), block):
+                beaten |= (self.matrix[rows[start:start+block]] @ self.matrix[candidates].T > kth).any(axis=0)
+            found += self.trail_ids[candidates[beaten]].tolist()
+        return found
+
+
+def read_vectors(conn):
+    return TrailVectors(pd.read_sql_query(q.SIMILAR_INPUT_TRAILS, conn), pd.read_sql_query(q.SIMILAR_INPUT_TAGS, conn))
+
+
+def update(conn, vectors=None):
+    #Brings SimilarTrails up to date with the trails in SimilarStale, using vectors (read
+    #from the database if not given) that already hold their current rows. Returns the
+    #number of trails whose list was written.
+    stale = [r[0] for r in conn.execute(q.SIMILAR_STALE)]
+    if not stale:
+        return 0
+    vectors = vectors or read_vectors(conn)
+    with vectors.lock:
+        total = int(vectors.alive.sum())
+        if len(stale) > REBUILD_SHARE * total or conn.execute(q.SIMILAR_ANY).fetchone() is None:
+            conn.execute(q.SIMILAR_CLEAR)
+            positions = vectors.live()
+            count = len(positions)
+        else:
+            listing = [r[0] for r in conn.execute(q.SIMILAR_LISTING, (json.dumps(stale),))]
+            affected = set(stale) | set(listing) | set(vectors.overtaken(conn, vectors.live(stale)))
+            conn.execute(q.SIMILAR_DELETE, (json.dumps(sorted(affected)),))
+            positions = vectors.live(affected)
+            count = len(affected)
+        conn.executemany(q.SIMILAR_INSERT, vectors.top_k(positions))
+    conn.execute(q.SIMILAR_STALE_DONE, (json.dumps(stale),))
+    return count
@@ -0,0 +1,135 @@
+### Arrow snapshot of the normalized tables, for a fast app start ###
+#
+# database.py writes one after every load. A snapshot is a directory per data version,
+#
+#   project.snapshot/CURRENT                     name of the newest version directory
+#   project.snapshot/<databaseID>-<version>/     one Arrow IPC file per table + manifest.json
+#
+# stamped with DataVersion from the database it was read from. The app memory-maps the
+# files instead of reading whole tables out of sqlite, and only trusts them while the
+# stamp still matches the database. pyarrow is optional: without it nothing is written
+# and load() returns None.
+
+import json
+import os
+import shutil
+import threading
+from pathlib import Path
+
+import pandas as pd
+
+FORMAT = 1
+TABLES = ['NationalParks', 'Trails', 'Location', 'Features', 'Activities']
+#Location.geolocation is only parsed into lat/lng at ingest, the app never reads it
+COLUMNS = {'Location': 'trailID, area_name, state, lat, lng'}
+#See DataVersion in database.py
+DATA_VERSION = 'SELECT databaseID, version FROM DataVersion WHERE id=1'
+
+
+def snapshot_path(db_path):
+    return Path(f'{db_path}.snapshot')
+
+
+def arrow():
+    try:
+        import pyarrow
+        import pyarrow.ipc
+    except ImportError:
+        return None
+    return pyarrow
+
+
+def read_tables(conn):
+    #(databaseID, version, {table: DataFrame}) read in one transaction, so all match the stamp
+    conn.execute('BEGIN')
+    try:
+        database_id, version = conn.execute(DATA_VERSION).fetchone()
+        tables = {table: pd.read_sql_query(f'SELECT {COLUMNS.get(table, "*")} FROM {table}', conn)
+                  for table in TABLES}
+    finally:
+        conn.rollback()
+    return database_id, version, tables
+
+
+def to_arrow(pa, frame):
+    #sqlite columns can hold mixed types (a length typed in as text); Arrow columns can't,
+    #so a mixed column is stored as text and the readers convert it back with to_numeric
+    for column in frame.columns:
+        if pd.api.types.infer_dtype(frame[column], skipna=True) in ('mixed', 'mixed-integer'):
+            frame[column] = frame[column].where(frame[column].isna(), frame[column].astype(str))
+    return pa.Table.from_pandas(frame, preserve_index=False)
+
+
+def write(conn, path):
+    #Writes a snapshot of the database behind conn and returns its manifest, or None without pyarrow
+    pa = arrow()
+    if pa is None:
+        return None
+    path = Path(path)
+    database_id, version, tables = read_tables(conn)
+    name = f'{database_id}-{version}'
+    manifest = {'format': FORMAT, 'databaseID': database_id, 'version': version,
+                'schema': conn.execute('PRAGMA user_version').fetchone()[0],
+                'rows': {table: len(frame) for table, frame in tables.items()}}
+
+    #Written under a temporary name and renamed, so a reader never sees half a snapshot
+    path.mkdir(exist_ok=True)
+    partial = path / f'{name}.{os.getpid()}-{threading.get_ident()}.partial'
+    partial.mkdir()
+    for table, frame in tables.items():
+        data = to_arrow(pa, frame)
+        with pa.OSFile(str(partial / f'{table}.arrow'), 'wb') as sink:
+            with pa.ipc.new_file(sink, data.schema) as writer:
+                writer.write_table(data)
+    (partial / 'manifest.json').write_text(json.dumps(manifest))
+    try:
+        partial.rename(path / name)
+    except OSError:
+        #Someone else wrote the same version first
+        shutil.rmtree(partial)
+    current = path / f'CURRENT.{os.getpid()}-{threading.get_ident()}'
+    current.write_text(name)
+    os.replace(current, path / 'CURRENT')
+
+    for old in path.iterdir():
+        if old.is_dir() and old.name != name and not old.name.endswith('.partial'):
+            shutil.rmtree(old, ignore_errors=True)
+    return manifest
+
+
+def load(conn, path):
+    #{table: DataFrame} from the current snapshot, memory-mapped, or None if there is no
+    #snapshot, pyarrow is missing, or the database changed since the snapshot was written
+    pa = arrow()
+    path = Path(path)
+    if pa is None or not (path / 'CURRENT').exists():
+        return None
+    folder = path / (path / 'CURRENT').read_text()
+    try:
+        manifest = json.loads((folder / 'manifest.json').read_text())
+    except FileNotFoundError:
+        return None
+    database_id, version = conn.execute(DATA_VERSION).fetchone()
+    schema = conn.execute('PRAGMA user_version').fetchone()[0]
+    if (manifest['format'], manifest['databaseID'], manifest['version'], manifest['schema']) != (FORMAT, database_id, version, schema):
+        return None
+    tables = {}
+    try:
+        for table in TABLES:
+            with pa.memory_map(str(folder / f'{table}.arrow')) as source:
+                tables[table] = pa.ipc.open_file(source).read_all().to_pandas()
+    except FileNotFoundError:
+        #A newer snapshot replaced this one while we were reading it
+        return None
+    return tables
+
+
+def trail_rows(tables):
+    #One row per trail with the columns of queries.TRAIL_ROWS_BY_ID, joined from the tables.
+    #A parkID sqlite stored as text (or nothing) must not stop the merge, it just finds no park.
+    trails = tables['Trails'].assign(parkID=pd.to_numeric(tables['Trails']['parkID'], errors='coerce'))
+    trails = trails.merge(tables['NationalParks'][['parkID', 'parkName']], on='parkID', how='left')
+    trails = trails.merge(tables['Location'][['trailID', 'area_name', 'state']], on='trailID', how='left')
+    return trails[['trailID', 'trailName', 'parkName', 'area_name', 'state', 'elevation_feet', 'length',
+                   'difficulty', 'routeType', 'reviews', 'rank']]
+
@@ -0,0 +1,119 @@
+### Columnar copy of the trails for the Streamlit process ###
+#
+# One row per trail, one NumPy array per column: numbers as float/int arrays, park, area,
+# state and route type as int32 codes into a list of distinct values, names as interned
+# strings. The state, park and difficulty searches are boolean masks over these arrays
+# instead of SQL round trips, and return the matches best rank first by walking a
+# ranking.RankOrder. Like facets.FacetIndex, trails are only ever appended: a deleted trail
+# is dropped from `alive`, an edited one is appended again.
+
+import sys
+import threading
+
+import numpy as np
+import pandas as pd
+
+import ranking
+
+NUMERIC = {'trailID': np.int64, 'elevation_feet': np.float64, 'length': np.float64,
+           'difficulty': np.float32, 'reviews': np.float64, 'rank': np.float64}
+CATEGORICAL = ['parkName', 'area_name', 'state', 'routeType']
+COLUMNS = ['trailID', 'trailName'] + CATEGORICAL + ['elevation_feet', 'length', 'difficulty', 'reviews', 'rank']
+
+
+class Categories:
+    #Dictionary encoding: codes index into values, -1 is NULL
+
+    def __init__(self):
+        self.values = []
+        self.lookup = {}
+
+    def encode(self, column):
+        codes = np.full(len(column), -1, dtype=np.int32)
+        present = column.notna().to_numpy()
+        uniques, inverse = np.unique(column[present].astype(str).to_numpy(), return_inverse=True)
+        for value in uniques:
+            if value not in self.lookup:
+                self.lookup[value] = len(self.values)
+                self.values.append(value)
+        codes[present] = np.array([self.lookup[v] for v in uniques], dtype=np.int32)[inverse]
+        return codes
+
+    def decode(self, codes):
+        return np.array(self.values + [None], dtype=object)[codes]
+
+    def codes(self, values):
+        return [self.lookup[v] for v in values if v in self.lookup]
+
+
+class TrailStore:
+    #trails has the COLUMNS of snapshot.trail_rows(), one row per trail
+
+    def __init__(self, trails):
+        self.lock = threading.Lock()
+        self.positions = {}
+        self.alive = np.empty(0, dtype=bool)
+        self.columns = {name: np.empty(0, dtype=dtype) for name, dtype in NUMERIC.items()}
+        self.columns['trailName'] = np.empty(0, dtype=object)
+        self.categories = {name: Categories() for name in CATEGORICAL}
+        self.columns.update({name: np.empty(0, dtype=np.int32) for name in CATEGORICAL})
+        self.ranks = ranking.RankOrder()
+        self.append(trails)
+
+    def append(self, trails):
+        trails = trails.drop_duplicates('trailID', keep='last').reset_index(drop=True)
+        start = len(self.alive)
+        added = {name: pd.to_numeric(trails[name], errors='coerce').to_numpy(dtype=dtype)
+                 for name, dtype in NUMERIC.items()}
+        added['trailName'] = np.array([None if pd.isna(n) else sys.intern(str(n)) for n in trails['trailName']], dtype=object)
+        for name in CATEGORICAL:
+            added[name] = self.categories[name].encode(trails[name])
+        for name, values in added.items():
+            self.columns[name] = np.concatenate([self.columns[name], values])
+        self.ranks.insert(added['rank'], start)
+
+        alive = np.concatenate([self.alive, np.ones(len(trails), dtype=bool)])
+        trail_ids = trails['trailID'].tolist()
+        for trail_id in trail_ids:
+            if trail_id in self.positions:
+                alive[self.positions[trail_id]] = False
+        self.positions.update(zip(trail_ids, range(start, start+len(trails))))
+        self.alive = alive
+
+    def refresh(self, trail_ids, trails):
+        #Drops trail_ids, then adds back the ones still in the database (the rows passed in)
+        with self.lock:
+            alive = self.alive.copy()
+            for trail_id in trail_ids:
+                position = self.positions.pop(trail_id, None)
+                if position is not None:
+                    alive[position] = False
+            self.alive = alive
+            if len(trails):
+                self.append(trails)
+
+    ## Masks ##
+
+    def isin(self, column, values):
+        with self.lock:
+            if column in self.categories:
+                return self.alive & np.isin(self.columns[column], self.categories[column].codes(values))
+            return self.alive & np.isin(self.columns[column], values)
+
+    def best(self, trail_ids, limit=None):
+        #The limit best ranked of trail_ids (all for None), best first
+        with self.lock:
+            mask = np.zeros(len(self.alive), dtype=bool)
+            mask[[self.positions[t] for t in trail_ids if t in self.positions]] = True
+            return self.columns['trailID'][self.ranks.top(mask & self.alive, limit)].tolist()
+
+    def select(self, mask, columns, limit=None):
+        #DataFrame of the limit best ranked masked trails (all for None), best first,
+        #categoricals decoded back to their values
+        with self.lock:
+            positions = self.ranks.top(mask & self.alive, limit)
+            found = {}
+            for name in columns:
+                values = self.columns[name][positions]
+                found[name] = self.categories[name].decode(values) if name in self.categories else values
+            return pd.DataFrame(found, columns=columns)
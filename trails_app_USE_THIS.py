@@ -1,9 +1,6 @@
 import streamlit as st 
 import pandas as pd
-import sqlite3
-
-conn = sqlite3.connect('project')
-c = conn.cursor()
+import repository as repo
 
 
 st.set_page_config(
@@ -32,7 +29,7 @@ st.title(":green[RouteRanger - A Trail Finder App]")
 
 ## Web application starts here
 
-menu = ["Home", "Search", "Add Trails", "Trails Maintenance"]
+menu = ["Home", "Search", "Statistics", "Add Trails", "Trails Maintenance", "Review Changes", "Refresh Data", "Performance"]
 choice = st.sidebar.selectbox("MENU", menu)
 
 if choice == "Home":
@@ -47,9 +44,9 @@ if choice == "Home":
                 Contribute your favorite trails, discover new adventures, and connect with like-minded 
                 individuals who share your love for the great outdoors.""")
     
-    st.subheader("All Trails Overview 🏕️")
-    all = 'SELECT trailName, parkName, elevation_feet, length, difficulty, routeType, reviews FROM Trails t JOIN NationalParks p ON t.parkID=p.parkID LIMIT 10'
-    display = pd.read_sql_query(all, con=conn)
+    st.subheader("Top Trails 🏕️")
+    st.caption("Best rated first, with ratings from only a few reviews counting for less")
+    display = repo.home_overview()
     st.dataframe(display, column_config={'trailName':'Trail', 'parkName':'National Park',
                                          'length': st.column_config.NumberColumn('Length',format="%.2f mi"),
                                          'elevation_feet':st.column_config.NumberColumn('Elevation',
@@ -57,43 +54,67 @@ if choice == "Home":
                                          'difficulty': st.column_config.NumberColumn('Difficulty',
                                                                                      help="1 - Easy, 2 - Moderate, 3 - Hard, 4 - Strenuous, 5 - Very challenging",
                                                                                        format="%d 🥾"),
-                                         'reviews':st.column_config.NumberColumn('Reviews', format="%d 💬")},
+                                         'reviews':st.column_config.NumberColumn('Reviews', format="%d 💬"),
+                                         'avg_rating':st.column_config.NumberColumn('Rating', format="%.1f ⭐")},
                  hide_index=True)
     
 elif choice=="Search":   
     st.subheader("Find trail🔎")
-    search_choice = st.radio("Search by",("key word", "state","national park", "difficulty"))
+    search_choice = st.radio("Search by",("key word", "state","national park", "difficulty", "filters", "features & activities", "near me"))
     
     if search_choice=="key word":
-        search_term = st.text_input("Enter key word")
-        get_trail='SELECT trailName, parkName, elevation_feet, length, difficulty, routeType FROM Trails t JOIN NationalParks p ON t.parkID=p.parkID WHERE trailName LIKE "%{}%"'.format(search_term)
-        result = pd.read_sql_query(get_trail, con=conn)
-        st.dataframe(result, column_config={'trailName':'Trail', 'parkName':'National Park',
+        search_term = st.text_input("Enter key word", help="Searches trail, park, area and state names, features and activities")
+        completions = repo.name_completions(search_term) if search_term.strip() else []
+        if completions and search_term not in completions:
+            completed = st.selectbox("Complete to", completions, index=None, placeholder="Trail and park names starting with that")
+            if completed:
+                search_term = completed
+        result = repo.keyword_search(search_term)
+        st.dataframe(result, column_config={'trailName':'Trail', 'parkName':'National Park', 'match':'Matched',
                                             'length': st.column_config.NumberColumn('Length',format="%.1f mi"),
                                          'elevation_feet':st.column_config.NumberColumn('Elevation',
                                                                                         format="%d ft"),
                                          'difficulty': st.column_config.NumberColumn('Difficulty',
                                                                                      help="1 - Easy, 2 - Moderate, 3 - Hard, 4 - Strenuous, 5 - Very challenging",
                                                                                        format="%d 🥾")})
-    
+        if result.empty and search_term.strip():
+            names, close_trails = repo.fuzzy_search(search_term)
+            places = names[names['kind'] != 'trail']
+            if names.empty:
+                st.markdown("No trail, park or area name is close to that either.")
+            else:
+                st.markdown("No exact matches. Did you mean:")
+                for place in places.itertuples():
+                    st.markdown(f"- **{place.name}** ({place.kind})")
+                if not close_trails.empty:
+                    st.dataframe(close_trails, column_config={'trailName':'Trail', 'parkName':'National Park', 'state':'State',
+                                                   'length': st.column_config.NumberColumn('Length',format="%.1f mi"),
+                                                   'elevation_feet':st.column_config.NumberColumn('Elevation',
+                                                                                                  format="%d ft"),
+                                                   'difficulty': st.column_config.NumberColumn('Difficulty',
+                                                                                               help="1 - Easy, 2 - Moderate, 3 - Hard, 4 - Strenuous, 5 - Very challenging",
+                                                                                                 format="%d 🥾")},
+                                 hide_index=True)
+            result = close_trails
+        if not result.empty:
+            similar_to = st.selectbox("Show trails similar to", result['trailName'].unique(), index=None)
+            if similar_to:
+                st.dataframe(repo.similar_trails(similar_to), column_config={'trailName':'Trail', 'parkName':'National Park', 'state':'State',
+                                             'length': st.column_config.NumberColumn('Length',format="%.1f mi"),
+                                             'elevation_feet':st.column_config.NumberColumn('Elevation',
+                                                                                            format="%d ft"),
+                                             'difficulty': st.column_config.NumberColumn('Difficulty',
+                                                                                         help="1 - Easy, 2 - Moderate, 3 - Hard, 4 - Strenuous, 5 - Very challenging",
+                                                                                           format="%d 🥾"),
+                                             'similarity': st.column_config.ProgressColumn('Similarity', min_value=0, max_value=1, format="%.2f")},
+                             hide_index=True)
+
     elif search_choice=='state':
-        all_states = c.execute('SELECT DISTINCT(state) FROM Location')
-        state_menu = []
-        for r in all_states:
-            r=str(r).replace(',','').replace('(', '').replace(')', '').replace("'", "")
-            state_menu.append(r)
-        state_choice = st.multiselect("Select state", state_menu)
-        
-        # Check if state_choice is a list or a string
-        if isinstance(state_choice, list):
-        # Convert list to a string with comma-separated values
-            states = ', '.join([f'"{state}"' for state in state_choice])
-        else:
-        # Wrap the single state_choice in quotes
-            states = f'"{state_choice}"'
+        state_choice = st.multiselect("Select state", repo.state_list())
     
-        get_trail=f'SELECT trailName, area_name, state, elevation_feet, length, difficulty, routeType FROM Trails t JOIN Location l ON t.trailID=l.trailID WHERE state IN ({states})'
-        result = pd.read_sql_query(get_trail, con=conn)
+        result = repo.state_search(state_choice)
+        if len(result) == repo.STORE_LIMIT:
+            st.caption(f'Showing the {repo.STORE_LIMIT} best ranked trails')
         st.dataframe(result, column_config={'trailName':'Trail', 'area_name':'Area', 'state':'State',
                                          'length': st.column_config.NumberColumn('Length',format="%.1f mi"),
                                          'elevation_feet':st.column_config.NumberColumn('Elevation',
@@ -103,21 +124,11 @@ elif choice=="Search":
                                                                                        format="%d 🥾")})
         
     elif search_choice =="national park":
-        all_parks = c.execute('SELECT DISTINCT(parkName) FROM NationalParks')
-        park_menu = []
-        for r in all_parks:
-            r=str(r).replace(',','').replace('(', '').replace(')', '').replace("'", "")
-            park_menu.append(r)
-        park_choice = st.multiselect("Select national park", park_menu)
-        
-        if isinstance(park_choice, list):
-            # Convert list to a string with comma-separated values
-            parks = ', '.join([f'"{park}"' for park in park_choice])
-        else:
-            parks = f'"park_choice"'
+        park_choice = st.multiselect("Select national park", repo.park_list())
     
-        get_trail=f'SELECT trailName, parkName, elevation_feet, length, difficulty, routeType FROM Trails t JOIN NationalParks p ON t.parkID=p.parkID WHERE parkName IN ({parks})'
-        result = pd.read_sql_query(get_trail, con=conn)
+        result = repo.park_search(park_choice)
+        if len(result) == repo.STORE_LIMIT:
+            st.caption(f'Showing the {repo.STORE_LIMIT} best ranked trails')
         st.dataframe(result, column_config={'trailName':'Trail', 'parkName':'National Park',
                                          'length': st.column_config.NumberColumn('Length',format="%.1f mi"),
                                          'elevation_feet':st.column_config.NumberColumn('Elevation',
@@ -141,10 +152,10 @@ elif choice=="Search":
             levels = [1,2,3,4,5]
             level = st.selectbox("Select difficulty level", levels)
             
-        get_trail='SELECT trailName, parkName, elevation_feet, length, difficulty, routeType FROM Trails t JOIN NationalParks p ON t.parkID=p.parkID WHERE difficulty="{}"'.format(level)
-        for n_trails in c.execute('SELECT COUNT(*) FROM Trails WHERE difficulty="{}"'.format(level)):
-            st.write(n_trails[0], 'total trails with difficulty level of', level)
-        result = pd.read_sql_query(get_trail, con=conn)
+        st.write(repo.difficulty_count(level), 'total trails with difficulty level of', level)
+        result = repo.difficulty_search(level)
+        if len(result) == repo.STORE_LIMIT:
+            st.caption(f'Showing the {repo.STORE_LIMIT} best ranked trails')
         st.dataframe(result, column_config={'trailName':'Trail', 'parkName':'National Park',
                                          'length': st.column_config.NumberColumn('Length',format="%.1f mi"),
                                          'elevation_feet':st.column_config.NumberColumn('Elevation',
@@ -153,45 +164,136 @@ elif choice=="Search":
                                                                                      help="1 - Easy, 2 - Moderate, 3 - Hard, 4 - Strenuous, 5 - Very challenging",
                                                                                        format="%d 🥾")})
 
+    elif search_choice =="filters":
+        # Combine any of the filters below. The number next to each choice is how many trails
+        # it would match with the other filters as they are, read from the in-memory facet index.
+        facet_labels = {'state': 'State', 'park': 'National park', 'difficulty': 'Difficulty',
+                        'routeType': 'Route type', 'feature': 'Features', 'activity': 'Activities'}
+        limits = repo.facet_limits()
+        col1, col2 = st.columns(2)
+        with col1:
+            length_range = st.slider("Length (mi)", 0.0, limits['length'][1], (0.0, limits['length'][1]))
+        with col2:
+            elevation_range = st.slider("Elevation (ft)", 0.0, limits['elevation'][1], (0.0, limits['elevation'][1]))
+        selected = {facet: st.session_state.get(f'facet {facet}', []) for facet in facet_labels}
+        total, result, counts = repo.faceted_search(
+            selected,
+            None if length_range == (0.0, limits['length'][1]) else length_range,
+            None if elevation_range == (0.0, limits['elevation'][1]) else elevation_range)
+        for col, band in zip((col1, col2), ('length_band', 'elevation_band')):
+            col.caption(' · '.join(f'{value}: {n}' for value, n in counts[band].items() if n))
+
+        cols = st.columns(3)
+        for i, (facet, label) in enumerate(facet_labels.items()):
+            with cols[i % 3]:
+                st.multiselect(label, sorted(counts[facet], key=str), key=f'facet {facet}',
+                               format_func=lambda value, c=counts[facet]: f'{value} ({c[value]})')
+
+        st.write(total, 'trails match' + (f', showing the {len(result)} best ranked' if total > len(result) else ''))
+        st.dataframe(result, column_config={'trailName':'Trail', 'parkName':'National Park', 'state':'State',
+                                         'length': st.column_config.NumberColumn('Length',format="%.1f mi"),
+                                         'elevation_feet':st.column_config.NumberColumn('Elevation',
+                                                                                        format="%d ft"),
+                                         'difficulty': st.column_config.NumberColumn('Difficulty',
+                                                                                     help="1 - Easy, 2 - Moderate, 3 - Hard, 4 - Strenuous, 5 - Very challenging",
+                                                                                       format="%d 🥾"),
+                                         'reviews':st.column_config.NumberColumn('Reviews', format="%d 💬"),
+                                         'avg_rating':st.column_config.NumberColumn('Rating', format="%.1f ⭐")},
+                     hide_index=True)
+
+    elif search_choice =="features & activities":
+        expression = st.text_input("Features and activities", placeholder="dogs-leash AND waterfall AND NOT camping",
+                                   help="Combine tags with AND, OR, NOT and parentheses. Tags next to each other must all match.")
+        st.caption('Tags: ' + ', '.join(repo.tag_list()))
+        if expression.strip():
+            try:
+                total, result = repo.tag_search(expression)
+            except ValueError as error:
+                st.error(f'Could not read that search: {error}')
+            else:
+                st.write(total, 'trails match' + (f', showing the {len(result)} best ranked' if total > len(result) else ''))
+                st.dataframe(result, column_config={'trailName':'Trail', 'parkName':'National Park', 'state':'State',
+                                                 'length': st.column_config.NumberColumn('Length',format="%.1f mi"),
+                                                 'elevation_feet':st.column_config.NumberColumn('Elevation',
+                                                                                                format="%d ft"),
+                                                 'difficulty': st.column_config.NumberColumn('Difficulty',
+                                                                                             help="1 - Easy, 2 - Moderate, 3 - Hard, 4 - Strenuous, 5 - Very challenging",
+                                                                                               format="%d 🥾"),
+                                                 'reviews':st.column_config.NumberColumn('Reviews', format="%d 💬"),
+                                                 'avg_rating':st.column_config.NumberColumn('Rating', format="%.1f ⭐")},
+                             hide_index=True)
+
+    elif search_choice =="near me":
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            lat = st.number_input("Latitude", min_value=-90.0, max_value=90.0, value=44.4280, format="%.5f")
+        with col2:
+            lng = st.number_input("Longitude", min_value=-180.0, max_value=180.0, value=-110.5885, format="%.5f")
+        with col3:
+            near_by = st.radio("Show", ("nearest trails", "trails within a radius"))
+        if near_by == "nearest trails":
+            k = st.slider("How many trails", 1, 100, 10)
+            result = repo.trails_nearest(lat, lng, k)
+        else:
+            radius = st.slider("Radius in miles", 1, 200, 25)
+            result = repo.trails_within(lat, lng, radius)
+        st.dataframe(result.drop(columns=['lat', 'lng']), column_config={'distance': st.column_config.NumberColumn('Distance',format="%.1f mi"),
+                                         'trailName':'Trail', 'parkName':'National Park', 'area_name':'Area', 'state':'State',
+                                         'length': st.column_config.NumberColumn('Length',format="%.1f mi"),
+                                         'elevation_feet':st.column_config.NumberColumn('Elevation',
+                                                                                        format="%d ft"),
+                                         'difficulty': st.column_config.NumberColumn('Difficulty',
+                                                                                     help="1 - Easy, 2 - Moderate, 3 - Hard, 4 - Strenuous, 5 - Very challenging",
+                                                                                       format="%d 🥾")},
+                     hide_index=True)
+
+if choice == "Statistics":
+    st.subheader("Trail statistics 📊")
+    scope = st.radio("Per", ["national park", "state"], horizontal=True)
+    # Read from the per-park and per-state rollups, which are kept up to date as trails change
+    groups, totals = repo.trail_statistics('park' if scope == "national park" else 'state')
+    st.write(int(groups['trails'].sum()), 'trails in', len(groups), 'national parks' if scope == "national park" else 'states')
+
+    cols = st.columns(3)
+    for col, (measure, label) in zip(cols, [('difficulty', 'Difficulty'), ('length', 'Length'), ('elevation', 'Elevation')]):
+        with col:
+            st.markdown(f':red[{label}]')
+            st.bar_chart(totals[measure], x_label=label, y_label='Trails', sort=False, height=250)
+
+    st.dataframe(groups, column_config={'name': 'National Park' if scope == "national park" else 'State',
+                                        'trails': st.column_config.NumberColumn('Trails', format="%d"),
+                                        'difficulty': st.column_config.NumberColumn('Avg difficulty', format="%.1f 🥾"),
+                                        'difficulty_histogram': st.column_config.BarChartColumn('Difficulty', help=' · '.join(totals['difficulty'].index), y_min=0),
+                                        'length': st.column_config.NumberColumn('Avg length', format="%.1f mi"),
+                                        'length_histogram': st.column_config.BarChartColumn('Length', help=' · '.join(totals['length'].index), y_min=0),
+                                        'elevation_feet': st.column_config.NumberColumn('Avg elevation', format="%d ft"),
+                                        'elevation_histogram': st.column_config.BarChartColumn('Elevation', help=' · '.join(totals['elevation'].index), y_min=0)},
+                 hide_index=True)
 
 if choice == 'Add Trails':
     st.subheader('Add a new trail')
-    id = []
-    for i in c.execute('SELECT trailID FROM Trails'):
-        id.append(i[0])
-    id.sort()
-    new_trail_id = id[-1]+1
     
     new_trail_name = st.text_input("Enter trail name")
     new_elevation = st.text_input("Enter trail elevation in feet (number only)")
     new_length = st.text_input("Enter trail length in mile (number only)")
     new_difficulty = st.selectbox("Select difficulty (1 to 5, where 5 is the most difficult)", [1,2,3,4,5])
     
-    park_menu = []
-    new_parkID=''
-    for p in c.execute('SELECT DISTINCT parkName FROM NationalParks'):
-        park_menu.append(p[0])
-    park_choice = st.selectbox("Select national park", park_menu)
-    for i in c.execute('SELECT parkID FROM NationalParks WHERE parkName=?', (park_choice,)):
-        new_parkID=i[0]
+    park_start = st.text_input("Find national park", placeholder="Start of the park name")
+    park_choice = st.selectbox("Select national park", repo.park_completions(park_start))
+    new_parkID = None if park_choice is None else repo.park_id(park_choice)
+    if new_parkID is None:
+        st.caption('No national park starts with that, try a shorter start')
     
     new_route_type = st.selectbox("Select route type", ['out and back', 'loop', 'point to point'])
     
-    if st.button('Add'):
-        c.execute('SELECT trailName FROM Trails WHERE trailName=?', (new_trail_name,))
-        result=c.fetchone()
-        if result is not None:
+    if st.button('Add', disabled=new_parkID is None):
+        new_trail_id = repo.add_trail(new_trail_name, new_length, new_elevation, new_difficulty,
+                                      new_route_type, new_parkID)
+        if new_trail_id is None:
             st.write('This trail already exists. Please use "search" to find this trail')
         else:
-            insert_query='INSERT INTO Trails(trailID, trailName, length, elevation_feet, difficulty, \
-            routeType, parkID) VALUES (?,?,?,?,?,?,?)'
-            c.execute(insert_query,(new_trail_id, new_trail_name, new_length, new_elevation, new_difficulty, 
-                                    new_route_type, new_parkID))
-            conn.commit()
             st.success('Thanks! This trail is added to our database', icon="✅")
-            new_trail = 'SELECT trailName, parkName, elevation_feet, length, difficulty, routeType FROM Trails t JOIN NationalParks p ON t.parkID=p.parkID WHERE \
-                trailName="{}"'.format(new_trail_name)
-            display = pd.read_sql_query(new_trail, con=conn)
+            display = repo.trail_by_name(new_trail_name)
             st.write(display)
 
 
@@ -201,10 +303,57 @@ if choice == "Trails Maintenance":
     st.warning("Double-check the facts and make sure everything's entered correctly because our entire community relies on this database :)", icon="⚠️")
     st.info('Pro Tip: Click anywhere in the table and press Ctrl-F to search for the trail that needs to be updated or deleted', icon="⭐")
     # df = pd.read_csv('trails.csv')
-    query = 'SELECT * FROM Trails'
-    df = pd.read_sql_query(query, con=conn)
-    
-    edited_df = st.data_editor(df, key='data_editor', disabled=['trailID', 'parkID', 'reviews'], hide_index=True)
+    # Only one page of trails is read and sent to the browser. Pages are keyset-paginated
+    # by the sort column, and filtering and sorting happen in the database.
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        name_filter = st.text_input("Trail name")
+        page_size = st.selectbox("Rows per page", [25, 50, 100, 250], index=1)
+    with col2:
+        park_filter = st.selectbox("National park", ["All parks"] + repo.park_list())
+        difficulty_filter = st.selectbox("Difficulty", ["All", 1, 2, 3, 4, 5])
+    with col3:
+        sort = st.selectbox("Sort by", repo.MAINTENANCE_SORTS)
+        descending = st.radio("Order", ("ascending", "descending"), horizontal=True) == "descending"
+
+    # Changing any control starts again from the first page
+    view = (name_filter, park_filter, difficulty_filter, sort, descending, page_size)
+    if st.session_state.get('maintenance_view') != view:
+        st.session_state['maintenance_view'] = view
+        st.session_state['maintenance_cursors'] = [None]
+    cursors = st.session_state['maintenance_cursors']
+
+    df = repo.trails_page(page_size, sort=sort, descending=descending, after=cursors[-1], name=name_filter,
+                          park_id=None if park_filter == "All parks" else repo.park_id(park_filter),
+                          difficulty=None if difficulty_filter == "All" else difficulty_filter)
+
+    page_key = f'data_editor {view} {cursors[-1]}'
+    parks = repo.park_names()
+    # Only the columns apply_updates writes can be changed
+    edited_df = st.data_editor(df, key=page_key, hide_index=True,
+                               disabled=[c for c in df.columns if c not in repo.EDITABLE_COLUMNS],
+                               num_rows="dynamic",
+                               column_config={'parkID': st.column_config.SelectboxColumn(
+                                   'National park', options=list(parks),
+                                   format_func=lambda p: parks.get(p, p), required=True)})
+
+    # Edits are kept per page, by trail ID, so they survive moving between pages
+    page_edits = st.session_state.setdefault('maintenance_edits', {})
+    editor = st.session_state[page_key]
+    page_edits[page_key] = {
+        'edited': {int(df['trailID'].iloc[row]): change for row, change in editor['edited_rows'].items()},
+        'added': [row for row in editor['added_rows'] if row],
+        'deleted': [int(df['trailID'].iloc[row]) for row in editor['deleted_rows']],
+    }
+
+    def next_page():
+        last = df[sort].tolist()[-1]
+        cursors.append((None if pd.isna(last) else last, df['trailID'].tolist()[-1]))
+
+    col1, col2, col3 = st.columns([1, 1, 6])
+    col1.button('Previous', on_click=cursors.pop, disabled=len(cursors) == 1)
+    col2.button('Next', on_click=next_page, disabled=len(df) < page_size)
+    col3.caption(f'Page {len(cursors)}')
     
     del_trailID = st.text_input('Copy and Paste trail ID that needs to be remove:')
     del_trailID = del_trailID.replace(',', '').replace('"', '')
@@ -212,20 +361,120 @@ if choice == "Trails Maintenance":
     if st.button('Delete'):
         try:
             del_trailID = int(del_trailID)
-            c.execute('DELETE FROM Trails WHERE trailID=?', (del_trailID,))
-            conn.commit()
-            if c.rowcount > 0:
+            if repo.delete_trail(del_trailID) > 0:
                 st.write('Thanks! The trail with ID', del_trailID, 'has been removed from our database.')
             else:
                 st.write('No rows found with the provided trail ID:', del_trailID)
         except ValueError:
             st.error('Please enter a valid trail ID', icon="🚨")
     
-    changes = st.session_state["data_editor"]
+    changes = {'edited': {}, 'added': [], 'deleted': []}
+    for edits in page_edits.values():
+        changes['edited'].update(edits['edited'])
+        changes['added'] += edits['added']
+        changes['deleted'] += edits['deleted']
     st.write("Here's what you've changed:")
     st.caption('_Once you make the changes, we will review them and update our database_')
     st.write(changes)
-## Changes made by users are saved as a JSON object into varibale 'changes' and will be reviewed by admin team 
-#  before making permanent changes into database, to avoid misuse of language. 
-    
-    
+
+    def submit_changes():
+        st.session_state['maintenance_submitted'] = repo.queue_updates(changes['edited'], changes['added'], changes['deleted'])
+        # Start every page editor from the database again
+        for key in page_edits:
+            st.session_state.pop(key, None)
+        page_edits.clear()
+
+    has_changes = any(changes.values())
+    st.button('Submit changes for review', on_click=submit_changes, disabled=not has_changes)
+    if st.session_state.pop('maintenance_submitted', None):
+        st.success('Thanks! Your changes are queued for review', icon="✅")
+## Changes made by users are saved as JSON into the TrailsUpdates table and reviewed by the admin team
+#  on the "Review Changes" page before making permanent changes into database, to avoid misuse of language.
+
+
+if choice == "Review Changes":
+    st.subheader("Review community changes")
+    st.caption('_Admins only: approved changes are applied to the database in one batch_')
+
+    def review(action, update_ids):
+        if action == 'apply':
+            applied, rejected = repo.apply_updates(update_ids)
+            st.session_state['review_message'] = f'{applied} changes applied' + (
+                f', {rejected} rejected (a new trail with no national park or a name that exists, or a trail that was deleted)' if rejected else '')
+        else:
+            st.session_state['review_message'] = f'{repo.reject_updates(update_ids)} changes rejected'
+        st.session_state.pop('review_editor', None)
+
+    if 'review_message' in st.session_state:
+        st.success(st.session_state.pop('review_message'), icon="✅")
+    pending = repo.pending_updates()
+    if pending.empty:
+        st.write('Nothing to review right now.')
+    else:
+        pending.insert(0, 'approve', False)
+        reviewed = st.data_editor(pending, key='review_editor', hide_index=True,
+                                  disabled=['updateID', 'trailID', 'trailName', 'content', 'submitted'],
+                                  column_config={'approve': st.column_config.CheckboxColumn('Select'),
+                                                 'trailName': 'Trail', 'content': 'Change'})
+        selected = reviewed.loc[reviewed['approve'], 'updateID'].tolist()
+        col1, col2, col3 = st.columns([1, 1, 4])
+        col1.button('Apply selected', on_click=review, args=('apply', selected), disabled=not selected)
+        col2.button('Reject selected', on_click=review, args=('reject', selected), disabled=not selected)
+        col3.button(f'Apply all {len(pending)}', on_click=review, args=('apply', pending['updateID'].tolist()))
+
+
+if choice == "Refresh Data":
+    st.subheader("Refresh the trail data")
+    st.caption('_Admins only: the csv is loaded into a copy of the database and swapped in at the end, so the app keeps working meanwhile_')
+
+    def start_refresh(csv_path, rebuild, prune):
+        try:
+            repo.start_refresh(csv_path, rebuild, prune)
+        except ValueError as error:
+            st.session_state['refresh_error'] = str(error)
+
+    csv_path = st.text_input('CSV file on the server', repo.CSV_PATH)
+    rebuild = st.checkbox('Rebuild from scratch (also drops trails added in the app)')
+    prune = st.checkbox('Remove trails that are no longer in the csv')
+    job = repo.latest_refresh()
+    running = job is not None and job.running()
+    st.button('Start refresh', on_click=start_refresh, args=(csv_path, rebuild, prune), disabled=running)
+    if 'refresh_error' in st.session_state:
+        st.error(st.session_state.pop('refresh_error'), icon="🚨")
+
+    @st.fragment(run_every=1 if running else None)
+    def refresh_progress():
+        job = repo.latest_refresh()
+        if job is None:
+            st.write('No refresh has run since the app started.')
+            return
+        st.progress(job.fraction(), text=f'Stage: {job.stage}')
+        if job.timings:
+            st.caption(' · '.join(f'{stage} {seconds:.1f}s' for stage, seconds in job.timings.items()))
+        if job.stage == 'done':
+            st.success('{new} new, {changed} changed, {unchanged} unchanged, {pruned} pruned trails'.format(**job.stats), icon="✅")
+        elif job.stage == 'failed':
+            st.error(job.error, icon="🚨")
+        if running and not job.running():
+            #Finished since the page was drawn: draw it again so the button is enabled
+            st.rerun()
+
+    refresh_progress()
+
+
+if choice == "Performance":
+    st.subheader("Query performance")
+    st.caption(f'_Admins only: timings of the last {repo.QUERY_WINDOW} database calls and searches in this app process, slowest total first_')
+
+    summary = repo.query_summary()
+    if summary.empty:
+        st.write('No queries recorded yet.')
+    else:
+        st.dataframe(summary, hide_index=True,
+                     column_config={'fingerprint': st.column_config.TextColumn('Query', width='large'),
+                                    **{c: st.column_config.NumberColumn(c, format='%.2f') for c in
+                                       ['p50_ms', 'p95_ms', 'p99_ms', 'max_ms', 'total_ms', 'rows', 'vm_steps', 'statements']}})
+    col1, col2 = st.columns([1, 4])
+    col1.button('Reset', on_click=repo.reset_query_stats)
+    dump = col2.checkbox(f'Also write every call to {repo.QUERY_LOG}', value=repo.query_stats().dump_path is not None)
+    repo.dump_queries(repo.QUERY_LOG if dump else None)